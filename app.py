@@ -1,18 +1,57 @@
-from flask import Flask, render_template, jsonify, request, session, redirect, url_for
+from flask import (Flask, render_template, jsonify, request, session, redirect, url_for, Response, stream_with_context,
+                   send_file, make_response)
+from jinja2 import ChoiceLoader, FileSystemLoader, FileSystemBytecodeCache
 from flask_cors import CORS
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 import sqlite3
 import json
+import re
 import requests
 import os
 import bcrypt
 import secrets
+import time
 from datetime import datetime, date, timedelta
-from database import init_database, insert_default_data, migrate_database
+from functools import wraps
+from database import init_database, insert_default_data, migrate_database, DATABASE_PATH
+from task_index import find_similar_tasks, refresh_tasks, invalidate_user_index, task_text, DUPLICATE_THRESHOLD
+from priority_engine import get_priority_suggestions
+from calendar_range import get_calendar_range, prefetch_adjacent, BUCKET_EXPRESSIONS, MAX_RANGE_DAYS
+from metrics import (registry, route_summaries, begin_request, end_request, request_elapsed, record_cache,
+                     InstrumentedConnection, AI_PROVIDER_LATENCY, add_statement_listener)
+from sql_profiler import profiler as sql_profiler
+from traffic_capture import recorder as traffic_recorder
+from tracing import (start_trace, end_trace, current_trace, traced, record_statement, instrument_requests,
+                     store as trace_store)
+from profiling import (start_request_profile, current_request_profile, finish_request_profile, list_profiles,
+                       profile_file_path, format_pstats, set_thread_route, clear_thread_route,
+                       sampler as sampling_profiler, SAMPLING_ENABLED)
+from memory_monitor import (register_cache, memory_report, take_snapshot, get_snapshot, diff_snapshots,
+                            MemorySnapshot, start_tracemalloc, stop_tracemalloc, parse_tracemalloc_frames,
+                            watchdog as memory_watchdog)
+from recurrence import normalize_rrule, load_recurring_occurrences, is_occurrence
+from schedule_index import (get_schedule_index, plan_auto_schedule, parse_duration, parse_day_window, parse_task_ids,
+                            DEFAULT_DURATION_MINUTES, DEFAULT_DAY_START, DEFAULT_DAY_END)
+from batch import parse_batch, execute_batch, shared_connection, is_subrequest
+from change_feed import feed as change_feed, task_change_events, RESYNC, CHANGE_FEED_HEARTBEAT
+from task_encoding import (default_encoder, encoder_from_args, select_clause, join_clause, TASK_DEFAULT_FIELDS,
+                           SEARCH_DEFAULT_FIELDS, CALENDAR_WEEK_DEFAULT_FIELDS)
+from compression import compress_response, send_static
+from asset_pipeline import load_manifest, resolve_static, BUILD_TEMPLATE_DIR, IMMUTABLE_MAX_AGE, SERVICE_WORKER
+from idempotency import (idempotent, current_key as current_idempotency_key, request_fingerprint,
+                         store as idempotency_store)
 
 app = Flask(__name__)
 app.secret_key = secrets.token_hex(32)  # 生成安全的密钥
-CORS(app)
+CORS(app, expose_headers=['X-Trace-Id', 'Idempotent-Replayed'])
+
+# 指标接口的访问令牌；未设置时只有管理员可以访问
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# 本地调试时公开指标接口（不要在生产环境开启）
+METRICS_PUBLIC = os.environ.get('METRICS_PUBLIC', 'false').lower() in ('1', 'true', 'yes')
+
+# 可访问管理接口的用户名（逗号分隔）；默认为空，须显式配置，避免任何人注册同名账号获得管理权限
+ADMIN_USERS = {name.strip() for name in os.environ.get('ADMIN_USERS', '').split(',') if name.strip()}
 
 # 配置Flask-Login
 login_manager = LoginManager()
@@ -88,11 +127,109 @@ init_database()
 migrate_database()  # 迁移数据库添加时间字段
 insert_default_data()
 
-def get_db_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect('settings.db')
+def open_db_connection():
+    """新建数据库连接"""
+    conn = sqlite3.connect(DATABASE_PATH, factory=InstrumentedConnection)
     conn.row_factory = sqlite3.Row
-    return conn
+    return sql_profiler.attach(conn)
+
+def get_db_connection():
+    """获取数据库连接，批量请求的子请求中返回共享连接"""
+    shared = shared_connection()
+    if shared is not None:
+        return shared
+    return open_db_connection()
+
+# SQL分析器通过计时包装器接收每条语句的耗时
+add_statement_listener(sql_profiler.on_statement)
+# 请求追踪：数据库语句和出站HTTP调用自动记录为span
+add_statement_listener(record_statement)
+instrument_requests()
+
+# 常驻采样分析器，按路由持续统计热点调用栈
+if SAMPLING_ENABLED:
+    sampling_profiler.start()
+
+# 内存看门狗（MEMORY_WATCHDOG_INTERVAL大于0时启用）
+memory_watchdog.start()
+
+# 变更推送：轮询变更表转发其他进程发布的事件
+change_feed.start(open_db_connection)
+
+# 幂等键：定时清理过期的键
+idempotency_store.start(open_db_connection)
+
+@app.before_request
+def start_request_metrics():
+    """记录请求开始时间，重置本请求的数据库统计"""
+    begin_request()
+
+@app.before_request
+def start_request_trace():
+    """开始请求追踪，沿用调用方传入的X-Trace-Id"""
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    start_trace(f'{request.method} {route}', request.headers.get('X-Trace-Id'))
+    set_thread_route(f'{request.method} {route}')
+
+@app.teardown_request
+def finish_request_trace(error=None):
+    """请求上下文结束时（流式响应在生成完毕后）结束追踪"""
+    if is_subrequest():
+        return
+    trace = current_trace()
+    if trace is not None and error is not None:
+        trace.attributes['error'] = type(error).__name__
+    end_trace()
+    clear_thread_route()
+
+@app.before_request
+def start_requested_profile():
+    """管理员请求带X-Profile头时分析本次请求（未带该头时没有额外开销）"""
+    mode = request.headers.get('X-Profile')
+    if not mode or not is_admin_user():
+        return
+    start_request_profile(mode, {
+        'route': request.url_rule.rule if request.url_rule else 'unmatched',
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'user_id': get_current_user_id(),
+        'started_at': datetime.now().isoformat()
+    })
+
+@app.teardown_request
+def finish_requested_profile(error=None):
+    if is_subrequest():
+        return
+    if current_request_profile() is not None:
+        finish_request_profile()
+
+@app.after_request
+def record_request_metrics(response):
+    """按路由模板记录延迟、状态码、响应大小和数据库开销"""
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    size = None if response.is_streamed else response.calculate_content_length()
+    end_request(route, request.method, response.status_code, size)
+    trace = current_trace()
+    if trace is not None:
+        trace.attributes.update({'path': request.path, 'status': response.status_code,
+                                 'user_id': get_current_user_id()})
+        response.headers['X-Trace-Id'] = trace.trace_id
+    profile = current_request_profile()
+    if profile is not None:
+        response.headers['X-Profile-Id'] = profile.profile_id
+    return response
+
+@app.after_request
+def compress_dynamic_response(response):
+    """按Accept-Encoding压缩响应体（在流量录制之后、记录响应大小之前执行）"""
+    return compress_response(response)
+
+@app.after_request
+def capture_traffic(response):
+    """开启流量录制时记录脱敏后的请求摘要（后注册的钩子先执行，此时请求计时尚未结束）"""
+    if traffic_recorder:
+        traffic_recorder.record(request, response, get_current_user_id(), request_elapsed() or 0.0)
+    return response
 
 def get_current_user_id():
     """获取当前登录用户的ID"""
@@ -100,37 +237,145 @@ def get_current_user_id():
         return int(current_user.id)
     return None
 
+def is_admin_user():
+    """当前登录用户是否在ADMIN_USERS中"""
+    return current_user.is_authenticated and current_user.username in ADMIN_USERS
+
+def get_user_data_version(user_id, conn):
+    """用户任务数据版本标识，任意任务或重复例外的增删改都会使其变化（由触发器维护）"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT version FROM user_data_versions WHERE user_id = ?', (user_id,))
+    row = cursor.fetchone()
+    # 统计和建议与当天日期有关，日期变化时也视为新版本
+    return f"{date.today().isoformat()}:{row[0] if row else 0}"
+
+def find_duplicate_tasks(user_id, title, description, conn):
+    """查找与待创建任务疑似重复的已有任务"""
+    matches = find_similar_tasks(user_id, task_text(title, description), conn,
+                                 top_k=3, min_score=DUPLICATE_THRESHOLD)
+    if not matches:
+        return []
+    
+    scores = dict(matches)
+    placeholders = ','.join('?' * len(scores))
+    cursor = conn.cursor()
+    cursor.execute(f'SELECT id, title FROM tasks WHERE user_id = ? AND id IN ({placeholders})',
+                   [user_id] + list(scores))
+    duplicates = [
+        {'id': row['id'], 'title': row['title'], 'similarity': round(scores[row['id']], 3)}
+        for row in cursor.fetchall()
+    ]
+    duplicates.sort(key=lambda item: item['similarity'], reverse=True)
+    return duplicates
+
+# 静态资源构建结果（python asset_pipeline.py），存在时优先使用构建后的模板
+asset_manifest = load_manifest(app.static_folder)
+if asset_manifest is not None:
+    app.jinja_loader = ChoiceLoader([FileSystemLoader(BUILD_TEMPLATE_DIR), app.jinja_loader])
+
+# 模板字节码缓存目录（设置后多进程和重启后无需重新编译模板）
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR')
+if TEMPLATE_CACHE_DIR:
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+# 启动时预编译首页模板，首个请求不再承担编译开销
+app.jinja_env.get_template('index.html')
+
+def serve_static(filename):
+    """静态资源：存在预压缩文件时直接返回，不在请求路径上压缩；带哈希的构建资源长期缓存"""
+    filename, immutable = resolve_static(asset_manifest, filename)
+    max_age = IMMUTABLE_MAX_AGE if immutable else app.get_send_file_max_age(filename)
+    response = send_static(app.static_folder, filename, max_age=max_age)
+    if immutable:
+        response.cache_control.immutable = True
+    elif filename.endswith(SERVICE_WORKER):
+        # Service Worker需要每次检查更新；允许其控制整个站点（拦截接口请求以支持离线发件箱）
+        response.cache_control.no_cache = True
+        response.headers['Service-Worker-Allowed'] = '/'
+    return response
+
+app.view_functions['static'] = serve_static
+
+# 已登录时首页是否在服务端渲染侧边栏和默认列表的首页任务
+SSR_ENABLED = os.environ.get('SSR_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+# 与前端getListDescription一致的列表描述
+LIST_DESCRIPTIONS = {
+    '我的一天': '今日任务',
+    '重要': '重要任务',
+    '已计划': '已计划的任务',
+    '任务': '所有任务',
+    '购物': '购物清单',
+    '工作': '工作任务',
+    '个人': '个人事务'
+}
+
+def initial_view(state):
+    """服务端渲染首页所需的显示数据，日期文字与前端formatDate一致"""
+    today = date.today()
+    tasks = []
+    for task in state['tasks']['items']:
+        due_label, overdue = '', False
+        if task['due_date']:
+            try:
+                due = date.fromisoformat(task['due_date'][:10])
+            except ValueError:
+                due = None
+            if due is not None:
+                if due == today:
+                    due_label = '今天'
+                elif due == today + timedelta(days=1):
+                    due_label = '明天'
+                else:
+                    due_label = f'{due.month}月{due.day}日'
+                overdue = due <= today and not task['completed']
+        tasks.append(dict(task, due_label=due_label, overdue=overdue))
+    
+    active_list = next((task_list for task_list in state['task_lists']
+                        if task_list['id'] == state['default_list_id']), None)
+    user = state['user']
+    return {
+        'active_list': active_list,
+        'description': LIST_DESCRIPTIONS.get(active_list['name'], '任务列表') if active_list else '',
+        'tasks': tasks,
+        'display_name': user['full_name'] or user['username'],
+        'initial': (user['username'] or 'U')[0].upper(),
+        'dark': state['preferences'].get('theme') == 'dark'
+    }
+
 @app.route('/')
 def index():
-    """主页面"""
-    return render_template('index.html')
+    """主页面；已登录时在服务端渲染侧边栏和默认列表首页任务，并嵌入初始状态供前端接管"""
+    if not SSR_ENABLED or not current_user.is_authenticated:
+        return render_template('index.html')
+    
+    state = build_bootstrap(get_current_user_id(), BOOTSTRAP_TASK_LIMIT)
+    state.update({'authenticated': True, 'rendered': True})
+    response = make_response(render_template('index.html', initial=state, view=initial_view(state)))
+    # 页面包含用户数据，只允许浏览器私有缓存且每次验证
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
-@app.route('/api/task_lists')
-@login_required
-def get_task_lists():
-    """获取当前用户的任务列表"""
-    user_id = get_current_user_id()
-    conn = get_db_connection()
+def query_task_lists(conn, user_id, list_id=None):
+    """查询用户的任务列表及各列表的任务统计，可只查询指定列表"""
     cursor = conn.cursor()
     
     # 一次性获取当前用户任务列表及其统计信息
-    cursor.execute('''
+    cursor.execute(f'''
         SELECT 
             tl.id, tl.name, tl.icon, tl.color, tl.sort_order,
             COUNT(t.id) as total_tasks,
             COUNT(CASE WHEN t.completed = 1 THEN 1 END) as completed_tasks
         FROM task_lists tl
         LEFT JOIN tasks t ON tl.id = t.list_id
-        WHERE tl.user_id = ?
+        WHERE tl.user_id = ?{' AND tl.id = ?' if list_id is not None else ''}
         GROUP BY tl.id, tl.name, tl.icon, tl.color, tl.sort_order
         ORDER BY tl.sort_order
-    ''', (user_id,))
-    
-    lists = cursor.fetchall()
-    conn.close()
+    ''', (user_id,) if list_id is None else (user_id, list_id))
     
     result = []
-    for task_list in lists:
+    for task_list in cursor.fetchall():
         result.append({
             'id': task_list['id'],
             'name': task_list['name'],
@@ -140,67 +385,96 @@ def get_task_lists():
             'total_tasks': task_list['total_tasks'] or 0,
             'completed_tasks': task_list['completed_tasks'] or 0
         })
-    
-    return jsonify(result)
+    return result
 
-@app.route('/api/tasks')
+@app.route('/api/task_lists')
 @login_required
-def get_tasks():
+def get_task_lists():
     """获取当前用户的任务列表"""
     user_id = get_current_user_id()
-    list_id = request.args.get('list_id')
-    show_completed = request.args.get('show_completed', 'true').lower() == 'true'
-    
     conn = get_db_connection()
+    result = query_task_lists(conn, user_id)
+    conn.close()
+    
+    return jsonify(result)
+
+def query_tasks(conn, user_id, list_id=None, show_completed=True, limit=None, offset=0, encoder=default_encoder):
+    """查询用户任务，可限定列表并分页，按编码器的字段在SQL中投影"""
     cursor = conn.cursor()
     
+    query = f'''
+        SELECT {select_clause(encoder.fields)}
+        FROM tasks t
+        {join_clause(encoder.fields)}
+        WHERE t.user_id = ?
+    '''
+    params = [user_id]
+    
     if list_id:
         # 获取特定列表的任务
-        query = '''
-            SELECT id, title, description, completed, priority, due_date, 
-                   start_time, end_time, list_id, created_at, updated_at, completed_at, is_important
-            FROM tasks 
-            WHERE list_id = ? AND user_id = ?
-        '''
-        params = [list_id, user_id]
-    else:
-        # 获取用户所有任务
-        query = '''
-            SELECT id, title, description, completed, priority, due_date, 
-                   start_time, end_time, list_id, created_at, updated_at, completed_at, is_important
-            FROM tasks
-            WHERE user_id = ?
-        '''
-        params = [user_id]
+        query += ' AND t.list_id = ?'
+        params.append(list_id)
     
     if not show_completed:
-        query += ' AND completed = 0'
+        query += ' AND t.completed = 0'
+    
+    query += ' ORDER BY t.is_important DESC, t.due_date ASC, t.created_at DESC'
     
-    query += ' ORDER BY is_important DESC, due_date ASC, created_at DESC'
+    if limit is not None:
+        query += ' LIMIT ? OFFSET ?'
+        params.extend([limit, offset])
     
     cursor.execute(query, params)
-    tasks = cursor.fetchall()
-    conn.close()
+    return [encoder.encode(task) for task in cursor.fetchall()]
+
+def fetch_task_dicts(conn, user_id, task_ids):
+    """按ID查询用户的任务，返回{任务ID: 任务字典}"""
+    task_ids = [int(task_id) for task_id in task_ids if str(task_id).isdigit()]
+    if not task_ids:
+        return {}
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT {select_clause(TASK_DEFAULT_FIELDS)}
+        FROM tasks t
+        WHERE t.user_id = ? AND t.id IN ({','.join('?' * len(task_ids))})
+    ''', [user_id] + task_ids)
+    return {task['id']: default_encoder.encode(task) for task in cursor.fetchall()}
+
+def publish_changes(conn, user_id, events):
+    """业务修改提交后发布变更事件"""
+    try:
+        change_feed.publish(conn, user_id, events)
+    except sqlite3.Error as e:
+        # 业务修改已经提交，推送失败不影响请求结果
+        print(f"发布变更失败: {e}")
+
+def publish_task_changes(conn, user_id, before, task_ids):
+    """任务修改提交后，对比修改前的状态发布变更事件"""
+    publish_changes(conn, user_id, task_change_events(before, fetch_task_dicts(conn, user_id, task_ids)))
+
+def publish_list_change(conn, user_id, list_id, event_type):
+    """列表创建或修改提交后发布包含任务统计的列表事件"""
+    lists = query_task_lists(conn, user_id, list_id)
+    if lists:
+        publish_changes(conn, user_id, [(event_type, {'list': lists[0]})])
+
+@app.route('/api/tasks')
+@login_required
+def get_tasks():
+    """获取当前用户的任务列表，支持fields字段投影和format=columnar列式格式"""
+    user_id = get_current_user_id()
+    list_id = request.args.get('list_id')
+    show_completed = request.args.get('show_completed', 'true').lower() == 'true'
+    try:
+        encoder = encoder_from_args(request.args, TASK_DEFAULT_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    result = []
-    for task in tasks:
-        result.append({
-            'id': task['id'],
-            'title': task['title'],
-            'description': task['description'],
-            'completed': bool(task['completed']),
-            'priority': task['priority'],
-            'due_date': task['due_date'],
-            'start_time': task['start_time'],
-            'end_time': task['end_time'],
-            'list_id': task['list_id'],
-            'created_at': task['created_at'],
-            'updated_at': task['updated_at'],
-            'completed_at': task['completed_at'],
-            'is_important': bool(task['is_important'])
-        })
+    conn = get_db_connection()
+    result = query_tasks(conn, user_id, list_id, show_completed, encoder=encoder)
+    conn.close()
     
-    return jsonify(result)
+    return jsonify(encoder.wrap(result))
 
 @app.route('/api/tasks/<int:task_id>', methods=['GET', 'PUT', 'DELETE'])
 @login_required
@@ -211,32 +485,17 @@ def handle_task(task_id):
     cursor = conn.cursor()
     
     if request.method == 'GET':
-        cursor.execute('''
-            SELECT id, title, description, completed, priority, due_date, 
-                   start_time, end_time, list_id, created_at, updated_at, completed_at, is_important
-            FROM tasks 
-            WHERE id = ? AND user_id = ?
+        cursor.execute(f'''
+            SELECT {select_clause(TASK_DEFAULT_FIELDS)}
+            FROM tasks t
+            WHERE t.id = ? AND t.user_id = ?
         ''', (task_id, user_id))
         
         task = cursor.fetchone()
         conn.close()
         
         if task:
-            return jsonify({
-                'id': task['id'],
-                'title': task['title'],
-                'description': task['description'],
-                'completed': bool(task['completed']),
-                'priority': task['priority'],
-                'due_date': task['due_date'],
-                'start_time': task['start_time'],
-                'end_time': task['end_time'],
-                'list_id': task['list_id'],
-                'created_at': task['created_at'],
-                'updated_at': task['updated_at'],
-                'completed_at': task['completed_at'],
-                'is_important': bool(task['is_important'])
-            })
+            return jsonify(default_encoder.encode(task))
         else:
             return jsonify({'error': '任务不存在'}), 404
     
@@ -252,6 +511,22 @@ def handle_task(task_id):
                 update_fields.append(f"{field} = ?")
                 update_values.append(data[field])
         
+        before = fetch_task_dicts(conn, user_id, [task_id])
+        current = before.get(task_id, {})
+        recurrence_rule = current.get('recurrence_rule')
+        if 'recurrence_rule' in data:
+            try:
+                recurrence_rule = normalize_rrule(data['recurrence_rule'])
+            except ValueError as e:
+                conn.close()
+                return jsonify({'error': f'重复规则无效: {e}'}), 400
+            update_values.append(recurrence_rule)
+            update_fields.append("recurrence_rule = ?")
+        # 与创建时一致：重复任务必须有开始日期
+        if recurrence_rule and not data.get('due_date', current.get('due_date')):
+            conn.close()
+            return jsonify({'error': '重复任务必须设置开始日期(due_date)'}), 400
+        
         if 'completed' in data:
             update_fields.append("completed = ?")
             update_values.append(data['completed'])
@@ -277,19 +552,27 @@ def handle_task(task_id):
         ''', update_values)
         
         conn.commit()
+        if 'title' in data or 'description' in data:
+            refresh_tasks(user_id, [task_id], conn)
+        publish_task_changes(conn, user_id, before, [task_id])
         conn.close()
         
         return jsonify({'success': True})
     
     elif request.method == 'DELETE':
+        before = fetch_task_dicts(conn, user_id, [task_id])
         cursor.execute('DELETE FROM tasks WHERE id = ? AND user_id = ?', (task_id, user_id))
+        cursor.execute('DELETE FROM task_recurrence_exceptions WHERE task_id = ? AND user_id = ?', (task_id, user_id))
         conn.commit()
+        refresh_tasks(user_id, [task_id], conn)
+        publish_task_changes(conn, user_id, before, [task_id])
         conn.close()
         
         return jsonify({'success': True})
 
 @app.route('/api/tasks', methods=['POST'])
 @login_required
+@idempotent
 def create_task():
     """创建新任务"""
     user_id = get_current_user_id()
@@ -299,12 +582,23 @@ def create_task():
     if not title:
         return jsonify({'error': '任务标题不能为空'}), 400
     
+    try:
+        recurrence_rule = normalize_rrule(data.get('recurrence_rule'))
+    except ValueError as e:
+        return jsonify({'error': f'重复规则无效: {e}'}), 400
+    if recurrence_rule and not data.get('due_date'):
+        return jsonify({'error': '重复任务必须设置开始日期(due_date)'}), 400
+    
     conn = get_db_connection()
     cursor = conn.cursor()
     
+    # 疑似重复只做提醒，不阻止创建
+    duplicates = find_duplicate_tasks(user_id, title, data.get('description', ''), conn)
+    
     cursor.execute('''
-        INSERT INTO tasks (title, description, priority, due_date, start_time, end_time, list_id, is_important, user_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO tasks (title, description, priority, due_date, start_time, end_time, list_id, is_important,
+                           recurrence_rule, user_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     ''', (
         title,
         data.get('description', ''),
@@ -314,17 +608,25 @@ def create_task():
         data.get('end_time'),
         data.get('list_id'),
         data.get('is_important', False),
+        recurrence_rule,
         user_id
     ))
     
     task_id = cursor.lastrowid
     conn.commit()
+    refresh_tasks(user_id, [task_id], conn)
+    publish_task_changes(conn, user_id, {}, [task_id])
     conn.close()
     
-    return jsonify({'id': task_id, 'success': True})
+    result = {'id': task_id, 'success': True}
+    if duplicates:
+        result['warning'] = '可能与已有任务重复'
+        result['similar_tasks'] = duplicates
+    return jsonify(result)
 
 @app.route('/api/task_lists', methods=['POST'])
 @login_required
+@idempotent
 def create_task_list():
     """创建新任务列表"""
     user_id = get_current_user_id()
@@ -354,6 +656,7 @@ def create_task_list():
     
     list_id = cursor.lastrowid
     conn.commit()
+    publish_list_change(conn, user_id, list_id, 'list.created')
     conn.close()
     
     return jsonify({'id': list_id, 'success': True})
@@ -390,19 +693,66 @@ def handle_task_list(list_id):
         ''', update_values)
         
         conn.commit()
+        publish_list_change(conn, user_id, list_id, 'list.updated')
         conn.close()
         
         return jsonify({'success': True})
     
     elif request.method == 'DELETE':
         # 删除列表及其所有任务（只删除当前用户的）
+        cursor.execute('SELECT id FROM tasks WHERE list_id = ? AND user_id = ?', (list_id, user_id))
+        before = fetch_task_dicts(conn, user_id, [row['id'] for row in cursor.fetchall()])
+        cursor.execute('''
+            DELETE FROM task_recurrence_exceptions
+            WHERE user_id = ? AND task_id IN (SELECT id FROM tasks WHERE list_id = ? AND user_id = ?)
+        ''', (user_id, list_id, user_id))
         cursor.execute('DELETE FROM tasks WHERE list_id = ? AND user_id = ?', (list_id, user_id))
         cursor.execute('DELETE FROM task_lists WHERE id = ? AND user_id = ?', (list_id, user_id))
+        list_deleted = cursor.rowcount > 0
         conn.commit()
+        # 先发布列表内任务的删除和计数变化，再发布列表本身的删除
+        events = task_change_events(before, {})
+        if list_deleted:
+            events.append(('list.deleted', {'id': list_id}))
+        publish_changes(conn, user_id, events)
         conn.close()
+        invalidate_user_index(user_id)
         
         return jsonify({'success': True})
 
+# 用户尚未保存偏好设置时返回的默认值
+DEFAULT_PREFERENCES = {
+    'theme': 'light',
+    'language': 'zh-CN',
+    'accent_color': '#0078d4',
+    'font_size': 'medium',
+    'animations_enabled': True,
+    'transparency_enabled': True,
+    'view_mode': 'list',
+    'show_completed': True,
+    'default_list_id': None
+}
+
+def query_user_preferences(conn, user_id):
+    """查询用户偏好设置，不存在时返回None"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT * FROM user_preferences WHERE user_id = ?', (user_id,))
+    prefs = cursor.fetchone()
+    if not prefs:
+        return None
+    return {
+        'theme': prefs['theme'],
+        'language': prefs['language'],
+        'accent_color': prefs['accent_color'],
+        'font_size': prefs['font_size'],
+        'animations_enabled': bool(prefs['animations_enabled']),
+        'transparency_enabled': bool(prefs['transparency_enabled']),
+        'view_mode': prefs['view_mode'],
+        'show_completed': bool(prefs['show_completed']),
+        'default_list_id': prefs['default_list_id'],
+        'pwa_install_dismissed': bool(prefs['pwa_install_dismissed']) if prefs['pwa_install_dismissed'] is not None else False
+    }
+
 @app.route('/api/user_preferences', methods=['GET', 'PUT'])
 @login_required
 def handle_user_preferences():
@@ -412,23 +762,10 @@ def handle_user_preferences():
     cursor = conn.cursor()
     
     if request.method == 'GET':
-        cursor.execute('SELECT * FROM user_preferences WHERE user_id = ?', (user_id,))
-        prefs = cursor.fetchone()
-        conn.close()
-        
+        prefs = query_user_preferences(conn, user_id)
         if prefs:
-            return jsonify({
-                'theme': prefs['theme'],
-                'language': prefs['language'],
-                'accent_color': prefs['accent_color'],
-                'font_size': prefs['font_size'],
-                'animations_enabled': bool(prefs['animations_enabled']),
-                'transparency_enabled': bool(prefs['transparency_enabled']),
-                'view_mode': prefs['view_mode'],
-                'show_completed': bool(prefs['show_completed']),
-                'default_list_id': prefs['default_list_id'],
-                'pwa_install_dismissed': bool(prefs['pwa_install_dismissed']) if prefs['pwa_install_dismissed'] is not None else False
-            })
+            conn.close()
+            return jsonify(prefs)
         else:
             # 如果没有偏好设置，创建默认设置
             cursor.execute('''
@@ -439,17 +776,7 @@ def handle_user_preferences():
             conn.close()
             
             # 返回默认设置
-            return jsonify({
-                'theme': 'light',
-                'language': 'zh-CN',
-                'accent_color': '#0078d4',
-                'font_size': 'medium',
-                'animations_enabled': True,
-                'transparency_enabled': True,
-                'view_mode': 'list',
-                'show_completed': True,
-                'default_list_id': None
-            })
+            return jsonify(DEFAULT_PREFERENCES)
     
     elif request.method == 'PUT':
         data = request.get_json()
@@ -481,12 +808,8 @@ def handle_user_preferences():
         
         return jsonify({'success': True})
 
-@app.route('/api/stats')
-@login_required
-def get_stats():
-    """获取当前用户的任务统计信息"""
-    user_id = get_current_user_id()
-    conn = get_db_connection()
+def query_stats(conn, user_id):
+    """查询用户的任务统计信息"""
     cursor = conn.cursor()
     
     # 总任务数
@@ -514,9 +837,7 @@ def get_stats():
     ''', (user_id, today, date.fromordinal(date.today().toordinal() + 7).isoformat()))
     week_due_tasks = cursor.fetchone()['week_due']
     
-    conn.close()
-    
-    return jsonify({
+    return {
         'total_tasks': total_tasks,
         'completed_tasks': completed_tasks,
         'pending_tasks': total_tasks - completed_tasks,
@@ -524,7 +845,18 @@ def get_stats():
         'today_due_tasks': today_due_tasks,
         'week_due_tasks': week_due_tasks,
         'completion_rate': round((completed_tasks / total_tasks * 100) if total_tasks > 0 else 0, 1)
-    })
+    }
+
+@app.route('/api/stats')
+@login_required
+def get_stats():
+    """获取当前用户的任务统计信息"""
+    user_id = get_current_user_id()
+    conn = get_db_connection()
+    result = query_stats(conn, user_id)
+    conn.close()
+    
+    return jsonify(result)
 
 @app.route('/api/search')
 @login_required
@@ -535,117 +867,266 @@ def search_tasks():
     
     if not query:
         return jsonify({'error': '缺少搜索查询'}), 400
+    try:
+        encoder = encoder_from_args(request.args, SEARCH_DEFAULT_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT t.id, t.title, t.description, t.completed, t.priority, 
-               t.due_date, t.list_id, tl.name as list_name, tl.icon as list_icon
+    cursor.execute(f'''
+        SELECT {select_clause(encoder.fields)}
         FROM tasks t
-        LEFT JOIN task_lists tl ON t.list_id = tl.id
+        {join_clause(encoder.fields)}
         WHERE t.user_id = ? AND (t.title LIKE ? OR t.description LIKE ?)
         ORDER BY t.is_important DESC, t.due_date ASC
     ''', (user_id, f'%{query}%', f'%{query}%'))
     
-    results = cursor.fetchall()
+    results = [encoder.encode(result) for result in cursor.fetchall()]
     conn.close()
     
-    search_results = []
-    for result in results:
-        search_results.append({
-            'id': result['id'],
-            'title': result['title'],
-            'description': result['description'],
-            'completed': bool(result['completed']),
-            'priority': result['priority'],
-            'due_date': result['due_date'],
-            'list_id': result['list_id'],
-            'list_name': result['list_name'],
-            'list_icon': result['list_icon']
-        })
+    return jsonify(encoder.wrap(results))
+
+@app.route('/api/suggestions/priority')
+@login_required
+def get_priority_suggestion_list():
+    """获取当前用户待办任务的本地优先级建议"""
+    config = load_ai_config()
+    if not config.get('features', {}).get('priority_suggestion', True):
+        return jsonify({'error': '优先级建议功能未启用'}), 403
+    
+    user_id = get_current_user_id()
+    limit = request.args.get('limit', type=int)
+    
+    conn = get_db_connection()
+    try:
+        data_version = get_user_data_version(user_id, conn)
+        suggestions, cached = get_priority_suggestions(user_id, data_version, conn)
+    finally:
+        conn.close()
+    record_cache('priority_suggestions', cached)
     
-    return jsonify(search_results)
+    return jsonify({
+        'version': data_version,
+        'cached': cached,
+        'count': len(suggestions),
+        'suggestions': suggestions[:limit] if limit else suggestions
+    })
 
 # 日历周视图相关API
 @app.route('/api/calendar/week')
 @login_required
 def get_calendar_week():
-    """获取当前用户的周视图日历数据"""
+    """获取当前用户的周视图日历数据，支持fields字段投影和format=columnar列式格式"""
     user_id = get_current_user_id()
     try:
-        # 获取查询参数
-        week_start = request.args.get('week_start')
-        if not week_start:
-            # 默认为本周开始
-            today = date.today()
-            days_since_monday = today.weekday()
-            week_start = (today - timedelta(days=days_since_monday)).isoformat()
-        
-        week_start_date = date.fromisoformat(week_start)
-        week_end_date = week_start_date + timedelta(days=6)
-        
+        encoder = encoder_from_args(request.args, CALENDAR_WEEK_DEFAULT_FIELDS,
+                                    extra_columns=('recurrence_rule', 'occurrence_date'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # 获取查询参数
+    week_start = request.args.get('week_start')
+    if not week_start:
+        # 默认为本周开始
+        today = date.today()
+        days_since_monday = today.weekday()
+        week_start = (today - timedelta(days=days_since_monday)).isoformat()
+    try:
+        week_start_date, week_end_date = parse_date_range(week_start, None)
+    except ValueError as e:
+        return jsonify({'error': f'日期参数无效: {e}'}), 400
+    try:
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # 获取指定周的用户任务
-        cursor.execute('''
-            SELECT t.id, t.title, t.description, t.completed, t.priority,
-                   t.due_date, t.start_time, t.end_time, t.list_id, t.is_important,
-                   tl.name as list_name, tl.icon as list_icon, tl.color as list_color
+        # 获取指定周的用户任务（所在天的下标和排序键直接在SQL中计算）
+        cursor.execute(f'''
+            SELECT {select_clause(encoder.fields)},
+                   CAST(julianday(t.due_date) - julianday(?) AS INTEGER) as day_index,
+                   t.start_time as sort_start_time, t.is_important as sort_important
             FROM tasks t
-            LEFT JOIN task_lists tl ON t.list_id = tl.id
-            WHERE t.user_id = ? AND t.due_date BETWEEN ? AND ?
+            {join_clause(encoder.fields)}
+            WHERE t.user_id = ? AND t.due_date BETWEEN ? AND ? AND t.recurrence_rule IS NULL
             ORDER BY t.due_date, t.start_time, t.is_important DESC
-        ''', (user_id, week_start_date.isoformat(), week_end_date.isoformat()))
+        ''', (week_start_date.isoformat(), user_id, week_start_date.isoformat(), week_end_date.isoformat()))
         
         tasks = cursor.fetchall()
+        occurrences = list(load_recurring_occurrences(conn, user_id, week_start_date, week_end_date))
         conn.close()
         
+        # 每天的任务暂存为(排序键, 编码后的任务)
+        day_tasks = [[] for _ in range(7)]
+        
+        # 将任务分配到对应的日期
+        for task in tasks:
+            day_index = task['day_index']
+            if day_index is not None and 0 <= day_index < 7:
+                sort_key = (task['sort_start_time'] or '', not task['sort_important'])
+                day_tasks[day_index].append((sort_key, encoder.encode(task)))
+        
+        # 将重复任务在本周内的实例分配到对应日期
+        for master, occurrence, status in occurrences:
+            sort_key = (master['start_time'] or '', not master['is_important'])
+            day_tasks[(occurrence - week_start_date).days].append((sort_key, encoder.encode_named(
+                master,
+                completed=status == 'completed',
+                recurrence_rule=master['recurrence_rule'],
+                occurrence_date=occurrence.isoformat()
+            )))
+        
+        if occurrences:
+            for items in day_tasks:
+                items.sort(key=lambda item: item[0])
+        
         # 构建周数据结构
         week_data = {
             'week_start': week_start_date.isoformat(),
             'week_end': week_end_date.isoformat(),
             'days': []
         }
+        if encoder.columnar:
+            week_data['columns'] = encoder.columns
         
-        # 初始化一周的每一天
         for i in range(7):
             current_date = week_start_date + timedelta(days=i)
             week_data['days'].append({
                 'date': current_date.isoformat(),
                 'day_name': current_date.strftime('%A'),
-                'tasks': []
+                'tasks': [item for _, item in day_tasks[i]]
             })
         
-        # 将任务分配到对应的日期
-        for task in tasks:
-            task_date = date.fromisoformat(task['due_date']) if task['due_date'] else None
-            if task_date:
-                day_index = (task_date - week_start_date).days
-                if 0 <= day_index < 7:
-                    task_data = {
-                        'id': task['id'],
-                        'title': task['title'],
-                        'description': task['description'],
-                        'completed': bool(task['completed']),
-                        'priority': task['priority'],
-                        'start_time': task['start_time'],
-                        'end_time': task['end_time'],
-                        'list_id': task['list_id'],
-                        'is_important': bool(task['is_important']),
-                        'list_name': task['list_name'],
-                        'list_icon': task['list_icon'],
-                        'list_color': task['list_color']
-                    }
-                    week_data['days'][day_index]['tasks'].append(task_data)
-        
         return jsonify(week_data)
         
     except Exception as e:
         print(f"获取周视图数据错误: {e}")
         return jsonify({'error': '获取周视图数据失败'}), 500
 
+@app.route('/api/calendar/range')
+@login_required
+def get_calendar_range_data():
+    """获取当前用户任意日期范围的日历数据（紧凑格式）"""
+    user_id = get_current_user_id()
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in BUCKET_EXPRESSIONS:
+        return jsonify({'error': '不支持的粒度，可选值: day/week/month'}), 400
+    
+    try:
+        start_date, end_date = parse_date_range(request.args.get('start'), request.args.get('end'),
+                                                max_days=MAX_RANGE_DAYS)
+    except ValueError as e:
+        return jsonify({'error': f'日期参数无效: {e}'}), 400
+    
+    conn = get_db_connection()
+    try:
+        data_version = get_user_data_version(user_id, conn)
+        result, cached = get_calendar_range(conn, user_id, data_version, start_date, end_date, granularity)
+    finally:
+        conn.close()
+    record_cache('calendar_range', cached)
+    
+    # 预取前后窗口，翻页时直接从内存返回
+    prefetch_adjacent(get_db_connection, user_id, data_version, start_date, end_date, granularity)
+    
+    return jsonify(dict(result, cached=cached))
+
+@app.route('/api/tasks/<int:task_id>/occurrences/<occurrence_date>', methods=['PUT'])
+@login_required
+def update_task_occurrence(task_id, occurrence_date):
+    """完成、跳过或恢复重复任务的单次实例（只写一行例外记录）"""
+    user_id = get_current_user_id()
+    data = request.get_json() or {}
+    
+    try:
+        occurrence = date.fromisoformat(occurrence_date)
+    except ValueError:
+        return jsonify({'error': '日期格式无效'}), 400
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT due_date, recurrence_rule FROM tasks WHERE id = ? AND user_id = ?', (task_id, user_id))
+        task = cursor.fetchone()
+        if not task or not task['recurrence_rule']:
+            return jsonify({'error': '重复任务不存在'}), 404
+        if not is_occurrence(date.fromisoformat(task['due_date']), task['recurrence_rule'], occurrence):
+            return jsonify({'error': '该日期不是此任务的重复实例'}), 400
+        if 'due_date' in data or 'start_time' in data:
+            return move_task_occurrence(conn, user_id, task_id, occurrence, data)
+        
+        before = fetch_task_dicts(conn, user_id, [task_id])
+        now = datetime.now().isoformat()
+        if data.get('skipped'):
+            status = 'skipped'
+        elif data.get('completed'):
+            status = 'completed'
+        else:
+            status = None
+        
+        if status:
+            cursor.execute('''
+                INSERT INTO task_recurrence_exceptions (task_id, user_id, occurrence_date, status, completed_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(task_id, occurrence_date) DO UPDATE SET status = excluded.status, completed_at = excluded.completed_at
+            ''', (task_id, user_id, occurrence.isoformat(), status, now if status == 'completed' else None))
+        else:
+            cursor.execute('''
+                DELETE FROM task_recurrence_exceptions
+                WHERE task_id = ? AND user_id = ? AND occurrence_date = ?
+            ''', (task_id, user_id, occurrence.isoformat()))
+        
+        # 更新主任务时间戳，使依赖数据版本的缓存失效
+        cursor.execute('UPDATE tasks SET updated_at = ? WHERE id = ? AND user_id = ?', (now, task_id, user_id))
+        conn.commit()
+        publish_task_changes(conn, user_id, before, [task_id])
+    finally:
+        conn.close()
+    
+    return jsonify({'success': True, 'task_id': task_id, 'occurrence_date': occurrence.isoformat(), 'status': status})
+
+def move_task_occurrence(conn, user_id, task_id, occurrence, data):
+    """把重复任务的单次实例移到其他时间：跳过原实例，在新时间创建一个独立任务"""
+    new_date = data.get('due_date') or occurrence.isoformat()
+    try:
+        date.fromisoformat(str(new_date))
+    except ValueError:
+        return jsonify({'error': '日期格式无效'}), 400
+    start_time = data.get('start_time')
+    end_time = data.get('end_time')
+    
+    if start_time and not data.get('allow_conflict'):
+        schedule = get_schedule_index(user_id, get_user_data_version(user_id, conn), conn)
+        # 同一天内移动时排除该实例本身
+        exclude_id = task_id if new_date == occurrence.isoformat() else None
+        conflicts = schedule.find_conflicts(new_date, start_time, end_time, exclude_id=exclude_id)
+        if conflicts:
+            return jsonify({'error': '时间冲突', 'conflicts': conflicts}), 409
+    
+    cursor = conn.cursor()
+    before = fetch_task_dicts(conn, user_id, [task_id])
+    master = before[task_id]
+    now = datetime.now().isoformat()
+    cursor.execute('''
+        INSERT INTO task_recurrence_exceptions (task_id, user_id, occurrence_date, status, completed_at)
+        VALUES (?, ?, ?, 'skipped', NULL)
+        ON CONFLICT(task_id, occurrence_date) DO UPDATE SET status = excluded.status, completed_at = NULL
+    ''', (task_id, user_id, occurrence.isoformat()))
+    cursor.execute('''
+        INSERT INTO tasks (title, description, priority, due_date, start_time, end_time, list_id, is_important, user_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (master['title'], master['description'], master['priority'], new_date, start_time, end_time,
+          master['list_id'], master['is_important'], user_id))
+    moved_task_id = cursor.lastrowid
+    # 更新主任务时间戳，使依赖数据版本的缓存失效
+    cursor.execute('UPDATE tasks SET updated_at = ? WHERE id = ? AND user_id = ?', (now, task_id, user_id))
+    conn.commit()
+    refresh_tasks(user_id, [moved_task_id], conn)
+    publish_task_changes(conn, user_id, before, [task_id, moved_task_id])
+    
+    return jsonify({'success': True, 'task_id': task_id, 'occurrence_date': occurrence.isoformat(),
+                    'status': 'moved', 'moved_task_id': moved_task_id})
+
 @app.route('/api/tasks/<int:task_id>/time', methods=['PUT'])
 @login_required
 def update_task_time(task_id):
@@ -653,11 +1134,29 @@ def update_task_time(task_id):
     user_id = get_current_user_id()
     try:
         data = request.get_json()
+        if data.get('due_date'):
+            # 日程索引按YYYY-MM-DD字符串分桶，其他写法（如20250101）也要拒绝
+            try:
+                valid = date.fromisoformat(str(data['due_date'])).isoformat() == data['due_date']
+            except ValueError:
+                valid = False
+            if not valid:
+                return jsonify({'error': '日期格式无效'}), 400
         
         conn = get_db_connection()
         cursor = conn.cursor()
         
+        # 检查与同一天其他定时任务的冲突
+        if data.get('due_date') and data.get('start_time') and not data.get('allow_conflict'):
+            schedule = get_schedule_index(user_id, get_user_data_version(user_id, conn), conn)
+            conflicts = schedule.find_conflicts(data['due_date'], data['start_time'],
+                                                data.get('end_time'), exclude_id=task_id)
+            if conflicts:
+                conn.close()
+                return jsonify({'error': '时间冲突', 'conflicts': conflicts}), 409
+        
         # 更新用户任务时间
+        before = fetch_task_dicts(conn, user_id, [task_id])
         cursor.execute('''
             UPDATE tasks 
             SET start_time = ?, end_time = ?, due_date = ?, updated_at = ?
@@ -672,6 +1171,7 @@ def update_task_time(task_id):
         ))
         
         conn.commit()
+        publish_task_changes(conn, user_id, before, [task_id])
         conn.close()
         
         return jsonify({'success': True})
@@ -680,6 +1180,133 @@ def update_task_time(task_id):
         print(f"更新任务时间错误: {e}")
         return jsonify({'error': '更新任务时间失败'}), 500
 
+# 日期范围参数允许的上下限，为重复展开和相邻窗口预取留出余量，避免日期运算溢出
+MIN_QUERY_DATE = date(1900, 1, 1)
+MAX_QUERY_DATE = date(9000, 12, 31)
+
+def parse_date_range(start_value, end_value, default_days=7, max_days=62):
+    """解析日期范围参数，返回(开始日期, 结束日期)"""
+    start_date = date.fromisoformat(str(start_value)) if start_value else date.today()
+    if not MIN_QUERY_DATE <= start_date <= MAX_QUERY_DATE:
+        raise ValueError(f'日期必须在{MIN_QUERY_DATE}到{MAX_QUERY_DATE}之间')
+    end_date = date.fromisoformat(str(end_value)) if end_value else start_date + timedelta(days=default_days - 1)
+    if not MIN_QUERY_DATE <= end_date <= MAX_QUERY_DATE:
+        raise ValueError(f'日期必须在{MIN_QUERY_DATE}到{MAX_QUERY_DATE}之间')
+    if end_date < start_date:
+        raise ValueError('结束日期不能早于开始日期')
+    if (end_date - start_date).days >= max_days:
+        raise ValueError(f'日期范围不能超过{max_days}天')
+    return start_date, end_date
+
+def auto_schedule_tasks(user_id, conn, start_date, end_date, duration=DEFAULT_DURATION_MINUTES,
+                        apply=True, task_ids=None, day_start=DEFAULT_DAY_START, day_end=DEFAULT_DAY_END):
+    """把未安排时间的待办任务按建议优先级填入空闲时段"""
+    data_version = get_user_data_version(user_id, conn)
+    schedule = get_schedule_index(user_id, data_version, conn)
+    suggestions, _ = get_priority_suggestions(user_id, data_version, conn)
+    
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id, title, due_date FROM tasks
+        WHERE user_id = ? AND completed = 0 AND start_time IS NULL
+    ''', (user_id,))
+    unscheduled = {row['id']: row for row in cursor.fetchall()}
+    if task_ids:
+        wanted = set(task_ids)
+        unscheduled = {task_id: row for task_id, row in unscheduled.items() if task_id in wanted}
+    
+    # 已逾期的任务不限制截止日期，按建议优先级排序
+    today = date.today().isoformat()
+    ordered = []
+    for item in suggestions:
+        row = unscheduled.get(item['id'])
+        if row:
+            due_date = row['due_date'] if row['due_date'] and row['due_date'] >= today else None
+            ordered.append({'id': row['id'], 'title': row['title'], 'due_date': due_date})
+    
+    plan = plan_auto_schedule(schedule, ordered, start_date, end_date, duration, day_start, day_end)
+    
+    if apply and plan:
+        planned_ids = [item['id'] for item in plan]
+        before = fetch_task_dicts(conn, user_id, planned_ids)
+        now = datetime.now().isoformat()
+        cursor.executemany('''
+            UPDATE tasks SET due_date = ?, start_time = ?, end_time = ?, updated_at = ?
+            WHERE id = ? AND user_id = ?
+        ''', [(item['due_date'], item['start_time'], item['end_time'], now, item['id'], user_id)
+              for item in plan])
+        conn.commit()
+        publish_task_changes(conn, user_id, before, planned_ids)
+    
+    return plan
+
+@app.route('/api/calendar/free_slots')
+@login_required
+def get_calendar_free_slots():
+    """获取当前用户指定日期范围内的空闲时段"""
+    user_id = get_current_user_id()
+    try:
+        start_date, end_date = parse_date_range(request.args.get('start'), request.args.get('end'))
+    except ValueError as e:
+        return jsonify({'error': f'日期参数无效: {e}'}), 400
+    try:
+        day_start, day_end = parse_day_window(request.args.get('day_start'), request.args.get('day_end'))
+        min_duration = parse_duration(request.args.get('min_duration'), 30, 'min_duration')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    conn = get_db_connection()
+    try:
+        schedule = get_schedule_index(user_id, get_user_data_version(user_id, conn), conn)
+    finally:
+        conn.close()
+    
+    days = schedule.free_slots(start_date, end_date, day_start=day_start, day_end=day_end,
+                               min_duration=min_duration)
+    return jsonify({
+        'start': start_date.isoformat(),
+        'end': end_date.isoformat(),
+        'days': days
+    })
+
+@app.route('/api/calendar/auto_schedule', methods=['POST'])
+@login_required
+def auto_schedule():
+    """自动把未安排时间的任务填入空闲时段"""
+    user_id = get_current_user_id()
+    data = request.get_json() or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': '请求体必须是JSON对象'}), 400
+    try:
+        start_date, end_date = parse_date_range(data.get('start'), data.get('end'))
+    except ValueError as e:
+        return jsonify({'error': f'日期参数无效: {e}'}), 400
+    try:
+        duration = parse_duration(data.get('duration'), DEFAULT_DURATION_MINUTES)
+        task_ids = parse_task_ids(data.get('task_ids'))
+        day_start, day_end = parse_day_window(data.get('day_start'), data.get('day_end'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    conn = get_db_connection()
+    try:
+        plan = auto_schedule_tasks(
+            user_id, conn, start_date, end_date,
+            duration=duration,
+            apply=not data.get('dry_run', False),
+            task_ids=task_ids,
+            day_start=day_start,
+            day_end=day_end
+        )
+    finally:
+        conn.close()
+    
+    return jsonify({
+        'success': True,
+        'scheduled_count': len(plan),
+        'plan': plan
+    })
+
 @app.route('/api/tasks/batch', methods=['POST'])
 @login_required
 def batch_update_tasks():
@@ -692,11 +1319,14 @@ def batch_update_tasks():
         conn = get_db_connection()
         cursor = conn.cursor()
         
+        # 非数字的ID不对应任何任务，写入前跳过，避免提交后同步索引时出错
+        updates = [update for update in updates if isinstance(update, dict) and str(update.get('id')).isdigit()]
+        task_ids = [int(update['id']) for update in updates]
+        before = fetch_task_dicts(conn, user_id, task_ids)
         success_count = 0
+        text_changed_ids = []
         for update in updates:
-            task_id = update.get('id')
-            if not task_id:
-                continue
+            task_id = int(update['id'])
             
             # 构建更新字段
             update_fields = []
@@ -720,8 +1350,12 @@ def batch_update_tasks():
                     WHERE id = ? AND user_id = ?
                 ''', update_values)
                 success_count += 1
+                if 'title' in update or 'description' in update:
+                    text_changed_ids.append(task_id)
         
         conn.commit()
+        refresh_tasks(user_id, text_changed_ids, conn)
+        publish_task_changes(conn, user_id, before, task_ids)
         conn.close()
         
         return jsonify({
@@ -733,9 +1367,68 @@ def batch_update_tasks():
         print(f"批量更新任务错误: {e}")
         return jsonify({'error': '批量更新失败'}), 500
 
+@app.route('/api/batch', methods=['POST'])
+@login_required
+def batch_requests():
+    """在一次HTTP请求中执行多个API调用，按请求顺序返回各自的状态码和响应体"""
+    try:
+        items = parse_batch(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    results = execute_batch(app, items, open_db_connection, current_user._get_current_object())
+    return jsonify({'responses': results})
+
+@app.route('/api/changes/stream')
+@login_required
+def stream_changes():
+    """当前用户的变更推送（SSE），断线重连时按Last-Event-ID补发"""
+    user_id = get_current_user_id()
+    last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id', ''))
+    last_event_id = int(last_event_id) if last_event_id.isdigit() else None
+    
+    def generate():
+        # 先订阅再补发，补发与实时事件重叠的部分按事件ID跳过
+        subscription = change_feed.subscribe(user_id)
+        try:
+            yield 'retry: 3000\n: connected\n\n'
+            last_sent = 0
+            if last_event_id is not None:
+                last_sent = last_event_id
+                conn = open_db_connection()
+                try:
+                    replayed, complete = change_feed.replay(conn, user_id, last_event_id)
+                except sqlite3.Error as e:
+                    print(f"补发变更失败: {e}")
+                    replayed, complete = [], False
+                finally:
+                    conn.close()
+                if not complete:
+                    yield 'event: resync\ndata: {}\n\n'
+                for event in replayed:
+                    last_sent = event.event_id
+                    yield event.format()
+            while True:
+                event = subscription.get(CHANGE_FEED_HEARTBEAT)
+                if event is None:
+                    yield ': heartbeat\n\n'
+                elif event is RESYNC:
+                    yield 'event: resync\ndata: {}\n\n'
+                elif event.event_id > last_sent:
+                    last_sent = event.event_id
+                    yield event.format()
+        finally:
+            change_feed.unsubscribe(subscription)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 # AI助手相关API
 # 全局变量存储对话历史
 conversation_history = []
+register_cache('conversation_history', lambda: conversation_history)
 
 def load_ai_config():
     """加载AI配置"""
@@ -864,8 +1557,9 @@ def handle_ai_config():
             return jsonify({'error': '保存配置失败'}), 500
 
 @app.route('/api/ai/chat', methods=['POST'])
+@idempotent
 def ai_chat():
-    """AI聊天接口"""
+    """AI聊天接口；携带幂等键的重试直接返回首次的完整回复，不会重复记录对话或执行操作"""
     try:
         data = request.get_json()
         user_message = data.get('message', '').strip()
@@ -889,7 +1583,7 @@ def ai_chat():
             })
         
         # 获取当前任务数据作为上下文
-        task_context = get_task_context()
+        task_context = get_task_context(user_message)
         
         # 构建增强的系统提示，包含AI操作接口说明
         enhanced_system_prompt = config['assistant']['system_prompt'] + f"""
@@ -923,6 +1617,11 @@ def ai_chat():
    {{"action": "search_tasks", "data": {{"query": "搜索关键词"}}}}
    ```
 
+6. **自动安排日程**（把未安排时间的任务填入空闲时段）：
+   ```json
+   {{"action": "auto_schedule", "data": {{"start": "2025-01-01", "end": "2025-01-07", "duration": 60}}}}
+   ```
+
 **使用方法：**
 - 在回复中包含上述JSON指令
 - 系统会自动识别并执行这些指令
@@ -950,6 +1649,14 @@ def ai_chat():
         conversation_context = get_conversation_context()
         messages.extend(conversation_context)
         
+        # 流式模式：边生成边执行已闭合的操作指令
+        if config['assistant'].get('stream_response', False):
+            return Response(
+                stream_with_context(stream_ai_chat(messages, config, user_message)),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+        
         # 调用OpenAI兼容API
         response = call_openai_api(messages, config)
         
@@ -998,41 +1705,156 @@ def ai_chat():
             'source': 'error'
         }), 500
 
-def parse_ai_actions(response):
-    """解析AI回复中的操作指令"""
-    import re
-    import json
-    
-    actions = []
-    
-    # 改进的JSON解析模式，支持嵌套结构
-    # 使用更精确的正则表达式来匹配完整的JSON对象
-    json_pattern = r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*"action"[^{}]*\}'
-    
-    # 首先尝试匹配包含action的JSON
-    matches = re.findall(json_pattern, response, re.DOTALL)
-    
-    # 如果没有找到，尝试更宽松的匹配
-    if not matches:
-        # 查找所有可能的JSON对象
-        json_pattern = r'\{(?:[^{}]|(?R))*\}'
-        matches = re.findall(json_pattern, response, re.DOTALL)
-    
-    for match in matches:
+def format_sse_event(event, payload):
+    """格式化一条SSE事件"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+# 单个操作指令的最大长度，超过后视为未闭合的花括号并重新同步
+AI_ACTION_MAX_CHARS = int(os.environ.get('AI_ACTION_MAX_CHARS', '16384'))
+
+class IncrementalActionScanner:
+    """增量扫描流式回复，在每个顶层JSON对象闭合时立即解析出操作指令
+    
+    正文里未配对的左花括号不能让扫描一直停在对象内部：当前内容不可能是JSON、
+    闭合后解析失败或超过长度上限时，从该花括号之后重新扫描。
+    """
+    
+    def __init__(self):
+        self._buffer = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        # 对象内最近一个字符串外的非空白字符
+        self._last = ''
+    
+    def feed(self, chunk):
+        """输入一段文本，返回本段中闭合的完整操作指令列表"""
+        actions = []
+        pos = 0
+        length = len(chunk)
+        
+        while pos < length:
+            if self._depth == 0:
+                # 不在对象内部时直接跳到下一个左花括号
+                start = chunk.find('{', pos)
+                if start == -1:
+                    break
+                self._buffer = ['{']
+                self._depth = 1
+                self._last = '{'
+                pos = start + 1
+                continue
+            
+            ch = chunk[pos]
+            pos += 1
+            
+            if self._in_string:
+                self._buffer.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last = ch
+            elif (ch == '{' and self._last not in '[:,') or (ch == '"' and self._last not in '{[:,') \
+                    or len(self._buffer) >= AI_ACTION_MAX_CHARS:
+                # JSON中左花括号只能出现在[:,之后、字符串只能出现在{[:,之后，否则这段不是指令
+                chunk = self._resync() + chunk[pos - 1:]
+                pos, length = 0, len(chunk)
+            else:
+                self._buffer.append(ch)
+                if ch == '"':
+                    self._in_string = True
+                elif ch == '{':
+                    self._depth += 1
+                elif ch == '}':
+                    self._depth -= 1
+                    if self._depth == 0:
+                        text = ''.join(self._buffer)
+                        action = self._parse_buffer()
+                        if action:
+                            actions.append(action)
+                        elif action is None:
+                            # 解析失败：里面可能还有完整的指令，从第一个花括号之后重新扫描
+                            chunk = text[1:] + chunk[pos:]
+                            pos, length = 0, len(chunk)
+                if not ch.isspace():
+                    self._last = ch
+        
+        return actions
+    
+    def _resync(self):
+        """放弃当前对象，返回第一个花括号之后已缓冲的内容以便重新扫描"""
+        text = ''.join(self._buffer[1:])
+        self._buffer = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        return text
+    
+    def _parse_buffer(self):
+        """解析已闭合的对象：不是JSON返回None，是JSON但不是操作指令返回False"""
+        text = ''.join(self._buffer)
+        self._buffer = []
         try:
-            # 清理可能的空白字符
-            clean_match = match.strip()
-            action_data = json.loads(clean_match)
-            if 'action' in action_data and 'data' in action_data:
-                actions.append(action_data)
-                print(f"成功解析AI指令: {action_data}")  # 调试日志
-        except json.JSONDecodeError as e:
-            print(f"JSON解析失败: {e}, 内容: {match}")  # 调试日志
-            continue
+            action_data = json.loads(text)
+        except json.JSONDecodeError:
+            return None
+        if isinstance(action_data, dict) and 'action' in action_data and 'data' in action_data:
+            return action_data
+        return False
+
+def stream_ai_chat(messages, config, user_message):
+    """流式AI聊天：转发文本增量，并在指令闭合时立即执行并推送结果"""
+    scanner = IncrementalActionScanner()
+    response_parts = []
+    action_results = []
+    
+    try:
+        for delta in call_openai_api_stream(messages, config):
+            response_parts.append(delta)
+            yield format_sse_event('delta', {'content': delta})
+            
+            for action in scanner.feed(delta):
+                result = execute_ai_action(action)
+                action_results.append(result)
+                yield format_sse_event('action', result)
+    except Exception as e:
+        print(f"流式API调用异常: {e}")
+    
+    response = ''.join(response_parts)
+    
+    if not response:
+        # 流式调用失败，降级到本地回复
+        response = generate_local_response(user_message)
+        add_to_conversation_history("assistant", response)
+        yield format_sse_event('done', {'response': response, 'source': 'local_fallback'})
+        return
+    
+    if action_results:
+        enhanced_response = generate_action_response(response, action_results)
+        add_to_conversation_history("assistant", enhanced_response)
+        yield format_sse_event('done', {
+            'response': enhanced_response,
+            'source': 'ai_with_actions',
+            'actions': action_results
+        })
+    else:
+        add_to_conversation_history("assistant", response)
+        yield format_sse_event('done', {'response': response, 'source': 'ai'})
+
+@traced('ai.parse_actions')
+def parse_ai_actions(response):
+    """解析AI回复中的操作指令（按花括号配对提取，支持嵌套结构）"""
+    actions = IncrementalActionScanner().feed(response)
+    for action_data in actions:
+        print(f"成功解析AI指令: {action_data}")  # 调试日志
     
     print(f"总共解析到 {len(actions)} 个AI指令")  # 调试日志
     return actions
 
+@traced('ai.execute_action')
 def execute_ai_action(action):
     """执行AI操作指令"""
     try:
@@ -1040,15 +1862,17 @@ def execute_ai_action(action):
         data = action.get('data', {})
         
         if action_type == 'create_task':
-            return execute_create_task(data)
+            return execute_idempotent_action(action_type, data, execute_create_task)
         elif action_type == 'create_list':
-            return execute_create_list(data)
+            return execute_idempotent_action(action_type, data, execute_create_list)
         elif action_type == 'update_task':
             return execute_update_task(data)
         elif action_type == 'delete_task':
             return execute_delete_task(data)
         elif action_type == 'search_tasks':
             return execute_search_tasks(data)
+        elif action_type == 'auto_schedule':
+            return execute_auto_schedule(data)
         else:
             return {
                 'success': False,
@@ -1064,6 +1888,21 @@ def execute_ai_action(action):
             'action': action.get('action', 'unknown')
         }
 
+def execute_idempotent_action(action_type, data, execute):
+    """聊天请求携带幂等键时，重试中内容相同的创建操作只执行一次，返回首次的结果"""
+    key = current_idempotency_key()
+    if key is None or not current_user.is_authenticated:
+        return execute(data)
+    action_key = f'{key}:{action_type}:{request_fingerprint(action_type, "", data)[:16]}'
+    result = idempotency_store.once(int(current_user.id), action_key, data, lambda: execute(data))
+    if result is None:
+        return {
+            'success': False,
+            'error': '相同的操作正在处理中',
+            'action': action_type
+        }
+    return result
+
 def execute_create_task(data):
     """执行创建任务操作"""
     try:
@@ -1124,6 +1963,8 @@ def execute_create_task(data):
             ''', ('默认列表', '📋', '#0078d4', 0, user_id))
             list_id = cursor.lastrowid
         
+        duplicates = find_duplicate_tasks(user_id, title, data.get('description', ''), conn)
+        
         # 创建任务
         cursor.execute('''
             INSERT INTO tasks (title, description, priority, due_date, start_time, end_time, list_id, is_important, user_id)
@@ -1142,9 +1983,11 @@ def execute_create_task(data):
         
         task_id = cursor.lastrowid
         conn.commit()
+        refresh_tasks(user_id, [task_id], conn)
+        publish_task_changes(conn, user_id, {}, [task_id])
         conn.close()
         
-        return {
+        result = {
             'success': True,
             'action': 'create_task',
             'task_id': task_id,
@@ -1152,6 +1995,10 @@ def execute_create_task(data):
             'title': title,
             'message': f'任务"{title}"创建成功'
         }
+        if duplicates:
+            result['similar_tasks'] = duplicates
+            result['message'] += f'（可能与已有任务"{duplicates[0]["title"]}"重复）'
+        return result
         
     except Exception as e:
         return {
@@ -1201,6 +2048,7 @@ def execute_create_list(data):
         
         list_id = cursor.lastrowid
         conn.commit()
+        publish_list_change(conn, user_id, list_id, 'list.created')
         conn.close()
         
         return {
@@ -1273,6 +2121,7 @@ def execute_update_task(data):
         update_values.append(task_id)
         update_values.append(user_id)
         
+        before = fetch_task_dicts(conn, user_id, [task_id])
         cursor.execute(f'''
             UPDATE tasks 
             SET {', '.join(update_fields)}
@@ -1280,6 +2129,9 @@ def execute_update_task(data):
         ''', update_values)
         
         conn.commit()
+        if 'title' in data or 'description' in data:
+            refresh_tasks(user_id, [task_id], conn)
+        publish_task_changes(conn, user_id, before, [task_id])
         conn.close()
         
         return {
@@ -1320,8 +2172,12 @@ def execute_delete_task(data):
         conn = get_db_connection()
         cursor = conn.cursor()
         
+        before = fetch_task_dicts(conn, user_id, [task_id])
         cursor.execute('DELETE FROM tasks WHERE id = ? AND user_id = ?', (task_id, user_id))
+        cursor.execute('DELETE FROM task_recurrence_exceptions WHERE task_id = ? AND user_id = ?', (task_id, user_id))
         conn.commit()
+        refresh_tasks(user_id, [task_id], conn)
+        publish_task_changes(conn, user_id, before, [task_id])
         conn.close()
         
         return {
@@ -1404,6 +2260,46 @@ def execute_search_tasks(data):
             'action': 'search_tasks'
         }
 
+def execute_auto_schedule(data):
+    """执行自动安排日程操作"""
+    try:
+        # 获取当前用户ID
+        if current_user.is_authenticated:
+            user_id = int(current_user.id)
+        else:
+            return {
+                'success': False,
+                'error': '用户未登录',
+                'action': 'auto_schedule'
+            }
+        
+        start_date, end_date = parse_date_range(data.get('start'), data.get('end'))
+        duration = parse_duration(data.get('duration'), DEFAULT_DURATION_MINUTES)
+        task_ids = parse_task_ids(data.get('task_ids'))
+        
+        conn = get_db_connection()
+        plan = auto_schedule_tasks(
+            user_id, conn, start_date, end_date,
+            duration=duration,
+            task_ids=task_ids
+        )
+        conn.close()
+        
+        return {
+            'success': True,
+            'action': 'auto_schedule',
+            'plan': plan,
+            'count': len(plan),
+            'message': f'已为{len(plan)}个任务安排时间'
+        }
+        
+    except Exception as e:
+        return {
+            'success': False,
+            'error': str(e),
+            'action': 'auto_schedule'
+        }
+
 def generate_action_response(original_response, action_results):
     """生成包含操作结果的回复"""
     if not action_results:
@@ -1428,6 +2324,8 @@ def generate_action_response(original_response, action_results):
                 response_parts.append(f'✅ {result["message"]}')
             elif result['action'] == 'search_tasks':
                 response_parts.append(f'🔍 {result["message"]}')
+            elif result['action'] == 'auto_schedule':
+                response_parts.append(f'📅 {result["message"]}')
     
     # 添加失败操作的结果
     if failed_actions:
@@ -1448,8 +2346,11 @@ def generate_action_response(original_response, action_results):
     else:
         return original_response
 
+@traced('ai.provider_call')
 def call_openai_api(messages, config):
     """调用OpenAI兼容API"""
+    started = time.perf_counter()
+    outcome = 'error'
     try:
         headers = {
             'Authorization': f'Bearer {config["assistant"]["api_key"]}',
@@ -1472,6 +2373,7 @@ def call_openai_api(messages, config):
         
         if response.status_code == 200:
             result = response.json()
+            outcome = 'success'
             return result['choices'][0]['message']['content']
         else:
             print(f"API调用失败: {response.status_code} - {response.text}")
@@ -1480,8 +2382,67 @@ def call_openai_api(messages, config):
     except Exception as e:
         print(f"API调用异常: {e}")
         return None
+    finally:
+        AI_PROVIDER_LATENCY.observe(time.perf_counter() - started, 'sync', outcome)
 
-def get_task_context():
+def call_openai_api_stream(messages, config):
+    """以流式方式调用OpenAI兼容API，逐段产出回复文本"""
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        for content in _iter_openai_stream(messages, config):
+            outcome = 'success'
+            yield content
+    finally:
+        AI_PROVIDER_LATENCY.observe(time.perf_counter() - started, 'stream', outcome)
+
+def _iter_openai_stream(messages, config):
+    """逐行读取OpenAI兼容的SSE流"""
+    headers = {
+        'Authorization': f'Bearer {config["assistant"]["api_key"]}',
+        'Content-Type': 'application/json'
+    }
+    
+    data = {
+        'model': config['assistant']['model'],
+        'messages': messages,
+        'max_tokens': config['assistant']['max_tokens'],
+        'temperature': config['assistant']['temperature'],
+        'stream': True
+    }
+    
+    with requests.post(
+        f"{config['assistant']['api_base']}/chat/completions",
+        headers=headers,
+        json=data,
+        timeout=config['assistant'].get('timeout', 30),
+        stream=True
+    ) as response:
+        if response.status_code != 200:
+            print(f"流式API调用失败: {response.status_code} - {response.text}")
+            return
+        
+        # SSE固定为UTF-8编码，服务商未声明charset时requests会按ISO-8859-1解码
+        response.encoding = 'utf-8'
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            payload = line[5:].strip()
+            if payload == '[DONE]':
+                break
+            try:
+                chunk = json.loads(payload)
+            except json.JSONDecodeError:
+                continue
+            choices = chunk.get('choices') or []
+            if not choices:
+                continue
+            content = (choices[0].get('delta') or {}).get('content')
+            if content:
+                yield content
+
+@traced('ai.task_context')
+def get_task_context(user_message=None):
     """获取当前任务数据作为AI上下文"""
     try:
         conn = get_db_connection()
@@ -1506,6 +2467,25 @@ def get_task_context():
         ''')
         recent_tasks = cursor.fetchall()
         
+        # 按语义相似度检索与用户消息相关的任务
+        related_tasks = []
+        today_slots = []
+        user_id = get_current_user_id()
+        if user_id:
+            schedule = get_schedule_index(user_id, get_user_data_version(user_id, conn), conn)
+            today_slots = schedule.free_slots(date.today(), date.today())[0]['slots']
+        if user_message and user_id:
+            matches = find_similar_tasks(user_id, user_message, conn, top_k=8, min_score=0.1)
+            if matches:
+                scores = dict(matches)
+                placeholders = ','.join('?' * len(scores))
+                cursor.execute(f'''
+                    SELECT id, title, completed, priority, due_date
+                    FROM tasks
+                    WHERE user_id = ? AND id IN ({placeholders})
+                ''', [user_id] + list(scores))
+                related_tasks = sorted(cursor.fetchall(), key=lambda row: scores[row['id']], reverse=True)
+        
         conn.close()
         
         context = f"总任务数: {total_tasks}, 已完成: {completed_tasks}, 重要待办: {important_tasks}\n"
@@ -1516,6 +2496,17 @@ def get_task_context():
             due_date = f" (截止: {task['due_date']})" if task['due_date'] else ""
             context += f"{status} {task['title']} [{priority}]{due_date}\n"
         
+        if today_slots:
+            context += "今日空闲时段: " + ", ".join(f"{s['start_time']}-{s['end_time']}" for s in today_slots) + "\n"
+        
+        if related_tasks:
+            context += "相关任务:\n"
+            for task in related_tasks:
+                status = "✓" if task['completed'] else "○"
+                priority = task['priority'] or 'medium'
+                due_date = f" (截止: {task['due_date']})" if task['due_date'] else ""
+                context += f"{status} [ID:{task['id']}] {task['title']} [{priority}]{due_date}\n"
+        
         return context
         
     except Exception as e:
@@ -2059,19 +3050,218 @@ def check_auth():
     if current_user.is_authenticated:
         return jsonify({
             'authenticated': True,
-            'user': {
-                'id': current_user.id,
-                'username': current_user.username,
-                'email': current_user.email,
-                'full_name': current_user.full_name,
-                'avatar_url': current_user.avatar_url
-            }
+            'user': user_info()
         })
     else:
         return jsonify({
             'authenticated': False
         })
 
+# 启动接口返回的默认列表首页任务数
+BOOTSTRAP_TASK_LIMIT = int(os.environ.get('BOOTSTRAP_TASK_LIMIT', '50'))
+
+def user_info():
+    """当前登录用户的公开信息"""
+    return {
+        'id': current_user.id,
+        'username': current_user.username,
+        'email': current_user.email,
+        'full_name': current_user.full_name,
+        'avatar_url': current_user.avatar_url
+    }
+
+def ai_ui_config():
+    """前端界面需要的AI配置，不包含API密钥等敏感字段"""
+    config = load_ai_config()
+    assistant = config.get('assistant', {})
+    return {
+        'name': assistant.get('name', 'AI助手'),
+        'mode': assistant.get('mode', 'smart'),
+        'welcome_message': assistant.get('welcome_message', ''),
+        'stream_response': assistant.get('stream_response', False),
+        'save_history': assistant.get('save_history', True),
+        'configured': bool(assistant.get('api_key')),
+        'features': config.get('features', {}),
+        'ui': config.get('ui', {})
+    }
+
+def build_bootstrap(user_id, limit):
+    """启动数据（不含认证状态），启动接口和服务端渲染的首页共用"""
+    conn = get_db_connection()
+    # 批量请求的共享连接由外层管理事务，不能在其上开始或提交事务
+    own_transaction = shared_connection() is None
+    try:
+        # 同一连接上的单个读事务，保证各部分数据来自同一时刻
+        if own_transaction:
+            conn.execute('BEGIN')
+        preferences = query_user_preferences(conn, user_id) or dict(DEFAULT_PREFERENCES)
+        lists = query_task_lists(conn, user_id)
+        stats = query_stats(conn, user_id)
+        
+        # 默认列表：偏好中的列表，否则"我的一天"，否则第一个列表
+        list_ids = {task_list['id'] for task_list in lists}
+        default_list_id = preferences.get('default_list_id')
+        if default_list_id not in list_ids:
+            today_list = next((task_list for task_list in lists if task_list['name'] == '我的一天'), None)
+            default_list_id = today_list['id'] if today_list else (lists[0]['id'] if lists else None)
+        
+        tasks = []
+        if default_list_id is not None:
+            # 多取一条用于判断是否还有下一页
+            tasks = query_tasks(conn, user_id, default_list_id, preferences['show_completed'], limit + 1)
+        if own_transaction:
+            conn.commit()
+    finally:
+        conn.close()
+    
+    return {
+        'user': user_info(),
+        'preferences': preferences,
+        'task_lists': lists,
+        'stats': stats,
+        'default_list_id': default_list_id,
+        'tasks': {
+            'list_id': default_list_id,
+            'items': tasks[:limit],
+            'limit': limit,
+            'has_more': len(tasks) > limit
+        },
+        'ai': {
+            'config': ai_ui_config(),
+            'history': conversation_history
+        }
+    }
+
+@app.route('/api/bootstrap')
+def bootstrap():
+    """应用启动数据：认证状态、偏好、列表、统计、默认列表首页任务和AI界面配置"""
+    if not current_user.is_authenticated:
+        return jsonify({'authenticated': False})
+    
+    limit = max(1, min(request.args.get('limit', BOOTSTRAP_TASK_LIMIT, type=int), 500))
+    result = build_bootstrap(get_current_user_id(), limit)
+    result['authenticated'] = True
+    return jsonify(result)
+
+@app.route('/api/metrics')
+def get_metrics():
+    """以Prometheus文本格式导出指标，format=json时返回各路由延迟分位数
+
+    需要携带METRICS_TOKEN（Authorization: Bearer）或以管理员登录；本地调试可设置METRICS_PUBLIC=true公开访问。
+    """
+    if not METRICS_PUBLIC:
+        authorized = bool(METRICS_TOKEN) and secrets.compare_digest(
+            request.headers.get('Authorization', '').encode('utf-8'), f'Bearer {METRICS_TOKEN}'.encode('utf-8'))
+        if not authorized and not is_admin_user():
+            return jsonify({'error': '未授权'}), 401
+    
+    if request.args.get('format') == 'json':
+        return jsonify({'routes': route_summaries()})
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+def admin_required(view):
+    """仅允许ADMIN_USERS中的已登录用户访问"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return jsonify({'error': '请先登录'}), 401
+        if not is_admin_user():
+            return jsonify({'error': '需要管理员权限'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/api/admin/traces')
+@admin_required
+def get_slow_traces():
+    """查看内存中保留的慢请求追踪摘要"""
+    min_ms = request.args.get('min_ms', 0, type=float)
+    return jsonify({
+        'slow_ms': trace_store.slow_ms,
+        'sample_rate': trace_store.sample_rate,
+        'traces': trace_store.recent(min_ms)
+    })
+
+@app.route('/api/admin/traces/<trace_id>')
+@admin_required
+def get_trace_detail(trace_id):
+    """查看单个慢请求追踪的完整span树"""
+    trace = trace_store.get(trace_id)
+    if trace is None:
+        return jsonify({'error': '追踪不存在或已被淘汰'}), 404
+    return jsonify(trace)
+
+@app.route('/api/admin/profiles')
+@admin_required
+def get_request_profiles():
+    """列出通过X-Profile头生成的请求分析结果"""
+    return jsonify({'profiles': list_profiles(limit=request.args.get('limit', 50, type=int))})
+
+@app.route('/api/admin/profiles/<filename>')
+@admin_required
+def get_request_profile_file(filename):
+    """下载pstats/collapsed文件，pstats加format=text时返回文本报告"""
+    path = profile_file_path(filename)
+    if path is None:
+        return jsonify({'error': '分析结果不存在'}), 404
+    if filename.endswith('.pstats') and request.args.get('format') == 'text':
+        sort = request.args.get('sort', 'cumulative')
+        if sort not in ('cumulative', 'tottime', 'ncalls'):
+            return jsonify({'error': '无效的排序字段'}), 400
+        report = format_pstats(path, sort, request.args.get('limit', 40, type=int))
+        return Response(report, mimetype='text/plain; charset=utf-8')
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=filename)
+
+@app.route('/api/admin/sampling')
+@admin_required
+def get_sampling_profile():
+    """常驻采样分析器的各路由热点帧，format=collapsed时返回火焰图输入"""
+    window = request.args.get('window', type=int)
+    route = request.args.get('route')
+    if request.args.get('format') == 'collapsed':
+        return Response(sampling_profiler.collapsed(window, route), mimetype='text/plain; charset=utf-8')
+    return jsonify(sampling_profiler.report(window, route, request.args.get('top', 20, type=int)))
+
+@app.route('/api/admin/memory')
+@admin_required
+def get_memory_report():
+    """进程内存、各缓存大小和tracemalloc占用最多的分配位置"""
+    return jsonify(memory_report(request.args.get('top', 20, type=int)))
+
+@app.route('/api/admin/memory/tracemalloc', methods=['POST'])
+@admin_required
+def toggle_tracemalloc():
+    """开启或关闭tracemalloc（开启后有额外的内存和CPU开销）"""
+    data = request.get_json() or {}
+    if data.get('enabled'):
+        try:
+            frames = parse_tracemalloc_frames(data.get('frames'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        start_tracemalloc(frames)
+    else:
+        stop_tracemalloc()
+    return jsonify({'success': True, 'tracing': bool(data.get('enabled'))})
+
+@app.route('/api/admin/memory/snapshots', methods=['POST'])
+@admin_required
+def create_memory_snapshot():
+    """保存一个内存快照，供之后比较"""
+    data = request.get_json(silent=True) or {}
+    return jsonify(take_snapshot(data.get('label')).summary())
+
+@app.route('/api/admin/memory/diff')
+@admin_required
+def get_memory_diff():
+    """比较两个快照（未指定to时与当前状态比较）"""
+    old = get_snapshot(request.args.get('from', ''))
+    if old is None:
+        return jsonify({'error': '起始快照不存在'}), 404
+    to_id = request.args.get('to')
+    new = get_snapshot(to_id) if to_id else MemorySnapshot('current')
+    if new is None:
+        return jsonify({'error': '目标快照不存在'}), 404
+    return jsonify(diff_snapshots(old, new, request.args.get('top', 20, type=int)))
+
 # 登录和注册页面
 @app.route('/login')
 def login_page():
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+静态资源构建 - 抽取模板中的内联CSS/JS，压缩后按内容哈希命名，生成资源清单并改写模板和Service Worker
+
+构建: python asset_pipeline.py
+输出static/dist/（带哈希的资源、sw.js、asset-manifest.json和预压缩文件）与build/templates/（改写后的模板）。
+应用启动时存在资源清单则使用构建后的模板，带哈希的资源以Cache-Control: immutable返回。
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+from compression import precompress_directory
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
+# 构建后模板的输出目录
+ASSET_BUILD_DIR = os.environ.get('ASSET_BUILD_DIR', os.path.join(BASE_DIR, 'build'))
+BUILD_TEMPLATE_DIR = os.path.join(ASSET_BUILD_DIR, 'templates')
+# 存在构建结果时是否使用（关闭后直接使用源模板和源文件，便于开发调试）
+ASSETS_ENABLED = os.environ.get('ASSETS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+# static下的构建输出子目录
+DIST_NAME = 'dist'
+MANIFEST_NAME = 'asset-manifest.json'
+SERVICE_WORKER = 'sw.js'
+# 带哈希资源的缓存时长（一年）
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+HASH_LENGTH = 10
+# 参与构建的静态文件扩展名
+ASSET_EXTENSIONS = ('.js', '.css', '.json')
+
+# ---------- 压缩 ----------
+
+def minify_css(text):
+    """去除注释和多余空白（字符串内容保持不变）"""
+    out = []
+    pending_space = False
+    i, n = 0, len(text)
+    while i < n:
+        c = text[i]
+        if c == '/' and text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+            pending_space = True
+            continue
+        if c in '"\'':
+            end = i + 1
+            while end < n and text[end] != c:
+                end += 2 if text[end] == '\\' else 1
+            if pending_space and out and out[-1][-1] not in '{};,>:(':
+                out.append(' ')
+            pending_space = False
+            out.append(text[i:end + 1])
+            i = end + 1
+            continue
+        if c.isspace():
+            pending_space = True
+            i += 1
+            continue
+        if pending_space and out and out[-1][-1] not in '{};,>:' and c not in '{};,>':
+            out.append(' ')
+        pending_space = False
+        if c == '}' and out and out[-1] == ';':
+            out.pop()
+        out.append(c)
+        i += 1
+    return ''.join(out).strip()
+
+# 其后出现的/是正则字面量而非除号的关键字
+_REGEX_KEYWORDS = {'return', 'typeof', 'case', 'do', 'else', 'in', 'instanceof', 'new', 'delete', 'void',
+                   'throw', 'yield', 'await'}
+# 行尾或下一行开头是这些字符时换行可以去掉（不会改变自动分号插入的结果）
+_JOIN_AFTER = set('{[(,;=:&|?*%<>!~^')
+_JOIN_BEFORE = set('}]),.;:?&|=')
+
+def _is_word_char(c):
+    return c.isalnum() or c in '_$' or ord(c) > 127
+
+def _needs_space(prev, c):
+    if _is_word_char(prev) and _is_word_char(c):
+        return True
+    # a + +b、a - -b、1 .toFixed()、除号后的注释起始
+    return (prev in '+-' and c in '+-') or (prev.isdigit() and c == '.') or (prev == '/' and c in '/*')
+
+def minify_js(text):
+    """保守的JS压缩：去除注释、缩进和空行，不改写标识符；字符串、模板字符串和正则保持原样"""
+    out = []
+    pending = None
+    last_word = ''
+    # 模板字符串中${}表达式的花括号深度栈
+    templates = []
+    i, n = 0, len(text)
+
+    def emit(piece):
+        nonlocal pending
+        if pending is not None and out:
+            prev = out[-1][-1]
+            if '\n' in pending and prev not in _JOIN_AFTER and piece[0] not in _JOIN_BEFORE:
+                out.append('\n')
+            elif _needs_space(prev, piece[0]):
+                out.append(' ')
+        pending = None
+        out.append(piece)
+
+    def scan_template(start):
+        """从start开始扫描模板字符串正文，返回(结束位置, 是否进入${表达式)"""
+        j = start
+        while j < n:
+            if text[j] == '\\':
+                j += 2
+            elif text[j] == '`':
+                return j + 1, False
+            elif text.startswith('${', j):
+                return j + 2, True
+            else:
+                j += 1
+        return n, False
+
+    while i < n:
+        c = text[i]
+        if c.isspace():
+            pending = (pending or '') + c
+            i += 1
+            continue
+        if c == '/' and text.startswith('//', i):
+            end = text.find('\n', i)
+            i = n if end < 0 else end
+            pending = (pending or '') + ' '
+            continue
+        if c == '/' and text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            comment = text[i:n if end < 0 else end + 2]
+            i = n if end < 0 else end + 2
+            pending = (pending or '') + ('\n' if '\n' in comment else ' ')
+            continue
+        if c in '"\'':
+            end = i + 1
+            while end < n and text[end] != c and text[end] != '\n':
+                end += 2 if text[end] == '\\' else 1
+            emit(text[i:end + 1])
+            i = end + 1
+            last_word = ''
+            continue
+        if c == '`' or (c == '}' and templates and templates[-1] == 0):
+            if c == '}':
+                templates.pop()
+            end, in_expression = scan_template(i + 1)
+            emit(text[i:end])
+            if in_expression:
+                templates.append(0)
+            i = end
+            last_word = ''
+            continue
+        if c == '/':
+            prev = out[-1][-1] if out else ''
+            is_regex = not prev or (prev not in ')]' and not _is_word_char(prev)) or last_word in _REGEX_KEYWORDS
+            if is_regex:
+                end = i + 1
+                in_class = False
+                while end < n and text[end] != '\n':
+                    ch = text[end]
+                    if ch == '\\':
+                        end += 2
+                        continue
+                    if ch == '[':
+                        in_class = True
+                    elif ch == ']':
+                        in_class = False
+                    elif ch == '/' and not in_class:
+                        break
+                    end += 1
+                end += 1
+                while end < n and _is_word_char(text[end]):
+                    end += 1
+                emit(text[i:end])
+                i = end
+                last_word = ''
+                continue
+        if _is_word_char(c):
+            end = i + 1
+            while end < n and _is_word_char(text[end]):
+                end += 1
+            last_word = text[i:end]
+            emit(last_word)
+            i = end
+            continue
+        if templates:
+            if c == '{':
+                templates[-1] += 1
+            elif c == '}':
+                templates[-1] -= 1
+        emit(c)
+        i += 1
+        last_word = ''
+    return ''.join(out).strip()
+
+def minify_json(text):
+    return json.dumps(json.loads(text), ensure_ascii=False, separators=(',', ':'))
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js, '.json': minify_json}
+
+# ---------- 构建 ----------
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+def static_url(path):
+    return '/static/' + path.replace(os.sep, '/')
+
+class AssetBuild:
+    """一次构建：写出带哈希的资源并记录逻辑名到输出路径（相对static目录）的映射"""
+
+    def __init__(self, static_dir=STATIC_DIR, template_dir=TEMPLATE_DIR, build_template_dir=BUILD_TEMPLATE_DIR):
+        self.static_dir = static_dir
+        self.template_dir = template_dir
+        self.build_template_dir = build_template_dir
+        self.dist_dir = os.path.join(static_dir, DIST_NAME)
+        self.assets = {}
+        self.sizes = {}
+
+    def add(self, name, text):
+        """压缩并写出一个资源，返回输出路径"""
+        stem, ext = os.path.splitext(name)
+        minified = MINIFIERS[ext](text).encode('utf-8')
+        path = f'{DIST_NAME}/{stem}.{content_hash(minified)}{ext}'
+        target = os.path.join(self.static_dir, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(minified)
+        self.assets[name] = path
+        self.sizes[name] = (len(text.encode('utf-8')), len(minified))
+        return path
+
+    def build_static(self):
+        for root, dirs, files in os.walk(self.static_dir):
+            dirs[:] = [name for name in dirs if os.path.join(root, name) != self.dist_dir]
+            for filename in sorted(files):
+                name = os.path.relpath(os.path.join(root, filename), self.static_dir).replace(os.sep, '/')
+                if name == SERVICE_WORKER or not filename.endswith(ASSET_EXTENSIONS):
+                    continue
+                with open(os.path.join(root, filename), 'r', encoding='utf-8') as f:
+                    self.add(name, f.read())
+
+    def rewrite_template(self, filename):
+        """内联的<style>/<script>抽取为外部资源，引用的本地静态文件改为带哈希的地址"""
+        with open(os.path.join(self.template_dir, filename), 'r', encoding='utf-8') as f:
+            html = f.read()
+        stem = os.path.splitext(filename)[0]
+        counters = {}
+
+        def extract(kind, content):
+            counters[kind] = counters.get(kind, 0) + 1
+            suffix = '' if counters[kind] == 1 else f'-{counters[kind]}'
+            return static_url(self.add(f'inline/{stem}{suffix}.{kind}', content))
+
+        def replace_style(match):
+            attrs, content = match.group(1) or '', match.group(2)
+            # 含模板语法或非CSS的块保留内联
+            if '{{' in content or '{%' in content or ('type=' in attrs and 'text/css' not in attrs):
+                return match.group(0)
+            return f'<link rel="stylesheet" href="{extract("css", content)}">'
+
+        def replace_script(match):
+            attrs, content = match.group(1) or '', match.group(2)
+            if 'src=' in attrs or not content.strip() or '{{' in content or '{%' in content:
+                return match.group(0)
+            if 'type=' in attrs and not re.search(r'type=["\'](text/javascript|module)["\']', attrs):
+                return match.group(0)
+            return f'<script{attrs} src="{extract("js", content)}"></script>'
+
+        def replace_url(match):
+            path = self.assets.get(match.group(2))
+            return match.group(0) if path is None else f'{match.group(1)}="{static_url(path)}"'
+
+        html = re.sub(r'<style(\s[^>]*)?>(.*?)</style>', replace_style, html, flags=re.S)
+        html = re.sub(r'<script(\s[^>]*)?>(.*?)</script>', replace_script, html, flags=re.S)
+        html = re.sub(r'\b(href|src)="/static/([^"?#]+)"', replace_url, html)
+
+        os.makedirs(self.build_template_dir, exist_ok=True)
+        with open(os.path.join(self.build_template_dir, filename), 'w', encoding='utf-8') as f:
+            f.write(html)
+
+    def build_service_worker(self, version):
+        """按资源清单生成Service Worker的预缓存列表和缓存版本"""
+        with open(os.path.join(self.static_dir, SERVICE_WORKER), 'r', encoding='utf-8') as f:
+            source = f.read()
+        match = re.search(r'const STATIC_ASSETS = \[(.*?)\];', source, re.S)
+        precache = []
+        for entry in re.findall(r"'([^']+)'", match.group(1)):
+            if entry.startswith('/static/'):
+                entry = static_url(self.assets.get(entry[len('/static/'):], entry[len('/static/'):]))
+            precache.append(entry)
+        for path in self.assets.values():
+            if static_url(path) not in precache:
+                precache.append(static_url(path))
+        source = source[:match.start(1)] + '\n' + ',\n'.join(f"  '{entry}'" for entry in precache) + '\n' + \
+            source[match.end(1):]
+        # 缓存名中的版本号改为构建版本，激活时清理旧版本缓存
+        source = re.sub(r"(const \w+ = '[\w-]+?-)v[\w.]+(')", rf'\g<1>{version}\g<2>', source)
+        path = f'{DIST_NAME}/{SERVICE_WORKER}'
+        with open(os.path.join(self.static_dir, path), 'w', encoding='utf-8') as f:
+            f.write(minify_js(source))
+        return path
+
+    def run(self):
+        if os.path.isdir(self.dist_dir):
+            shutil.rmtree(self.dist_dir)
+        if os.path.isdir(self.build_template_dir):
+            shutil.rmtree(self.build_template_dir)
+        self.build_static()
+        templates = sorted(name for name in os.listdir(self.template_dir) if name.endswith('.html'))
+        for filename in templates:
+            self.rewrite_template(filename)
+
+        version = content_hash(json.dumps(self.assets, sort_keys=True).encode('utf-8'))
+        manifest = {
+            'version': version,
+            'assets': self.assets,
+            'aliases': {SERVICE_WORKER: self.build_service_worker(version)},
+            'templates': templates
+        }
+        with open(os.path.join(self.dist_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        precompress_directory(self.dist_dir, force=True)
+        return manifest
+
+# ---------- 运行时 ----------
+
+def load_manifest(static_dir=STATIC_DIR):
+    """读取资源清单，未构建或已关闭时返回None；源文件比构建结果新时输出提醒"""
+    path = os.path.join(static_dir, DIST_NAME, MANIFEST_NAME)
+    if not ASSETS_ENABLED or not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    built_at = os.path.getmtime(path)
+    sources = [os.path.join(TEMPLATE_DIR, name) for name in manifest['templates']]
+    sources += [os.path.join(static_dir, name) for name in list(manifest['assets']) + list(manifest['aliases'])
+                if not name.startswith('inline/')]
+    if any(os.path.exists(source) and os.path.getmtime(source) > built_at for source in sources):
+        print('⚠️ 静态资源构建结果已过期，请重新运行 python asset_pipeline.py')
+    manifest['immutable'] = set(manifest['assets'].values())
+    return manifest
+
+def resolve_static(manifest, filename):
+    """把静态文件请求映射到构建结果，返回(文件名, 是否为带哈希的不可变资源)"""
+    if manifest is None:
+        return filename, False
+    filename = manifest['aliases'].get(filename, filename)
+    return filename, filename in manifest['immutable']
+
+def main():
+    parser = argparse.ArgumentParser(description='构建静态资源')
+    parser.parse_args()
+
+    build = AssetBuild()
+    manifest = build.run()
+    for name, path in manifest['assets'].items():
+        original, minified = build.sizes[name]
+        print(f'{name} -> {path} {original:,} -> {minified:,} 字节 ({minified / original:.0%})')
+    print(f"构建版本 {manifest['version']}，共 {len(manifest['assets'])} 个资源，"
+          f"模板输出到 {os.path.relpath(BUILD_TEMPLATE_DIR, BASE_DIR)}")
+
+if __name__ == '__main__':
+    main()
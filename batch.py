@@ -0,0 +1,176 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from flask import g, request
+from werkzeug.exceptions import HTTPException
+from werkzeug.test import EnvironBuilder
+from tracing import span
+
+# 单次批量请求最多包含的子请求数
+BATCH_MAX_REQUESTS = int(os.environ.get('BATCH_MAX_REQUESTS', '20'))
+# 并发执行只读子请求的线程数（1为全部顺序执行）
+BATCH_READ_WORKERS = int(os.environ.get('BATCH_READ_WORKERS', '4'))
+
+ALLOWED_METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE')
+# 只读方法的子请求可以并发执行，写请求按顺序执行并作为并发分组的边界
+READ_METHODS = ('GET', 'HEAD')
+# 从外层请求转发给子请求的请求头
+FORWARDED_HEADERS = ('Cookie', 'Authorization', 'Accept-Language', 'User-Agent')
+# 子请求可以单独携带的请求头
+SUBREQUEST_HEADERS = ('Idempotency-Key',)
+# 子请求WSGI环境中的标记，请求钩子据此跳过子请求
+SUBREQUEST_KEY = 'todo.batch_subrequest'
+# 始终返回流式响应（SSE）的接口，批量请求无法等待其结束
+STREAMING_PATHS = ('/api/changes/stream',)
+
+_local = threading.local()
+_executor = None
+_executor_lock = threading.Lock()
+
+class SharedConnection:
+    """批量请求内共享的数据库连接，子请求调用close()时不真正关闭"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def close(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+def shared_connection():
+    """当前线程正在执行的批量请求的共享连接，不在批量请求中时返回None"""
+    return getattr(_local, 'connection', None)
+
+def is_subrequest():
+    """当前请求是否是批量请求中的子请求"""
+    return bool(request.environ.get(SUBREQUEST_KEY))
+
+@contextmanager
+def connection_scope(connect):
+    """在当前线程内共享一个新连接，结束时回滚未提交的事务并关闭"""
+    conn = connect()
+    _local.connection = SharedConnection(conn)
+    try:
+        yield conn
+    finally:
+        _local.connection = None
+        if conn.in_transaction:
+            conn.rollback()
+        conn.close()
+
+def parse_batch(data):
+    """校验批量请求体，返回[{method, path, body, headers}]；格式错误时抛出ValueError"""
+    items = data.get('requests') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        raise ValueError('requests必须是非空数组')
+    if len(items) > BATCH_MAX_REQUESTS:
+        raise ValueError(f'单次最多{BATCH_MAX_REQUESTS}个子请求')
+
+    result = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f'第{index + 1}个子请求格式错误')
+        method = str(item.get('method', 'GET')).upper()
+        path = item.get('path')
+        if method not in ALLOWED_METHODS:
+            raise ValueError(f'第{index + 1}个子请求的方法不支持: {method}')
+        if not isinstance(path, str) or not path.startswith('/api/'):
+            raise ValueError(f'第{index + 1}个子请求的路径必须以/api/开头')
+        if path.split('?', 1)[0].rstrip('/') == '/api/batch':
+            raise ValueError('不支持嵌套批量请求')
+        if path.split('?', 1)[0].rstrip('/') in STREAMING_PATHS:
+            raise ValueError(f'第{index + 1}个子请求的接口是流式响应，不支持批量执行')
+        headers = item.get('headers') or {}
+        if not isinstance(headers, dict):
+            raise ValueError(f'第{index + 1}个子请求的headers必须是对象')
+        headers = [(name, str(value)) for name, value in headers.items()
+                   if name.title() in SUBREQUEST_HEADERS and value is not None]
+        result.append({'method': method, 'path': path, 'body': item.get('body'), 'headers': headers})
+    return result
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=BATCH_READ_WORKERS, thread_name_prefix='batch-read')
+        return _executor
+
+def _serialize(response):
+    data = response.get_data()
+    if response.is_json:
+        body = response.get_json(silent=True)
+    else:
+        body = data.decode('utf-8', errors='replace')
+    return {'status': response.status_code, 'body': body}
+
+def dispatch(app, item, user, headers, base_url):
+    """通过URL映射执行一个子请求（不经过before/after_request钩子），返回{status, body}"""
+    path, _, query_string = item['path'].partition('?')
+    builder = EnvironBuilder(path=path, query_string=query_string, method=item['method'],
+                             json=item['body'], headers=headers + item.get('headers', []), base_url=base_url)
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+    environ[SUBREQUEST_KEY] = True
+
+    with app.request_context(environ):
+        # 子请求沿用外层请求的登录用户，不再从会话重新加载
+        g._login_user = user
+        try:
+            response = app.make_response(app.dispatch_request())
+            if response.is_streamed:
+                # 流式响应（如开启流式输出的AI对话）读取时会一直阻塞，关闭生成器后拒绝
+                response.close()
+                result = {'status': 501, 'body': {'error': '批量请求不支持流式响应的接口'}}
+            else:
+                result = _serialize(response)
+        except HTTPException as e:
+            result = {'status': e.code, 'body': {'error': e.description}}
+        except Exception as e:
+            print(f"批量子请求执行失败 {item['method']} {item['path']}: {e}")
+            result = {'status': 500, 'body': {'error': '服务器内部错误'}}
+        finally:
+            # 子请求出错时可能留下未提交的写入，不能让后续子请求一并提交
+            conn = shared_connection()
+            if conn is not None and conn.in_transaction:
+                conn.rollback()
+    return result
+
+def _run_chunk(app, items, indexes, connect, user, headers, base_url):
+    with connection_scope(connect):
+        return [(index, dispatch(app, items[index], user, headers, base_url)) for index in indexes]
+
+def execute_batch(app, items, connect, user):
+    """按顺序执行子请求：连续的只读子请求分组并发执行，写请求在共享连接上顺序执行"""
+    headers = [(name, request.headers[name]) for name in FORWARDED_HEADERS if name in request.headers]
+    base_url = request.host_url
+    results = [None] * len(items)
+
+    with connection_scope(connect):
+        index = 0
+        while index < len(items):
+            end = index
+            while end < len(items) and items[end]['method'] in READ_METHODS:
+                end += 1
+            if end - index >= 2 and BATCH_READ_WORKERS > 1:
+                # 按工作线程轮流分配，每个线程在自己的连接上顺序执行分到的子请求
+                workers = min(BATCH_READ_WORKERS, end - index)
+                chunks = [list(range(index + offset, end, workers)) for offset in range(workers)]
+                with span('batch.reads', count=end - index, workers=workers):
+                    futures = [_get_executor().submit(_run_chunk, app, items, chunk, connect, user, headers, base_url)
+                               for chunk in chunks]
+                    for future in futures:
+                        for position, result in future.result():
+                            results[position] = result
+                index = end
+            else:
+                item = items[index]
+                with span('batch.request', method=item['method'], path=item['path']) as request_span:
+                    results[index] = dispatch(app, item, user, headers, base_url)
+                    request_span.set('status', results[index]['status'])
+                index += 1
+    return results
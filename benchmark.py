@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+接口基准测试 - 针对生成的数据集测量各接口吞吐量与延迟分位数
+
+默认使用Flask测试客户端（进程内），--socket 时启动真实HTTP服务并发压测。
+结果可保存为基线JSON，之后的运行与基线比较，超过回退阈值时以非零状态退出。
+示例:
+    python generate_data.py --db bench.db --users 2000 --tasks-per-list poisson:80
+    python benchmark.py --db bench.db --save-baseline
+    python benchmark.py --db bench.db --threshold 0.15
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+import numpy as np
+from stub_provider import StubConfig, start_stub_server
+
+DEFAULT_BASELINE_DIR = 'benchmarks'
+DEFAULT_PASSWORD = 'password123'
+
+SCENARIOS = ['tasks', 'task_lists', 'stats', 'search', 'calendar_week', 'tasks_batch', 'refresh_batch', 'login', 'ai_chat']
+
+# 回退判定使用的指标：(字段, 数值越大越差)
+REGRESSION_FIELDS = [('p50_ms', True), ('p95_ms', True), ('throughput', False)]
+
+class BenchUser:
+    """一个已登录的压测用户及其数据"""
+
+    def __init__(self, user_id, username, task_ids):
+        self.user_id = user_id
+        self.username = username
+        self.task_ids = task_ids
+        self.client = None
+
+def load_bench_users(db_path, count, rng):
+    """从数据集中抽取有任务的用户"""
+    conn = sqlite3.connect(db_path)
+    user_ids = [row[0] for row in conn.execute(
+        'SELECT DISTINCT user_id FROM tasks ORDER BY user_id')]
+    if not user_ids:
+        raise SystemExit(f'{db_path} 中没有任务数据，请先运行 generate_data.py')
+    chosen = sorted(rng.sample(user_ids, min(count, len(user_ids))))
+    users = []
+    for user_id in chosen:
+        username = conn.execute('SELECT username FROM users WHERE id = ?', (user_id,)).fetchone()[0]
+        task_ids = [row[0] for row in conn.execute(
+            'SELECT id FROM tasks WHERE user_id = ? ORDER BY id LIMIT 200', (user_id,))]
+        users.append(BenchUser(user_id, username, task_ids))
+    conn.close()
+    return users
+
+def build_request(scenario, user, rng, week_start):
+    """返回(方法, 路径, JSON请求体)"""
+    if scenario == 'tasks':
+        return 'GET', '/api/tasks', None
+    if scenario == 'task_lists':
+        return 'GET', '/api/task_lists', None
+    if scenario == 'stats':
+        return 'GET', '/api/stats', None
+    if scenario == 'search':
+        return 'GET', f"/api/search?q={rng.choice(['报告', '会议', 'review', '项目', 'plan'])}", None
+    if scenario == 'calendar_week':
+        start = week_start + timedelta(weeks=rng.randint(-4, 4))
+        return 'GET', f'/api/calendar/week?week_start={start.isoformat()}', None
+    if scenario == 'tasks_batch':
+        ids = rng.sample(user.task_ids, min(10, len(user.task_ids)))
+        return 'POST', '/api/tasks/batch', {'updates': [
+            {'id': task_id, 'is_important': rng.randint(0, 1)} for task_id in ids]}
+    if scenario == 'refresh_batch':
+        # 切换完成状态后刷新任务、列表和统计，合并为一次批量请求
+        return 'POST', '/api/batch', {'requests': [
+            {'method': 'PUT', 'path': f'/api/tasks/{rng.choice(user.task_ids)}', 'body': {'completed': rng.randint(0, 1)}},
+            {'method': 'GET', 'path': '/api/tasks'},
+            {'method': 'GET', 'path': '/api/task_lists'},
+            {'method': 'GET', 'path': '/api/stats'}]}
+    if scenario == 'login':
+        return 'POST', '/api/auth/login', {'username': user.username, 'password': DEFAULT_PASSWORD}
+    if scenario == 'ai_chat':
+        return 'POST', '/api/ai/chat', {'message': '帮我找一下报告相关的任务'}
+    raise ValueError(f'未知场景: {scenario}')
+
+def summarize(latencies, errors, elapsed):
+    values = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+        'max_ms': round(float(values.max()), 3)
+    }
+
+class ClientRunner:
+    """使用Flask测试客户端顺序发送请求"""
+
+    def __init__(self, app, users):
+        self.users = users
+        for user in users:
+            user.client = app.test_client()
+            response = user.client.post('/api/auth/login',
+                                        json={'username': user.username, 'password': DEFAULT_PASSWORD})
+            if response.status_code != 200:
+                raise SystemExit(f'用户 {user.username} 登录失败: {response.status_code}')
+
+    def run(self, requests_list):
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        for user, (method, path, body) in requests_list:
+            begin = time.perf_counter()
+            response = user.client.open(path, method=method, json=body)
+            response.get_data()
+            latencies.append(time.perf_counter() - begin)
+            if response.status_code >= 400:
+                errors += 1
+        return latencies, errors, time.perf_counter() - started
+
+    def close(self):
+        pass
+
+class SocketRunner:
+    """启动真实HTTP服务，用线程池并发发送请求"""
+
+    def __init__(self, app, users, concurrency):
+        import requests
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}'
+        self.concurrency = concurrency
+        for user in users:
+            user.client = requests.Session()
+            response = user.client.post(f'{self.base_url}/api/auth/login',
+                                        json={'username': user.username, 'password': DEFAULT_PASSWORD})
+            if response.status_code != 200:
+                raise SystemExit(f'用户 {user.username} 登录失败: {response.status_code}')
+
+    def _send(self, item):
+        user, (method, path, body) = item
+        begin = time.perf_counter()
+        response = user.client.request(method, self.base_url + path, json=body)
+        return time.perf_counter() - begin, response.status_code >= 400
+
+    def run(self, requests_list):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            results = list(pool.map(self._send, requests_list))
+        elapsed = time.perf_counter() - started
+        return [latency for latency, _ in results], sum(1 for _, failed in results if failed), elapsed
+
+    def close(self):
+        self.server.shutdown()
+
+def load_app(db_path, api_base, stream=False):
+    """在指定数据集上导入应用，并把AI服务指向本地桩"""
+    os.environ['DATABASE_PATH'] = db_path
+    import app as app_module
+
+    base_config = app_module.load_ai_config
+
+    def bench_ai_config():
+        config = base_config()
+        config['assistant'].update({'api_key': 'bench', 'api_base': api_base, 'stream_response': stream})
+        return config
+
+    app_module.load_ai_config = bench_ai_config
+    app_module.app.logger.disabled = True
+    return app_module
+
+def run_benchmarks(args):
+    rng = random.Random(args.seed)
+    users = load_bench_users(args.db, args.users, rng)
+
+    # 在数据集副本上运行，写操作不影响原始数据
+    work_dir = tempfile.mkdtemp(prefix='bench-')
+    db_copy = os.path.join(work_dir, os.path.basename(args.db))
+    shutil.copyfile(args.db, db_copy)
+
+    api_base = args.api_base
+    if not api_base:
+        stub = start_stub_server(StubConfig(latency=args.ai_latency, chunk_latency=args.ai_chunk_latency,
+                                            seed=args.seed))
+        api_base = stub.api_base
+    app_module = load_app(db_copy, api_base, args.ai_stream)
+    if args.profile_sql:
+        app_module.sql_profiler.sample_rate = 1.0
+
+    runner = (SocketRunner(app_module.app, users, args.concurrency) if args.socket
+              else ClientRunner(app_module.app, users))
+    week_start = date.today() - timedelta(days=date.today().weekday())
+    results = {}
+    try:
+        for scenario in args.scenarios:
+            count = max(args.requests // 10, 1) if scenario == 'ai_chat' else args.requests
+            requests_list = [(user, build_request(scenario, user, rng, week_start))
+                             for user in (rng.choice(users) for _ in range(count + args.warmup))]
+            runner.run(requests_list[:args.warmup])
+            latencies, errors, elapsed = runner.run(requests_list[args.warmup:])
+            results[scenario] = summarize(latencies, errors, elapsed)
+            print(format_row(scenario, results[scenario]), flush=True)
+    finally:
+        runner.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+def format_row(scenario, result):
+    return (f"{scenario:<14} {result['requests']:>6} {result['errors']:>5} {result['throughput']:>10.1f} "
+            f"{result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} {result['max_ms']:>9.2f}")
+
+def compare_with_baseline(results, baseline, threshold):
+    """与基线逐项比较，返回回退描述列表"""
+    regressions = []
+    for scenario, result in results.items():
+        base = baseline.get('results', {}).get(scenario)
+        if not base:
+            continue
+        for field, higher_is_worse in REGRESSION_FIELDS:
+            old, new = base.get(field), result.get(field)
+            if not old or new is None:
+                continue
+            change = (new - old) / old if higher_is_worse else (old - new) / old
+            if change > threshold:
+                regressions.append(f'{scenario}.{field}: {old} -> {new} ({change:+.1%})')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='接口基准测试')
+    parser.add_argument('--db', default='bench.db', help='generate_data.py生成的数据集')
+    parser.add_argument('--name', default='default', help='基线名称')
+    parser.add_argument('--baseline-dir', default=DEFAULT_BASELINE_DIR, help='基线保存目录')
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果保存为基线')
+    parser.add_argument('--threshold', type=float, default=0.2, help='允许的回退比例（0.2即20%%）')
+    parser.add_argument('--scenarios', type=lambda value: value.split(','), default=SCENARIOS,
+                        help=f"逗号分隔的场景（默认全部: {','.join(SCENARIOS)}）")
+    parser.add_argument('--requests', type=int, default=200, help='每个场景的请求数')
+    parser.add_argument('--warmup', type=int, default=10, help='每个场景的预热请求数')
+    parser.add_argument('--users', type=int, default=20, help='参与压测的用户数')
+    parser.add_argument('--seed', type=int, default=1, help='请求序列的随机种子')
+    parser.add_argument('--socket', action='store_true', help='启动真实HTTP服务并发压测')
+    parser.add_argument('--concurrency', type=int, default=8, help='--socket模式下的并发数')
+    parser.add_argument('--api-base', help='AI服务地址（默认启动stub_provider本地桩）')
+    parser.add_argument('--ai-latency', default='fixed:0', help='本地桩的响应延迟分布（毫秒）')
+    parser.add_argument('--ai-chunk-latency', default='fixed:0', help='本地桩流式每段间隔分布（毫秒）')
+    parser.add_argument('--ai-stream', action='store_true', help='聊天场景使用流式回复')
+    parser.add_argument('--no-profile-sql', dest='profile_sql', action='store_false',
+                        help='关闭SQL语句分析（默认全量开启，统计写入SQL_PROFILE_DIR）')
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知场景: {', '.join(sorted(unknown))}")
+    if not os.path.exists(args.db):
+        parser.error(f'数据集 {args.db} 不存在，请先运行 generate_data.py')
+
+    print(f"{'场景':<12} {'请求数':>5} {'错误':>4} {'吞吐req/s':>9} {'p50ms':>9} {'p95ms':>9} "
+          f"{'p99ms':>9} {'最大ms':>7}")
+    results = run_benchmarks(args)
+
+    record = {
+        'name': args.name,
+        'created_at': datetime.now().isoformat(),
+        'dataset': os.path.basename(args.db),
+        'mode': 'socket' if args.socket else 'client',
+        'concurrency': args.concurrency if args.socket else 1,
+        'requests': args.requests,
+        'ai_stream': args.ai_stream,
+        'profile_sql': args.profile_sql,
+        'results': results
+    }
+    baseline_path = os.path.join(args.baseline_dir, f'{args.name}.json')
+
+    if args.save_baseline:
+        os.makedirs(args.baseline_dir, exist_ok=True)
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False, indent=2)
+        print(f'已保存基线: {baseline_path}')
+        return 0
+
+    if not os.path.exists(baseline_path):
+        print(f'没有基线 {baseline_path}，使用 --save-baseline 创建')
+        return 0
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('mode') != record['mode']:
+        print(f"警告: 基线模式为 {baseline.get('mode')}，本次为 {record['mode']}")
+    if baseline.get('profile_sql', False) != record['profile_sql']:
+        print('警告: 基线与本次的SQL语句分析开关不同，延迟不可直接比较')
+
+    regressions = compare_with_baseline(results, baseline, args.threshold)
+    if regressions:
+        print(f'发现性能回退（阈值 {args.threshold:.0%}）:')
+        for line in regressions:
+            print(f'  {line}')
+        return 1
+    print(f'未发现超过 {args.threshold:.0%} 的性能回退')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
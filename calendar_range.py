@@ -0,0 +1,201 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from recurrence import load_recurring_occurrences
+from memory_monitor import register_cache
+
+# 紧凑格式中每个任务数组的列顺序
+TASK_COLUMNS = ['id', 'title', 'description', 'completed', 'priority', 'due_date',
+                'start_time', 'end_time', 'list_id', 'is_important', 'recurrence_rule']
+
+# 各粒度下的分桶表达式（在SQL中计算）
+BUCKET_EXPRESSIONS = {
+    'day': 'due_date',
+    'week': "date(due_date, 'weekday 0', '-6 days')",
+    'month': "strftime('%Y-%m-01', due_date)"
+}
+
+# 单个范围请求允许的最大天数
+MAX_RANGE_DAYS = 370
+# 每个用户缓存的窗口数量
+CACHE_WINDOWS_PER_USER = 8
+# 后台预取相邻窗口的线程数
+PREFETCH_WORKERS = int(os.environ.get('CALENDAR_PREFETCH_WORKERS', '2'))
+# 排队中的预取窗口上限，超过后跳过新的预取
+PREFETCH_MAX_PENDING = int(os.environ.get('CALENDAR_PREFETCH_MAX_PENDING', '64'))
+
+_executor = None
+_executor_lock = threading.Lock()
+# 已提交但尚未完成的预取{(用户ID, 数据版本, 窗口键)}
+_pending = set()
+
+def query_calendar_range(conn, user_id, start_date, end_date, granularity='day'):
+    """在SQL中按粒度分桶，返回紧凑的日历范围数据"""
+    bucket = BUCKET_EXPRESSIONS[granularity]
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT {bucket} AS bucket,
+               json_group_array(json_array(id, title, description, completed, priority, due_date,
+                                           start_time, end_time, list_id, is_important,
+                                           recurrence_rule)) AS tasks
+        FROM (
+            SELECT * FROM tasks
+            WHERE user_id = ? AND due_date BETWEEN ? AND ? AND recurrence_rule IS NULL
+            ORDER BY due_date, start_time, is_important DESC
+        )
+        GROUP BY bucket
+        ORDER BY bucket
+    ''', (user_id, start_date.isoformat(), end_date.isoformat()))
+    buckets = {row['bucket']: json.loads(row['tasks']) for row in cursor.fetchall()}
+    
+    # 重复任务只在窗口内惰性展开，不落库
+    expanded_keys = set()
+    for master, occurrence, status in load_recurring_occurrences(conn, user_id, start_date, end_date):
+        key = bucket_key(occurrence, granularity)
+        buckets.setdefault(key, []).append([
+            master['id'], master['title'], master['description'], 1 if status == 'completed' else 0,
+            master['priority'], occurrence.isoformat(), master['start_time'], master['end_time'],
+            master['list_id'], master['is_important'], master['recurrence_rule']
+        ])
+        expanded_keys.add(key)
+    for key in expanded_keys:
+        buckets[key].sort(key=lambda task: (task[5], task[6] or '', -(task[9] or 0)))
+
+    return {
+        'start': start_date.isoformat(),
+        'end': end_date.isoformat(),
+        'granularity': granularity,
+        'columns': TASK_COLUMNS,
+        'buckets': [{'key': key, 'tasks': buckets[key]} for key in sorted(buckets)]
+    }
+
+def query_list_lookup(conn, user_id):
+    """任务列表的名称、图标和颜色，{列表ID: [名称, 图标, 颜色]}"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, name, icon, color FROM task_lists WHERE user_id = ?', (user_id,))
+    return {row['id']: [row['name'], row['icon'], row['color']] for row in cursor.fetchall()}
+
+def bucket_key(day, granularity):
+    """计算日期所在的分桶键，与BUCKET_EXPRESSIONS保持一致"""
+    if granularity == 'week':
+        return (day - timedelta(days=day.weekday())).isoformat()
+    if granularity == 'month':
+        return day.replace(day=1).isoformat()
+    return day.isoformat()
+
+def adjacent_windows(start_date, end_date, granularity):
+    """计算前后相邻的窗口，月粒度按自然月对齐"""
+    if granularity == 'month' and start_date.day == 1:
+        previous_end = start_date - timedelta(days=1)
+        previous_start = previous_end.replace(day=1)
+        next_start = (end_date.replace(day=1) + timedelta(days=32)).replace(day=1)
+        next_end = (next_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        return [(previous_start, previous_end), (next_start, next_end)]
+
+    span = end_date - start_date + timedelta(days=1)
+    return [(start_date - span, end_date - span), (start_date + span, end_date + span)]
+
+class CalendarRangeCache:
+    """按用户缓存最近访问和预取的日历窗口，数据版本变化时整体失效"""
+
+    def __init__(self, windows_per_user=CACHE_WINDOWS_PER_USER):
+        self._windows_per_user = windows_per_user
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, data_version, key):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] == data_version and key in entry[1]:
+                entry[1].move_to_end(key)
+                self.hits += 1
+                return entry[1][key]
+            self.misses += 1
+            return None
+
+    def put(self, user_id, data_version, key, value):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if not entry or entry[0] != data_version:
+                entry = (data_version, OrderedDict())
+                self._entries[user_id] = entry
+            entry[1][key] = value
+            entry[1].move_to_end(key)
+            while len(entry[1]) > self._windows_per_user:
+                entry[1].popitem(last=False)
+
+    def contains(self, user_id, data_version, key):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            return bool(entry and entry[0] == data_version and key in entry[1])
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(entry[1]) for entry in self._entries.values())
+
+range_cache = CalendarRangeCache()
+register_cache('calendar_range', lambda: range_cache._entries)
+
+def get_calendar_range(conn, user_id, data_version, start_date, end_date, granularity='day'):
+    """获取日历范围数据，优先读取缓存；返回(数据, 是否命中缓存)
+
+    数据版本只跟踪任务表，列表信息不缓存，每次查询以反映列表的改名和删除。
+    """
+    key = (start_date.isoformat(), end_date.isoformat(), granularity)
+    cached = range_cache.get(user_id, data_version, key)
+    if cached is None:
+        cached = query_calendar_range(conn, user_id, start_date, end_date, granularity)
+        range_cache.put(user_id, data_version, key, cached)
+        hit = False
+    else:
+        hit = True
+    return dict(cached, lists=query_list_lookup(conn, user_id)), hit
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='calendar-prefetch')
+        return _executor
+
+def prefetch_adjacent(connect, user_id, data_version, start_date, end_date, granularity='day'):
+    """在共享线程池中预取前后相邻窗口，使翻页请求直接命中内存
+
+    已缓存或正在预取的窗口会跳过，排队过多时放弃本次预取。
+    """
+    if PREFETCH_WORKERS <= 0:
+        return
+    windows = []
+    with _executor_lock:
+        for window_start, window_end in adjacent_windows(start_date, end_date, granularity):
+            key = (window_start.isoformat(), window_end.isoformat(), granularity)
+            pending = (user_id, data_version, key)
+            if pending in _pending or len(_pending) >= PREFETCH_MAX_PENDING \
+                    or range_cache.contains(user_id, data_version, key):
+                continue
+            _pending.add(pending)
+            windows.append((window_start, window_end, pending))
+    if not windows:
+        return
+
+    def worker():
+        try:
+            conn = connect()
+            try:
+                for window_start, window_end, pending in windows:
+                    result = query_calendar_range(conn, user_id, window_start, window_end, granularity)
+                    range_cache.put(user_id, data_version, pending[2], result)
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"预取日历窗口失败: {e}")
+        finally:
+            with _executor_lock:
+                _pending.difference_update(pending for _, _, pending in windows)
+
+    _get_executor().submit(worker)
@@ -0,0 +1,246 @@
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from collections import Counter, deque
+from datetime import date, timedelta
+from memory_monitor import register_cache
+
+# 每个推送连接最多积压的事件数，超出后丢弃积压并要求客户端重新同步
+CHANGE_FEED_QUEUE_SIZE = int(os.environ.get('CHANGE_FEED_QUEUE_SIZE', '100'))
+# 没有事件时发送心跳注释的间隔（秒），防止代理断开空闲连接
+CHANGE_FEED_HEARTBEAT = float(os.environ.get('CHANGE_FEED_HEARTBEAT', '15'))
+# 轮询变更表获取其他进程所发布事件的间隔（秒，0为关闭，单进程部署可关闭）
+CHANGE_FEED_POLL_INTERVAL = float(os.environ.get('CHANGE_FEED_POLL_INTERVAL', '1'))
+# 变更表保留时长（分钟），客户端断线重连时在此范围内补发
+CHANGE_FEED_RETENTION_MINUTES = int(os.environ.get('CHANGE_FEED_RETENTION_MINUTES', '60'))
+# 断线重连时最多补发的事件数，超出时要求客户端重新同步
+CHANGE_FEED_REPLAY_LIMIT = 500
+# 每发布多少批事件清理一次过期记录
+PRUNE_EVERY = 200
+
+# 队列溢出或补发不完整时返回给订阅者的标记
+RESYNC = object()
+
+class ChangeEvent:
+    """一条已写入变更表的事件，data为序列化后的JSON"""
+
+    __slots__ = ('event_id', 'user_id', 'event_type', 'data')
+
+    def __init__(self, event_id, user_id, event_type, data):
+        self.event_id = event_id
+        self.user_id = user_id
+        self.event_type = event_type
+        self.data = data
+
+    def format(self):
+        return f'id: {self.event_id}\nevent: {self.event_type}\ndata: {self.data}\n\n'
+
+class Subscription:
+    """一个推送连接的有界事件队列"""
+
+    def __init__(self, user_id, maxsize=CHANGE_FEED_QUEUE_SIZE):
+        self.user_id = user_id
+        self.maxsize = maxsize
+        self._events = deque()
+        self._overflowed = False
+        self._cond = threading.Condition()
+
+    def put(self, event):
+        with self._cond:
+            if self._overflowed:
+                return
+            if len(self._events) >= self.maxsize:
+                # 客户端消费太慢：丢弃积压，下次读取时要求重新同步
+                self._events.clear()
+                self._overflowed = True
+            else:
+                self._events.append(event)
+            self._cond.notify()
+
+    def get(self, timeout):
+        """取出下一个事件；超时返回None，溢出后返回RESYNC"""
+        with self._cond:
+            if not self._events and not self._overflowed:
+                self._cond.wait(timeout)
+            if self._overflowed:
+                self._overflowed = False
+                return RESYNC
+            return self._events.popleft() if self._events else None
+
+    def __len__(self):
+        return len(self._events)
+
+class ChangeFeed:
+    """进程内按用户分发的变更发布/订阅，多进程时通过变更表互相转发"""
+
+    def __init__(self):
+        # 区分本进程写入的事件，轮询时跳过
+        self.origin = uuid.uuid4().hex
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._connect = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._published = 0
+
+    def start(self, connect, poll_interval=CHANGE_FEED_POLL_INTERVAL):
+        """记录建立数据库连接的函数，并按需启动变更表轮询线程"""
+        self._connect = connect
+        if poll_interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(poll_interval,), name='change-feed', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[subscription.user_id]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscribers.values())
+
+    def publish(self, conn, user_id, events):
+        """把[(事件类型, 数据)]写入变更表并推送给本进程订阅者，需在业务事务提交后调用"""
+        if not events:
+            return []
+        cursor = conn.cursor()
+        published = []
+        for event_type, payload in events:
+            data = json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=str)
+            cursor.execute('''
+                INSERT INTO change_events (user_id, event_type, payload, origin)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, event_type, data, self.origin))
+            published.append(ChangeEvent(cursor.lastrowid, user_id, event_type, data))
+        conn.commit()
+        self._deliver(published)
+
+        self._published += 1
+        if self._published % PRUNE_EVERY == 0:
+            self.prune(conn)
+        return published
+
+    def replay(self, conn, user_id, last_event_id):
+        """断线重连时补发last_event_id之后的事件，返回(事件列表, 是否完整)"""
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, user_id, event_type, payload FROM change_events
+            WHERE user_id = ? AND id > ?
+            ORDER BY id LIMIT ?
+        ''', (user_id, last_event_id, CHANGE_FEED_REPLAY_LIMIT + 1))
+        rows = cursor.fetchall()
+        events = [ChangeEvent(row[0], row[1], row[2], row[3]) for row in rows[:CHANGE_FEED_REPLAY_LIMIT]]
+        if len(rows) > CHANGE_FEED_REPLAY_LIMIT:
+            return events, False
+        # 最早的记录已被清理时无法保证补发完整
+        cursor.execute('SELECT MIN(id) FROM change_events')
+        oldest = cursor.fetchone()[0]
+        if oldest is None:
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_events'")
+            row = cursor.fetchone()
+            return events, row is None or row[0] <= last_event_id
+        return events, oldest <= last_event_id + 1
+
+    def prune(self, conn):
+        conn.execute("DELETE FROM change_events WHERE created_at < datetime('now', ?)",
+                     (f'-{CHANGE_FEED_RETENTION_MINUTES} minutes',))
+        conn.commit()
+
+    def _deliver(self, events):
+        for event in events:
+            with self._lock:
+                subscriptions = list(self._subscribers.get(event.user_id, ()))
+            for subscription in subscriptions:
+                subscription.put(event)
+
+    def _run(self, poll_interval):
+        conn = None
+        last_id = None
+        while not self._stop.wait(poll_interval):
+            try:
+                if conn is None:
+                    conn = self._connect()
+                if last_id is None:
+                    last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM change_events').fetchone()[0]
+                    continue
+                rows = conn.execute('''
+                    SELECT id, user_id, event_type, payload, origin FROM change_events
+                    WHERE id > ? ORDER BY id LIMIT 1000
+                ''', (last_id,)).fetchall()
+                if not rows:
+                    continue
+                last_id = rows[-1][0]
+                self._deliver([ChangeEvent(row[0], row[1], row[2], row[3])
+                               for row in rows if row[4] != self.origin])
+            except sqlite3.Error as e:
+                print(f"轮询变更表失败: {e}")
+                if conn is not None:
+                    conn.close()
+                conn = None
+
+def _counters(task, today, week_end):
+    """任务对统计信息的贡献，与统计接口的各项条件一致"""
+    completed = bool(task['completed'])
+    due_date = task['due_date']
+    return {
+        'total_tasks': 1,
+        'completed_tasks': int(completed),
+        'important_tasks': int(bool(task['is_important']) and not completed),
+        'today_due_tasks': int(due_date == today and not completed),
+        'week_due_tasks': int(bool(due_date) and today <= due_date <= week_end and not completed)
+    }
+
+def task_change_events(before, after):
+    """根据任务修改前后的状态（{任务ID: 任务字典}）生成变更事件和计数增量"""
+    today = date.today().isoformat()
+    week_end = (date.today() + timedelta(days=7)).isoformat()
+    events = []
+    stats = Counter()
+    lists = {}
+
+    for task_id in sorted(set(before) | set(after)):
+        old, new = before.get(task_id), after.get(task_id)
+        if old == new:
+            continue
+        for task, sign in ((old, -1), (new, 1)):
+            if task is None:
+                continue
+            counters = _counters(task, today, week_end)
+            for key, value in counters.items():
+                stats[key] += sign * value
+            if task['list_id'] is not None:
+                list_delta = lists.setdefault(task['list_id'], Counter())
+                list_delta['total_tasks'] += sign
+                list_delta['completed_tasks'] += sign * counters['completed_tasks']
+        if new is None:
+            events.append(('task.deleted', {'id': task_id, 'list_id': old['list_id']}))
+        else:
+            events.append(('task.upserted', {'task': new}))
+
+    list_deltas = {list_id: {key: value for key, value in delta.items() if value}
+                   for list_id, delta in lists.items()}
+    list_deltas = {list_id: delta for list_id, delta in list_deltas.items() if delta}
+    if list_deltas:
+        events.append(('lists.counts', {'lists': list_deltas}))
+    stats_delta = {key: value for key, value in stats.items() if value}
+    if stats_delta:
+        events.append(('stats.delta', {'stats': stats_delta}))
+    return events
+
+feed = ChangeFeed()
+register_cache('change_feed_subscriptions', lambda: feed._subscribers)
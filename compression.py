@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+响应压缩 - 动态响应按Accept-Encoding协商gzip/br压缩，静态资源使用构建时预压缩的文件
+
+预压缩静态资源: python compression.py [--static-dir static] [--force]
+为可压缩的静态文件生成.gz（安装brotli时另生成.br）同名文件，请求时直接返回而不在请求路径上压缩。
+"""
+
+import argparse
+import gzip
+import mimetypes
+import os
+from flask import request, send_file, send_from_directory
+from werkzeug.security import safe_join
+from metrics import registry
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 是否压缩动态响应
+COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# 小于该字节数的响应不压缩（压缩收益抵不过头部和CPU开销）
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '500'))
+# 动态响应的gzip压缩级别（1-9）；预压缩静态资源总是使用最高级别
+COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', '6'))
+# 动态响应的brotli质量（0-11），较高的质量在请求路径上耗时过多
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '4'))
+
+# 可压缩的内容类型（另外所有text/*都可压缩）
+COMPRESSIBLE_TYPES = {'application/json', 'application/javascript', 'application/manifest+json',
+                      'application/xml', 'image/svg+xml', 'text/javascript'}
+# 可预压缩的静态文件扩展名
+PRECOMPRESS_EXTENSIONS = ('.js', '.css', '.html', '.json', '.svg', '.txt', '.xml', '.map')
+# 编码名 -> 预压缩文件后缀；按服务端优先顺序排列
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+COMPRESSION_BYTES = registry.counter(
+    'http_compression_bytes_total', '压缩前后的响应体字节数', ('encoding', 'stage'))
+
+def available_encodings():
+    """当前环境支持的压缩编码，按优先顺序"""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+def negotiate(accept_encodings, encodings=None):
+    """按请求的Accept-Encoding选择编码，不接受任何可用编码时返回None"""
+    return accept_encodings.best_match(encodings or available_encodings())
+
+def compress(data, encoding, level=COMPRESSION_LEVEL, brotli_quality=COMPRESSION_BROTLI_QUALITY):
+    if encoding == 'br':
+        return brotli.compress(data, quality=brotli_quality)
+    # mtime固定为0，相同内容压缩结果一致
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+def is_compressible(mimetype):
+    return bool(mimetype) and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES)
+
+def compress_response(response):
+    """按需压缩动态响应；流式响应（如SSE）、文件响应和已编码的响应保持原样"""
+    if not COMPRESSION_ENABLED or response.is_streamed or response.direct_passthrough:
+        return response
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return response
+    if 'Content-Encoding' in response.headers or not is_compressible(response.mimetype):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    length = response.calculate_content_length()
+    if length is None or length < COMPRESSION_MIN_SIZE:
+        return response
+    encoding = negotiate(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    data = compress(response.get_data(), encoding)
+    if len(data) >= length:
+        return response
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    # 压缩后的表示与原表示不同，强ETag需要区分
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f'{etag}-{encoding}')
+    COMPRESSION_BYTES.inc(encoding, 'original', amount=length)
+    COMPRESSION_BYTES.inc(encoding, 'compressed', amount=len(data))
+    return response
+
+def precompressed_path(path, encoding):
+    """与原文件同样新的预压缩文件路径，不存在或已过期时返回None"""
+    candidate = path + ENCODING_SUFFIXES[encoding]
+    try:
+        if os.path.getmtime(candidate) >= os.path.getmtime(path):
+            return candidate
+    except OSError:
+        pass
+    return None
+
+def send_static(directory, filename, max_age=None):
+    """发送静态文件，客户端接受时直接返回预压缩的同名文件"""
+    path = safe_join(directory, filename)
+    mimetype = mimetypes.guess_type(filename)[0]
+    if path is None or not os.path.isfile(path) or not is_compressible(mimetype):
+        return send_from_directory(directory, filename, max_age=max_age)
+
+    # 按客户端偏好依次查找预压缩文件（发送.br文件不需要brotli库），同等偏好时按服务端顺序
+    accept = request.accept_encodings
+    response = None
+    for encoding in sorted(ENCODING_SUFFIXES, key=lambda name: -accept.quality(name)):
+        candidate = precompressed_path(path, encoding) if accept.quality(encoding) > 0 else None
+        if candidate is not None:
+            response = send_file(candidate, mimetype=mimetype, max_age=max_age)
+            response.headers['Content-Encoding'] = encoding
+            break
+    if response is None:
+        response = send_from_directory(directory, filename, max_age=max_age)
+    response.vary.add('Accept-Encoding')
+    return response
+
+def precompress_file(path, force=False):
+    """为一个静态文件生成预压缩文件，返回[(编码, 原大小, 压缩后大小)]"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    results = []
+    for encoding in available_encodings():
+        target = path + ENCODING_SUFFIXES[encoding]
+        if not force and precompressed_path(path, encoding) is not None:
+            continue
+        compressed = compress(data, encoding, level=9, brotli_quality=11)
+        if len(compressed) >= len(data):
+            # 压缩无收益时删除旧文件，请求时回退到原文件
+            if os.path.exists(target):
+                os.remove(target)
+            continue
+        with open(target, 'wb') as f:
+            f.write(compressed)
+        results.append((encoding, len(data), len(compressed)))
+    return results
+
+def precompress_directory(directory, force=False, min_size=COMPRESSION_MIN_SIZE):
+    """预压缩目录下所有可压缩的静态文件"""
+    results = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if not name.endswith(PRECOMPRESS_EXTENSIONS) or os.path.getsize(path) < min_size:
+                continue
+            for encoding, original, compressed in precompress_file(path, force):
+                results.append((os.path.relpath(path, directory), encoding, original, compressed))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='预压缩静态资源')
+    parser.add_argument('--static-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'),
+                        help='静态资源目录')
+    parser.add_argument('--force', action='store_true', help='重新生成未过期的预压缩文件')
+    args = parser.parse_args()
+
+    results = precompress_directory(args.static_dir, args.force)
+    for name, encoding, original, compressed in results:
+        print(f'{name} [{encoding}] {original:,} -> {compressed:,} 字节 ({compressed / original:.0%})')
+    print(f'共生成 {len(results)} 个预压缩文件')
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,16 @@
+import os
 import sqlite3
 import json
 from datetime import datetime, date
 
-def migrate_database():
+# 数据库文件路径，可通过环境变量切换到生成的压测数据集
+DATABASE_PATH = os.environ.get('DATABASE_PATH', 'settings.db')
+# 每个用户保留的任务变更记录条数，缓存落后更多时整体重建
+TASK_CHANGE_LOG_KEEP = 1000
+
+def migrate_database(db_path=DATABASE_PATH):
     """迁移数据库，添加用户系统支持"""
-    conn = sqlite3.connect('settings.db')
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
     try:
@@ -56,6 +62,11 @@ def migrate_database():
             cursor.execute('ALTER TABLE tasks ADD COLUMN end_time TIME')
             print("添加start_time和end_time字段")
         
+        # 检查是否有重复规则字段
+        if 'recurrence_rule' not in task_columns:
+            cursor.execute('ALTER TABLE tasks ADD COLUMN recurrence_rule TEXT')
+            print("添加recurrence_rule字段")
+        
         # 检查user_preferences表是否有user_id字段
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_preferences'")
         if cursor.fetchone():
@@ -160,9 +171,9 @@ def migrate_database():
     finally:
         conn.close()
 
-def init_database():
+def init_database(db_path=DATABASE_PATH):
     """初始化SQLite数据库"""
-    conn = sqlite3.connect('settings.db')
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
     # 删除旧表（如果存在）
@@ -203,6 +214,7 @@ def init_database():
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             completed_at TIMESTAMP,
             is_important BOOLEAN DEFAULT 0,
+            recurrence_rule TEXT,
             FOREIGN KEY (list_id) REFERENCES task_lists (id),
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
@@ -244,6 +256,96 @@ def init_database():
         )
     ''')
     
+    # 日历范围查询按(user_id, due_date)走索引
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_due_date ON tasks (user_id, due_date)')
+    
+    # 创建重复任务例外表（单次完成或跳过的实例）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_recurrence_exceptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            occurrence_date DATE NOT NULL,
+            status TEXT NOT NULL DEFAULT 'completed',
+            completed_at TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (task_id, occurrence_date),
+            FOREIGN KEY (task_id) REFERENCES tasks (id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_recurrence_exceptions_user_date
+        ON task_recurrence_exceptions (user_id, occurrence_date)
+    ''')
+    
+    # 创建变更推送表（断线补发和多进程间转发变更事件）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            event_type TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            origin TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_change_events_user ON change_events (user_id, id)')
+    
+    # 用户数据版本：任务和重复例外的任意写入都由触发器递增，各缓存据此判断是否失效
+    # （updated_at混有UTC和本地时间两种格式，不能用其最大值判断）
+    # 同时记录每个版本涉及的任务ID，缓存可以只更新落后期间变化的任务
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_data_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_change_log (
+            user_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            task_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, version)
+        )
+    ''')
+    for table, id_column in (('tasks', 'id'), ('task_recurrence_exceptions', 'task_id')):
+        for event, row, condition in (('INSERT', 'NEW', ''), ('UPDATE', 'NEW', ''),
+                                      ('UPDATE', 'OLD', ' AND OLD.user_id IS NOT NEW.user_id'), ('DELETE', 'OLD', '')):
+            name = f'{table}_{event.lower()}_{row.lower()}_version'
+            # 每次启动重建触发器，使定义的修改对已有数据库生效
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+            cursor.execute(f'''
+                CREATE TRIGGER {name}
+                AFTER {event} ON {table} WHEN {row}.user_id IS NOT NULL{condition}
+                BEGIN
+                    INSERT INTO user_data_versions (user_id, version) VALUES ({row}.user_id, 1)
+                    ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+                    INSERT INTO task_change_log (user_id, version, task_id)
+                    SELECT user_id, version, {row}.{id_column} FROM user_data_versions WHERE user_id = {row}.user_id;
+                    DELETE FROM task_change_log
+                    WHERE user_id = {row}.user_id AND version <= (
+                        SELECT version FROM user_data_versions WHERE user_id = {row}.user_id
+                    ) - {TASK_CHANGE_LOG_KEEP};
+                END
+            ''')
+    
+    # 创建幂等键表（创建类请求重试时返回首次的响应，status为空表示处理中）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            idempotency_key TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            status INTEGER,
+            mimetype TEXT,
+            body BLOB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (user_id, idempotency_key)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at)')
+    
     # 创建用户会话表
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS user_sessions (
@@ -311,9 +413,9 @@ def get_default_tasks():
         ('阅读新书', '完成第三章的阅读', 0, 'low', tomorrow, 7, 0)
     ]
 
-def insert_default_data():
+def insert_default_data(db_path=DATABASE_PATH):
     """插入默认数据"""
-    conn = sqlite3.connect('settings.db')
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
     # 检查是否已经有用户数据
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+压测数据生成器 - 按可配置的分布批量生成用户、任务列表和任务
+
+同一种子和--today生成的数据库内容完全一致（包括密码哈希和时间戳），写入时使用单事务executemany并推迟建索引。
+示例: python generate_data.py --db bench.db --users 20000 --tasks-per-list poisson:8 --seed 42
+生成后通过 DATABASE_PATH=bench.db python app.py 使用该数据集。
+"""
+
+import argparse
+import base64
+import hashlib
+import os
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+import bcrypt
+import numpy as np
+from database import init_database, get_default_task_lists
+
+# 所有生成用户共用的登录密码
+DEFAULT_PASSWORD = 'password123'
+# 每批写入的行数
+BATCH_SIZE = 50000
+
+CJK_WORDS = ['完成', '整理', '准备', '提交', '项目', '报告', '会议', '客户', '邮件', '文档', '代码',
+             '审查', '测试', '上线', '预算', '计划', '采购', '健身', '阅读', '学习', '复习', '家庭',
+             '体检', '预约', '旅行', '机票', '酒店', '牛奶', '面包', '周报', '需求', '设计', '评审',
+             '跟进', '发票', '报销', '培训', '演示', '合同', '打扫', '房间', '生日', '礼物', '数据']
+EN_WORDS = ['review', 'draft', 'send', 'update', 'fix', 'plan', 'call', 'meeting', 'report', 'invoice',
+            'client', 'deploy', 'release', 'budget', 'design', 'email', 'docs', 'book', 'flight', 'gym',
+            'groceries', 'notes', 'backlog', 'sprint', 'demo', 'contract', 'follow', 'up', 'team', 'data']
+PRIORITIES = np.array(['low', 'medium', 'high'])
+RECURRENCE_RULES = ['FREQ=DAILY', 'FREQ=WEEKLY', 'FREQ=WEEKLY;INTERVAL=2', 'FREQ=MONTHLY']
+
+def parse_distribution(spec):
+    """解析分布描述：fixed:N、uniform:A-B、poisson:λ，返回采样函数"""
+    kind, _, value = spec.partition(':')
+    kind = kind.strip().lower()
+    try:
+        if kind == 'fixed':
+            n = int(value)
+            return lambda rng, size: np.full(size, n, dtype=np.int64)
+        if kind == 'uniform':
+            low, _, high = value.partition('-')
+            low, high = int(low), int(high or low)
+            return lambda rng, size: rng.integers(low, high + 1, size)
+        if kind == 'poisson':
+            lam = float(value)
+            return lambda rng, size: rng.poisson(lam, size)
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f'无效的分布: {spec}（可用 fixed:N、uniform:A-B、poisson:λ）')
+
+def parse_range(spec):
+    """解析A-B形式的整数区间"""
+    low, _, high = spec.partition('-')
+    try:
+        low, high = int(low), int(high or low)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'无效的区间: {spec}')
+    if low < 0 or high < low:
+        raise argparse.ArgumentTypeError(f'无效的区间: {spec}')
+    return low, high
+
+def ratio(value):
+    value = float(value)
+    if not 0 <= value <= 1:
+        raise argparse.ArgumentTypeError('比例必须在0到1之间')
+    return value
+
+class TextGenerator:
+    """按中英文比例和词数区间拼接标题与描述"""
+
+    def __init__(self, rng, cjk_ratio):
+        self.rng = rng
+        self.cjk_ratio = cjk_ratio
+
+    def make(self, word_range):
+        count = int(self.rng.integers(word_range[0], word_range[1] + 1))
+        if count == 0:
+            return None
+        if self.rng.random() < self.cjk_ratio:
+            return ''.join(CJK_WORDS[i] for i in self.rng.integers(0, len(CJK_WORDS), count))
+        words = ' '.join(EN_WORDS[i] for i in self.rng.integers(0, len(EN_WORDS), count))
+        return words.capitalize()
+
+# bcrypt使用的base64字母表（与标准base64只有字符不同）
+_BCRYPT_ALPHABET = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/',
+                                 './ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789')
+
+def _timestamp(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+def seeded_salt(seed, rounds=4):
+    """由种子确定的bcrypt盐，使相同种子生成的密码哈希一致（不消耗数据生成的随机数序列）"""
+    raw = hashlib.sha256(f'generate_data:{seed}'.encode('utf-8')).digest()[:16]
+    encoded = base64.b64encode(raw).decode('ascii')[:22].translate(_BCRYPT_ALPHABET)
+    return f'$2b${rounds:02d}${encoded}'.encode('ascii')
+
+def generate_users(args, rng, password_hash, now):
+    """逐个生成用户行，同时为每个用户确定列表数量"""
+    list_counts = np.maximum(args.lists_per_user(rng, args.users), 1)
+    for index in range(args.users):
+        user_id = index + 1
+        created_at = now - timedelta(days=int(rng.integers(0, args.history_days + 1)))
+        yield (user_id, f'user{user_id}', f'user{user_id}@example.com', password_hash,
+               f'测试用户{user_id}', 1, 1, _timestamp(created_at), _timestamp(created_at)), int(list_counts[index])
+
+def generate_lists(user_id, list_count, first_list_id, now):
+    defaults = get_default_task_lists()
+    for offset in range(list_count):
+        name, icon, color, _ = defaults[offset % len(defaults)]
+        if offset >= len(defaults):
+            name = f'{name}{offset // len(defaults) + 1}'
+        yield (first_list_id + offset, name, icon, color, offset, user_id, _timestamp(now), _timestamp(now))
+
+def generate_tasks(args, rng, text, user_id, list_ids, first_task_id, today, now):
+    """为单个用户批量采样任务属性（向量化），再逐行输出"""
+    counts = args.tasks_per_list(rng, len(list_ids))
+    total = int(counts.sum())
+    if total == 0:
+        return
+    task_lists = np.repeat(list_ids, counts)
+
+    created_offsets = rng.uniform(0, args.history_days * 86400, total)
+    completed = rng.random(total) < args.completion_ratio
+    has_due = rng.random(total) >= args.no_due_ratio
+    due_offsets = np.rint(rng.normal(0, args.due_spread, total)).astype(np.int64)
+    # 已完成任务的截止日期大多在过去
+    due_offsets = np.where(completed, -np.abs(due_offsets), due_offsets)
+    timed = has_due & (rng.random(total) < args.timed_ratio)
+    start_minutes = rng.integers(7 * 4, 21 * 4, total) * 15
+    durations = rng.choice([15, 30, 45, 60, 90, 120], total)
+    priorities = PRIORITIES[rng.choice(3, total, p=[0.3, 0.5, 0.2])]
+    important = rng.random(total) < args.important_ratio
+    recurring = has_due & ~completed & (rng.random(total) < args.recurring_ratio)
+    # 完成耗时服从指数分布（小时）
+    completion_hours = rng.exponential(args.completion_latency_hours, total)
+
+    for i in range(total):
+        created_at = now - timedelta(seconds=float(created_offsets[i]))
+        due_date = (today + timedelta(days=int(due_offsets[i]))).isoformat() if has_due[i] else None
+        start_time = end_time = None
+        if timed[i]:
+            start = int(start_minutes[i])
+            end = min(start + int(durations[i]), 24 * 60 - 1)
+            start_time = f'{start // 60:02d}:{start % 60:02d}'
+            end_time = f'{end // 60:02d}:{end % 60:02d}'
+        completed_at = None
+        updated_at = created_at
+        if completed[i]:
+            updated_at = min(created_at + timedelta(hours=float(completion_hours[i])), now)
+            completed_at = _timestamp(updated_at)
+        rule = RECURRENCE_RULES[i % len(RECURRENCE_RULES)] if recurring[i] else None
+        yield (first_task_id + i, text.make(args.title_words), text.make(args.description_words),
+               int(completed[i]), str(priorities[i]), due_date, start_time, end_time,
+               int(task_lists[i]), user_id, _timestamp(created_at), _timestamp(updated_at),
+               completed_at, int(important[i]), rule)
+
+def generate(args):
+    """生成完整数据集并返回各表行数"""
+    rng = np.random.default_rng(args.seed)
+    text = TextGenerator(rng, args.cjk_ratio)
+    # 降低bcrypt轮数，避免生成大量用户时耗时过长；盐由种子确定，保证结果可复现
+    password_hash = bcrypt.hashpw(args.password.encode('utf-8'), seeded_salt(args.seed)).decode('utf-8')
+    today = date.fromisoformat(args.today) if args.today else date.today()
+    now = datetime.combine(today, datetime.min.time()) + timedelta(hours=12)
+
+    init_database(args.db)
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    cursor = conn.cursor()
+    cursor.execute('PRAGMA journal_mode = OFF')
+    cursor.execute('PRAGMA synchronous = OFF')
+    cursor.execute('PRAGMA cache_size = -200000')
+
+    # 先删除二级索引，数据写完后统一重建
+    cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")
+    indexes = cursor.fetchall()
+    for name, _ in indexes:
+        cursor.execute(f'DROP INDEX {name}')
+
+    counts = {'users': 0, 'task_lists': 0, 'tasks': 0}
+    next_list_id = 1
+    next_task_id = 1
+    users, lists, tasks, preferences = [], [], [], []
+
+    started = time.perf_counter()
+    cursor.execute('BEGIN')
+    try:
+        for user, list_count in generate_users(args, rng, password_hash, now):
+            users.append(user)
+            user_id = user[0]
+            list_ids = np.arange(next_list_id, next_list_id + list_count)
+            lists.extend(generate_lists(user_id, list_count, next_list_id, now))
+            preferences.append((user_id, next_list_id, user[7], user[7]))
+            next_list_id += list_count
+            before = len(tasks)
+            tasks.extend(generate_tasks(args, rng, text, user_id, list_ids, next_task_id, today, now))
+            next_task_id += len(tasks) - before
+            if len(tasks) >= BATCH_SIZE:
+                _flush_rows(cursor, users, lists, tasks, preferences, counts)
+        _flush_rows(cursor, users, lists, tasks, preferences, counts)
+        cursor.execute('COMMIT')
+    except BaseException:
+        cursor.execute('ROLLBACK')
+        raise
+    insert_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _, sql in indexes:
+        cursor.execute(sql)
+    cursor.execute('ANALYZE')
+    index_seconds = time.perf_counter() - started
+    conn.close()
+    return counts, insert_seconds, index_seconds
+
+def _flush_rows(cursor, users, lists, tasks, preferences, counts):
+    """按外键顺序写入缓冲的行并清空缓冲区"""
+    cursor.executemany('''
+        INSERT INTO users (id, username, email, password_hash, full_name, is_active, email_verified,
+                           created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', users)
+    cursor.executemany('''
+        INSERT INTO task_lists (id, name, icon, color, sort_order, user_id, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', lists)
+    cursor.executemany('''
+        INSERT INTO user_preferences (user_id, default_list_id, created_at, updated_at) VALUES (?, ?, ?, ?)
+    ''', preferences)
+    cursor.executemany('''
+        INSERT INTO tasks (id, title, description, completed, priority, due_date, start_time, end_time,
+                           list_id, user_id, created_at, updated_at, completed_at, is_important, recurrence_rule)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', tasks)
+    counts['users'] += len(users)
+    counts['task_lists'] += len(lists)
+    counts['tasks'] += len(tasks)
+    for rows in (users, lists, tasks, preferences):
+        rows.clear()
+
+def main():
+    parser = argparse.ArgumentParser(description='生成压测用的合成数据集')
+    parser.add_argument('--db', default='bench.db', help='输出数据库文件')
+    parser.add_argument('--force', action='store_true', help='覆盖已存在的数据库文件')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子')
+    parser.add_argument('--users', type=int, default=1000, help='用户数')
+    parser.add_argument('--lists-per-user', type=parse_distribution, default='uniform:3-10',
+                        help='每个用户的列表数分布')
+    parser.add_argument('--tasks-per-list', type=parse_distribution, default='poisson:25',
+                        help='每个列表的任务数分布')
+    parser.add_argument('--completion-ratio', type=ratio, default=0.6, help='已完成任务比例')
+    parser.add_argument('--due-spread', type=float, default=30, help='截止日期相对今天的标准差（天）')
+    parser.add_argument('--no-due-ratio', type=ratio, default=0.3, help='无截止日期的任务比例')
+    parser.add_argument('--timed-ratio', type=ratio, default=0.25, help='有截止日期任务中带具体时间的比例')
+    parser.add_argument('--important-ratio', type=ratio, default=0.1, help='重要任务比例')
+    parser.add_argument('--recurring-ratio', type=ratio, default=0.0, help='未完成任务中重复任务的比例')
+    parser.add_argument('--cjk-ratio', type=ratio, default=0.7, help='中文文本比例')
+    parser.add_argument('--title-words', type=parse_range, default='2-6', help='标题词数区间')
+    parser.add_argument('--description-words', type=parse_range, default='0-20', help='描述词数区间')
+    parser.add_argument('--history-days', type=int, default=365, help='创建时间回溯天数')
+    parser.add_argument('--completion-latency-hours', type=float, default=48, help='平均完成耗时（小时）')
+    parser.add_argument('--today', help='基准日期YYYY-MM-DD（默认今天，固定后可完全复现）')
+    parser.add_argument('--password', default=DEFAULT_PASSWORD, help='所有用户的登录密码')
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        if not args.force:
+            parser.error(f'{args.db} 已存在，使用 --force 覆盖')
+        os.remove(args.db)
+
+    counts, insert_seconds, index_seconds = generate(args)
+    print(f"已生成 {args.db}: {counts['users']} 个用户, {counts['task_lists']} 个列表, {counts['tasks']} 个任务")
+    rate = counts['tasks'] / insert_seconds if insert_seconds else 0
+    print(f"写入耗时 {insert_seconds:.2f}s（{rate:,.0f} 任务/秒），建索引耗时 {index_seconds:.2f}s")
+    print(f"用户名 user1..user{args.users}，密码 {args.password}")
+
+if __name__ == '__main__':
+    main()
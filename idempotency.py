@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from functools import wraps
+from flask import request, jsonify, make_response, Response
+from flask_login import current_user
+from batch import shared_connection
+from metrics import registry
+
+# 客户端用于标识一次创建操作的请求头，重试时携带相同的值
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+# 重放响应上的标记头
+REPLAYED_HEADER = 'Idempotent-Replayed'
+# 幂等键保留时长（小时），过期后相同的键视为新请求
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+# 处理中的键超过该秒数仍未完成时视为进程中断遗留，允许重新执行
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '120'))
+# 后台清理过期键的间隔（分钟，0为关闭）
+IDEMPOTENCY_SWEEP_MINUTES = float(os.environ.get('IDEMPOTENCY_SWEEP_MINUTES', '10'))
+MAX_KEY_LENGTH = 255
+
+IDEMPOTENCY_REQUESTS = registry.counter(
+    'idempotency_requests_total', '携带幂等键的请求数', ('result',))
+
+class IdempotencyStore:
+    """按(用户, 幂等键)保存创建操作的响应，重试时返回原响应而不重复执行"""
+
+    def __init__(self):
+        self._connect = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self, connect, sweep_minutes=IDEMPOTENCY_SWEEP_MINUTES):
+        """记录建立数据库连接的函数，并按需启动过期键清理线程"""
+        self._connect = connect
+        if sweep_minutes <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(sweep_minutes * 60,),
+                                        name='idempotency-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def connection(self):
+        """批量请求的子请求中使用共享连接，返回(连接, 是否需要关闭)"""
+        shared = shared_connection()
+        if shared is not None:
+            return shared, False
+        return self._connect(), True
+
+    def claim(self, conn, user_id, key, fingerprint):
+        """认领幂等键：成功时返回None，由调用方执行；键已存在时返回已有记录(fingerprint, status, mimetype, body)"""
+        # 过期的记录和中断遗留的处理中记录不再占用该键
+        conn.execute('''
+            DELETE FROM idempotency_keys
+            WHERE user_id = ? AND idempotency_key = ?
+              AND (created_at < datetime('now', ?) OR (status IS NULL AND created_at < datetime('now', ?)))
+        ''', (user_id, key, f'-{IDEMPOTENCY_TTL_HOURS} hours', f'-{IDEMPOTENCY_LOCK_SECONDS} seconds'))
+        try:
+            conn.execute('''
+                INSERT INTO idempotency_keys (user_id, idempotency_key, fingerprint) VALUES (?, ?, ?)
+            ''', (user_id, key, fingerprint))
+            conn.commit()
+            return None
+        except sqlite3.IntegrityError:
+            conn.rollback()
+        row = conn.execute('''
+            SELECT fingerprint, status, mimetype, body FROM idempotency_keys
+            WHERE user_id = ? AND idempotency_key = ?
+        ''', (user_id, key)).fetchone()
+        # 记录在查询前被删除时按处理中对待，由客户端稍后重试
+        return tuple(row) if row is not None else (fingerprint, None, None, None)
+
+    def complete(self, conn, user_id, key, status, mimetype, body):
+        conn.execute('''
+            UPDATE idempotency_keys SET status = ?, mimetype = ?, body = ?
+            WHERE user_id = ? AND idempotency_key = ?
+        ''', (status, mimetype, body, user_id, key))
+        conn.commit()
+
+    def release(self, conn, user_id, key):
+        """执行失败时释放幂等键，允许用相同的键重试"""
+        # 共享连接上可能留有失败请求未提交的写入，不能一并提交
+        if conn.in_transaction:
+            conn.rollback()
+        conn.execute('DELETE FROM idempotency_keys WHERE user_id = ? AND idempotency_key = ?', (user_id, key))
+        conn.commit()
+
+    def record_stream(self, user_id, key, response):
+        """包装流式响应：完整发送后保存全部内容供重放，中途断开或出错时释放幂等键"""
+        chunks = response.response
+        status, mimetype = response.status_code, response.mimetype
+
+        def generate():
+            body = []
+            finished = False
+            try:
+                for chunk in chunks:
+                    body.append(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+                    yield chunk
+                finished = True
+            finally:
+                if hasattr(chunks, 'close'):
+                    chunks.close()
+                conn, owned = self.connection()
+                try:
+                    if finished:
+                        self.complete(conn, user_id, key, status, mimetype, b''.join(body))
+                        IDEMPOTENCY_REQUESTS.inc('executed')
+                    else:
+                        self.release(conn, user_id, key)
+                finally:
+                    if owned:
+                        conn.close()
+        return generate()
+
+    def sweep(self, conn):
+        """删除过期的幂等键，返回删除的条数"""
+        cursor = conn.execute("DELETE FROM idempotency_keys WHERE created_at < datetime('now', ?)",
+                              (f'-{IDEMPOTENCY_TTL_HOURS} hours',))
+        conn.commit()
+        return cursor.rowcount
+
+    def once(self, user_id, key, payload, execute):
+        """非HTTP操作（如AI操作指令）的幂等执行：execute返回结果字典，只保存成功的结果"""
+        fingerprint = request_fingerprint('ACTION', key, payload)
+        conn, owned = self.connection()
+        try:
+            existing = self.claim(conn, user_id, key, fingerprint)
+            if existing is not None:
+                if existing[1] is None:
+                    IDEMPOTENCY_REQUESTS.inc('in_progress')
+                    return None
+                IDEMPOTENCY_REQUESTS.inc('replayed')
+                return dict(json.loads(existing[3]), replayed=True)
+            try:
+                result = execute()
+            except BaseException:
+                self.release(conn, user_id, key)
+                raise
+            if result.get('success'):
+                self.complete(conn, user_id, key, 200, 'application/json',
+                              json.dumps(result, ensure_ascii=False, default=str).encode('utf-8'))
+                IDEMPOTENCY_REQUESTS.inc('executed')
+            else:
+                self.release(conn, user_id, key)
+            return result
+        finally:
+            if owned:
+                conn.close()
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            conn = None
+            try:
+                conn = self._connect()
+                removed = self.sweep(conn)
+                if removed:
+                    print(f"清理过期幂等键 {removed} 条")
+            except sqlite3.Error as e:
+                print(f"清理过期幂等键失败: {e}")
+            finally:
+                if conn is not None:
+                    conn.close()
+
+def request_fingerprint(method, path, payload):
+    """请求的摘要，相同的幂等键用于不同请求时据此拒绝；JSON按规范形式计算，不受格式差异影响"""
+    if isinstance(payload, bytes):
+        body = payload
+    else:
+        body = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'),
+                          default=str).encode('utf-8')
+    digest = hashlib.sha256(f'{method} {path}\n'.encode('utf-8'))
+    digest.update(body)
+    return digest.hexdigest()
+
+def current_key():
+    """当前请求携带的幂等键，未携带时返回None；格式无效时抛出ValueError"""
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if key is None:
+        return None
+    key = key.strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f'{IDEMPOTENCY_HEADER}必须是1到{MAX_KEY_LENGTH}个字符')
+    return key
+
+def idempotent(view):
+    """创建类接口的幂等装饰器（放在login_required之后）：携带相同幂等键的重试直接返回首次的响应
+
+    未登录的请求不做幂等处理；流式响应在发送完毕后保存，重放时一次性返回全部内容。
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            key = current_key()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if key is None or not current_user.is_authenticated:
+            return view(*args, **kwargs)
+
+        user_id = int(current_user.get_id())
+        payload = request.get_json(silent=True)
+        fingerprint = request_fingerprint(request.method, request.path,
+                                          request.get_data() if payload is None else payload)
+        conn, owned = store.connection()
+        try:
+            existing = store.claim(conn, user_id, key, fingerprint)
+            if existing is not None:
+                return replay(existing, fingerprint)
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                store.release(conn, user_id, key)
+                raise
+            # 服务端错误不保存，客户端可以用相同的键重试
+            if response.status_code >= 500:
+                store.release(conn, user_id, key)
+            elif response.is_streamed:
+                response.response = store.record_stream(user_id, key, response)
+            else:
+                store.complete(conn, user_id, key, response.status_code, response.mimetype, response.get_data())
+                IDEMPOTENCY_REQUESTS.inc('executed')
+            return response
+        finally:
+            if owned:
+                conn.close()
+    return wrapper
+
+def replay(existing, fingerprint):
+    """根据已有记录生成响应"""
+    saved_fingerprint, status, mimetype, body = existing
+    if saved_fingerprint != fingerprint:
+        IDEMPOTENCY_REQUESTS.inc('mismatch')
+        return jsonify({'error': f'{IDEMPOTENCY_HEADER}已用于不同的请求'}), 422
+    if status is None:
+        IDEMPOTENCY_REQUESTS.inc('in_progress')
+        return jsonify({'error': '相同幂等键的请求正在处理中，请稍后重试'}), 409
+    IDEMPOTENCY_REQUESTS.inc('replayed')
+    response = Response(body, status=status, mimetype=mimetype)
+    response.headers[REPLAYED_HEADER] = 'true'
+    return response
+
+store = IdempotencyStore()
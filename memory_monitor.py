@@ -0,0 +1,277 @@
+import gc
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+
+# 启动时开启tracemalloc及其保留的调用栈深度
+TRACEMALLOC_ENABLED = os.environ.get('MEMORY_TRACEMALLOC', '').lower() in ('1', 'true', 'yes')
+TRACEMALLOC_FRAMES = int(os.environ.get('MEMORY_TRACEMALLOC_FRAMES', '10'))
+# 接口允许设置的最大调用栈深度，过深时每次分配的记录开销过大
+MAX_TRACEMALLOC_FRAMES = 100
+# 内存看门狗：检查间隔（分钟，0为关闭）和触发记录的增长阈值（MB）
+WATCHDOG_INTERVAL_MINUTES = float(os.environ.get('MEMORY_WATCHDOG_INTERVAL', '0'))
+WATCHDOG_THRESHOLD_MB = float(os.environ.get('MEMORY_WATCHDOG_THRESHOLD_MB', '50'))
+# 内存中保留的快照数
+MAX_SNAPSHOTS = 5
+# 估算缓存大小时最多遍历的对象数
+SIZEOF_NODE_LIMIT = 200000
+
+# 缓存名称到取值函数的映射，取值函数返回缓存容器本身
+_caches = OrderedDict()
+
+def register_cache(name, getter):
+    """登记一个需要统计大小的缓存"""
+    _caches[name] = getter
+
+def deep_sizeof(obj, limit=SIZEOF_NODE_LIMIT):
+    """递归估算对象占用的字节数，返回(字节数, 是否因遍历上限而截断)"""
+    seen = set()
+    stack = [obj]
+    total = 0
+    visited = 0
+    while stack:
+        current = stack.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        visited += 1
+        if visited > limit:
+            return total, True
+        nbytes = getattr(current, 'nbytes', None)
+        if isinstance(nbytes, int) and hasattr(current, 'dtype'):
+            # numpy数组：数据缓冲区加对象头
+            total += nbytes + sys.getsizeof(current, 0) if current.base is None else sys.getsizeof(current, 0)
+            continue
+        total += sys.getsizeof(current, 0)
+        if isinstance(current, (str, bytes, bytearray, int, float, bool, type(None))):
+            continue
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset, deque)):
+            stack.extend(current)
+        else:
+            if hasattr(current, '__dict__'):
+                stack.append(current.__dict__)
+            for slot in getattr(type(current), '__slots__', ()):
+                if hasattr(current, slot):
+                    stack.append(getattr(current, slot))
+            if hasattr(current, 'keys') and hasattr(current, '__getitem__'):
+                try:
+                    stack.extend(current[key] for key in current.keys())
+                except Exception:
+                    pass
+    return total, False
+
+def cache_sizes():
+    """各登记缓存的条目数和估算字节数"""
+    result = []
+    for name, getter in _caches.items():
+        try:
+            container = getter()
+            entries = len(container) if hasattr(container, '__len__') else None
+            size, truncated = deep_sizeof(container)
+            result.append({'name': name, 'entries': entries, 'bytes': size, 'truncated': truncated})
+        except Exception as e:
+            result.append({'name': name, 'error': str(e)})
+    return result
+
+def process_memory():
+    """当前进程的常驻内存与峰值（字节），优先读取/proc"""
+    rss = peak = None
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith('VmHWM:'):
+                    peak = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if peak is None:
+        try:
+            import resource
+            usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # macOS以字节计，Linux以KB计
+            peak = usage if sys.platform == 'darwin' else usage * 1024
+        except (ImportError, OSError):
+            pass
+    return {'rss_bytes': rss, 'peak_rss_bytes': peak}
+
+def parse_tracemalloc_frames(value):
+    """解析tracemalloc调用栈深度（1到MAX_TRACEMALLOC_FRAMES的整数），未指定时返回默认值；无效时抛出ValueError"""
+    if value is None:
+        return TRACEMALLOC_FRAMES
+    if isinstance(value, bool) or not (isinstance(value, int) or (isinstance(value, str) and value.isdigit())):
+        raise ValueError('frames必须是正整数')
+    value = int(value)
+    if not 0 < value <= MAX_TRACEMALLOC_FRAMES:
+        raise ValueError(f'frames必须在1到{MAX_TRACEMALLOC_FRAMES}之间')
+    return value
+
+def start_tracemalloc(frames=TRACEMALLOC_FRAMES):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+def stop_tracemalloc():
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    with _snapshots_lock:
+        _snapshots.clear()
+
+def _format_statistic(stat):
+    frame = stat.traceback[0]
+    return {
+        'location': f'{frame.filename}:{frame.lineno}',
+        'size_bytes': stat.size,
+        'count': stat.count,
+        'traceback': [f'{f.filename}:{f.lineno}' for f in stat.traceback]
+    }
+
+def _format_diff(stat):
+    item = _format_statistic(stat)
+    item.update({'size_diff_bytes': stat.size_diff, 'count_diff': stat.count_diff})
+    return item
+
+def _filtered(snapshot):
+    return snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<unknown>')
+    ))
+
+def top_allocators(limit=20, group_by='lineno'):
+    """tracemalloc中当前占用最多的分配位置"""
+    if not tracemalloc.is_tracing():
+        return None
+    current, peak = tracemalloc.get_traced_memory()
+    snapshot = _filtered(tracemalloc.take_snapshot())
+    return {
+        'traced_bytes': current,
+        'traced_peak_bytes': peak,
+        'top': [_format_statistic(stat) for stat in snapshot.statistics(group_by)[:limit]]
+    }
+
+class MemorySnapshot:
+    """某一时刻的进程内存、缓存大小和tracemalloc快照"""
+
+    def __init__(self, label=None):
+        self.snapshot_id = uuid.uuid4().hex[:8]
+        self.label = label
+        self.taken_at = datetime.now()
+        self.process = process_memory()
+        self.caches = {item['name']: item for item in cache_sizes()}
+        self.tracemalloc = _filtered(tracemalloc.take_snapshot()) if tracemalloc.is_tracing() else None
+
+    def summary(self):
+        return {
+            'id': self.snapshot_id,
+            'label': self.label,
+            'taken_at': self.taken_at.isoformat(),
+            'rss_bytes': self.process['rss_bytes'],
+            'has_tracemalloc': self.tracemalloc is not None
+        }
+
+_snapshots = deque(maxlen=MAX_SNAPSHOTS)
+_snapshots_lock = threading.Lock()
+
+def take_snapshot(label=None):
+    snapshot = MemorySnapshot(label)
+    with _snapshots_lock:
+        _snapshots.append(snapshot)
+    return snapshot
+
+def list_snapshots():
+    with _snapshots_lock:
+        return [snapshot.summary() for snapshot in _snapshots]
+
+def get_snapshot(snapshot_id):
+    with _snapshots_lock:
+        return next((snapshot for snapshot in _snapshots if snapshot.snapshot_id == snapshot_id), None)
+
+def diff_snapshots(old, new, limit=20, group_by='lineno'):
+    """比较两个快照：常驻内存、各缓存和tracemalloc分配位置的变化"""
+    caches = []
+    for name, item in new.caches.items():
+        before = old.caches.get(name, {})
+        caches.append({
+            'name': name,
+            'entries': item.get('entries'),
+            'entries_diff': (item.get('entries') or 0) - (before.get('entries') or 0),
+            'bytes': item.get('bytes'),
+            'bytes_diff': (item.get('bytes') or 0) - (before.get('bytes') or 0)
+        })
+    caches.sort(key=lambda item: item['bytes_diff'], reverse=True)
+
+    old_rss, new_rss = old.process['rss_bytes'], new.process['rss_bytes']
+    result = {
+        'from': old.summary(),
+        'to': new.summary(),
+        'elapsed_seconds': round((new.taken_at - old.taken_at).total_seconds(), 1),
+        'rss_diff_bytes': new_rss - old_rss if old_rss is not None and new_rss is not None else None,
+        'caches': caches,
+        'top': None
+    }
+    if old.tracemalloc is not None and new.tracemalloc is not None:
+        stats = new.tracemalloc.compare_to(old.tracemalloc, group_by)
+        result['top'] = [_format_diff(stat) for stat in stats[:limit]]
+    return result
+
+def memory_report(limit=20):
+    """管理接口使用的完整内存报告"""
+    return {
+        'process': process_memory(),
+        'gc': {'counts': gc.get_count(), 'objects': len(gc.get_objects())},
+        'caches': cache_sizes(),
+        'tracemalloc': top_allocators(limit),
+        'snapshots': list_snapshots()
+    }
+
+class MemoryWatchdog:
+    """定时检查常驻内存，增长超过阈值时输出增长最多的缓存和分配位置"""
+
+    def __init__(self, interval_minutes=WATCHDOG_INTERVAL_MINUTES, threshold_mb=WATCHDOG_THRESHOLD_MB):
+        self.interval = interval_minutes * 60
+        self.threshold = threshold_mb * 1024 * 1024
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='memory-watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        previous = MemorySnapshot('watchdog')
+        while not self._stop.wait(self.interval):
+            current = MemorySnapshot('watchdog')
+            growth = (current.process['rss_bytes'] or 0) - (previous.process['rss_bytes'] or 0)
+            if growth >= self.threshold:
+                self.report_growth(previous, current, growth)
+            previous = current
+
+    def report_growth(self, previous, current, growth):
+        diff = diff_snapshots(previous, current, limit=5)
+        print(f"[内存看门狗] {diff['elapsed_seconds']:.0f}秒内常驻内存增长 {growth / 1048576:.1f}MB，"
+              f"当前 {(current.process['rss_bytes'] or 0) / 1048576:.1f}MB")
+        for cache in diff['caches'][:5]:
+            if cache['bytes_diff'] > 0:
+                print(f"  缓存 {cache['name']}: +{cache['bytes_diff'] / 1024:.0f}KB "
+                      f"({cache['entries_diff']:+} 条，共 {cache['entries']} 条)")
+        for stat in diff['top'] or []:
+            print(f"  分配 {stat['location']}: {stat['size_diff_bytes'] / 1024:+.0f}KB ({stat['count_diff']:+} 个)")
+
+watchdog = MemoryWatchdog()
+
+if TRACEMALLOC_ENABLED:
+    start_tracemalloc()
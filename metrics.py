@@ -0,0 +1,293 @@
+import bisect
+import sqlite3
+import threading
+import time
+
+# 默认的延迟分桶（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 响应体大小分桶（字节）
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# 单次请求的SQL语句数分桶
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Counter:
+    """按标签分组的累加计数器"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+class Histogram:
+    """按标签分组的累积分桶直方图，可估算分位数"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # [各分桶计数(含+Inf), 总和, 总数]
+                series = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._series[labels] = series
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def label_sets(self):
+        with self._lock:
+            return sorted(self._series)
+
+    def quantile(self, q, *labels):
+        """按分桶线性插值估算分位数（与PromQL的histogram_quantile一致）"""
+        with self._lock:
+            series = self._series.get(labels)
+            if not series or not series[2]:
+                return None
+            counts = list(series[0])
+            total = series[2]
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index >= len(self.buckets):
+                    return self.buckets[-1]
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def summary(self, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            count, total = (series[2], series[1]) if series else (0, 0.0)
+        return {
+            'count': count,
+            'sum': round(total, 6),
+            'p50': self.quantile(0.5, *labels),
+            'p95': self.quantile(0.95, *labels),
+            'p99': self.quantile(0.99, *labels)
+        }
+
+    def samples(self):
+        with self._lock:
+            items = sorted((labels, ([*series[0]], series[1], series[2])) for labels, series in self._series.items())
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_number(float(bound))}"'
+                yield f'{self.name}_bucket', _format_labels(self.labelnames, labels, le), cumulative
+            yield f'{self.name}_sum', _format_labels(self.labelnames, labels), total
+            yield f'{self.name}_count', _format_labels(self.labelnames, labels), count
+
+class Gauge:
+    """由回调函数实时计算取值的指标"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, callback, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._callback = callback
+
+    def samples(self):
+        values = self._callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+class MetricsRegistry:
+    """指标注册表，负责输出Prometheus文本格式"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback, labelnames=()):
+        return self.register(Gauge(name, documentation, callback, labelnames))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+REQUEST_LATENCY = registry.histogram(
+    'http_request_duration_seconds', 'HTTP请求处理耗时', ('route', 'method'))
+REQUESTS_TOTAL = registry.counter(
+    'http_requests_total', 'HTTP请求数', ('route', 'method', 'status'))
+RESPONSE_BYTES = registry.histogram(
+    'http_response_size_bytes', 'HTTP响应体大小', ('route',), SIZE_BUCKETS)
+DB_QUERIES = registry.histogram(
+    'db_queries_per_request', '单次请求执行的SQL语句数', ('route',), COUNT_BUCKETS)
+DB_TIME = registry.histogram(
+    'db_time_per_request_seconds', '单次请求的数据库耗时', ('route',))
+AI_PROVIDER_LATENCY = registry.histogram(
+    'ai_provider_request_duration_seconds', 'AI服务商调用耗时', ('mode', 'outcome'))
+CACHE_REQUESTS = registry.counter(
+    'cache_requests_total', '缓存访问次数', ('cache', 'result'))
+
+def _cache_hit_ratios():
+    values = CACHE_REQUESTS.snapshot()
+    ratios = {}
+    for cache in {labels[0] for labels in values}:
+        hits = values.get((cache, 'hit'), 0)
+        total = hits + values.get((cache, 'miss'), 0)
+        ratios[(cache,)] = hits / total if total else 0.0
+    return ratios
+
+registry.gauge('cache_hit_ratio', '缓存命中率', _cache_hit_ratios, ('cache',))
+
+def record_cache(cache, hit):
+    """记录一次缓存访问"""
+    CACHE_REQUESTS.inc(cache, 'hit' if hit else 'miss')
+
+# 当前线程内正在处理的请求的数据库统计
+_request_stats = threading.local()
+
+def begin_request():
+    """请求开始时重置线程内统计"""
+    _request_stats.started = time.perf_counter()
+    _request_stats.db_queries = 0
+    _request_stats.db_time = 0.0
+
+def record_db_query(duration):
+    """累加一次SQL执行耗时（请求上下文之外的调用忽略）"""
+    if getattr(_request_stats, 'started', None) is not None:
+        _request_stats.db_queries += 1
+        _request_stats.db_time += duration
+
+def request_elapsed():
+    """当前请求已耗费的秒数，请求上下文之外返回None"""
+    started = getattr(_request_stats, 'started', None)
+    return None if started is None else time.perf_counter() - started
+
+def end_request(route, method, status, response_bytes):
+    """请求结束时写入各项指标"""
+    started = getattr(_request_stats, 'started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    REQUEST_LATENCY.observe(elapsed, route, method)
+    REQUESTS_TOTAL.inc(route, method, str(status))
+    if response_bytes is not None:
+        RESPONSE_BYTES.observe(response_bytes, route)
+    DB_QUERIES.observe(_request_stats.db_queries, route)
+    DB_TIME.observe(_request_stats.db_time, route)
+    _request_stats.started = None
+
+# SQL语句执行后的回调：listener(connection, sql, parameters, duration)
+_statement_listeners = []
+
+def add_statement_listener(listener):
+    """注册SQL语句监听器（executemany时parameters为None）"""
+    _statement_listeners.append(listener)
+
+def _notify_statement(connection, sql, parameters, duration):
+    record_db_query(duration)
+    for listener in _statement_listeners:
+        try:
+            listener(connection, sql, parameters, duration)
+        except Exception as e:
+            print(f"SQL语句监听器异常: {e}")
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """记录每条语句耗时的游标"""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _notify_statement(self.connection, sql, parameters, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _notify_statement(self.connection, sql, None, time.perf_counter() - started)
+
+class InstrumentedConnection(sqlite3.Connection):
+    """默认创建InstrumentedCursor的连接"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def route_summaries():
+    """各路由的延迟分位数汇总（JSON视图用）"""
+    return [
+        dict(REQUEST_LATENCY.summary(route, method), route=route, method=method)
+        for route, method in REQUEST_LATENCY.label_sets()
+    ]
@@ -0,0 +1,114 @@
+import threading
+import numpy as np
+from memory_monitor import register_cache
+
+# 各评分因子的权重
+PRIORITY_WEIGHTS = {
+    'urgency': 0.40,
+    'importance': 0.20,
+    'priority': 0.15,
+    'age': 0.10,
+    'latency_risk': 0.15
+}
+
+PRIORITY_LEVELS = {'high': 1.0, 'medium': 0.5, 'low': 0.0}
+
+# 无历史完成记录时假定的完成耗时（天）
+DEFAULT_LATENCY_DAYS = 3.0
+
+def load_priority_inputs(user_id, conn):
+    """从数据库读取评分所需的原始数据，日期差在SQL中用julianday计算
+
+    created_at由CURRENT_TIMESTAMP写入（UTC），due_date为本地日期。
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id, title, list_id, is_important, priority, due_date,
+               julianday(due_date) - julianday('now', 'localtime', 'start of day') AS days_until_due,
+               julianday('now') - julianday(created_at) AS age_days
+        FROM tasks
+        WHERE user_id = ? AND completed = 0
+    ''', (user_id,))
+    tasks = cursor.fetchall()
+
+    # 历史完成耗时：按列表统计平均值
+    cursor.execute('''
+        SELECT list_id, AVG(julianday(completed_at) - julianday(created_at)) AS latency_days
+        FROM tasks
+        WHERE user_id = ? AND completed = 1 AND completed_at IS NOT NULL
+        GROUP BY list_id
+    ''', (user_id,))
+    list_latency = {row['list_id']: row['latency_days'] for row in cursor.fetchall()
+                    if row['latency_days'] is not None and row['latency_days'] >= 0}
+    return tasks, list_latency
+
+def score_tasks(tasks, list_latency, weights=PRIORITY_WEIGHTS):
+    """对所有待办任务一次性向量化评分，返回按得分降序排列的建议列表"""
+    if not tasks:
+        return []
+
+    count = len(tasks)
+    days_until_due = np.array([row['days_until_due'] if row['days_until_due'] is not None else np.nan
+                               for row in tasks], dtype=np.float64)
+    age_days = np.array([row['age_days'] or 0.0 for row in tasks], dtype=np.float64)
+    importance = np.array([1.0 if row['is_important'] else 0.0 for row in tasks])
+    priority = np.array([PRIORITY_LEVELS.get(row['priority'], 0.5) for row in tasks])
+
+    default_latency = float(np.mean(list(list_latency.values()))) if list_latency else DEFAULT_LATENCY_DAYS
+    latency = np.array([list_latency.get(row['list_id'], default_latency) for row in tasks])
+
+    has_due = ~np.isnan(days_until_due)
+    due = np.where(has_due, days_until_due, 0.0)
+
+    # 紧迫度：越接近截止日越接近1，已逾期为1，无截止日期给较低基础分
+    urgency = np.where(has_due, 1.0 / (1.0 + np.exp(np.clip((due - 2.0) / 1.5, -50.0, 50.0))), 0.1)
+    urgency = np.where(has_due & (due < 0), 1.0, urgency)
+
+    # 任务搁置时间：30天封顶
+    age = np.clip(np.log1p(np.maximum(age_days, 0.0)) / np.log1p(30.0), 0.0, 1.0)
+
+    # 延期风险：该列表历史完成耗时相对剩余天数的比例
+    latency_risk = np.where(has_due, np.clip(latency / np.maximum(due, 0.5), 0.0, 1.0), 0.0)
+
+    factors = {
+        'urgency': urgency,
+        'importance': importance,
+        'priority': priority,
+        'age': age,
+        'latency_risk': latency_risk
+    }
+    scores = np.zeros(count)
+    for name, values in factors.items():
+        scores += weights.get(name, 0.0) * values
+
+    order = np.argsort(-scores, kind='stable')
+    suggestions = []
+    for rank, i in enumerate(order, start=1):
+        row = tasks[i]
+        suggestions.append({
+            'id': row['id'],
+            'title': row['title'],
+            'list_id': row['list_id'],
+            'due_date': row['due_date'],
+            'rank': rank,
+            'score': round(float(scores[i]), 4),
+            'factors': {name: round(float(values[i]), 3) for name, values in factors.items()}
+        })
+    return suggestions
+
+_cache = {}
+_cache_lock = threading.Lock()
+register_cache('priority_suggestions', lambda: _cache)
+
+def get_priority_suggestions(user_id, data_version, conn):
+    """获取优先级建议，按用户数据版本缓存评分结果"""
+    with _cache_lock:
+        cached = _cache.get(user_id)
+    if cached and cached[0] == data_version:
+        return cached[1], True
+
+    tasks, list_latency = load_priority_inputs(user_id, conn)
+    suggestions = score_tasks(tasks, list_latency)
+    with _cache_lock:
+        _cache[user_id] = (data_version, suggestions)
+    return suggestions, False
@@ -0,0 +1,433 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+from memory_monitor import register_cache
+
+# 单次请求分析结果的保存目录
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join('logs', 'profiles'))
+# 单次请求统计采样的间隔（毫秒）
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', '2'))
+# 目录中最多保留的分析结果数
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', '200'))
+# 调用栈最大深度
+MAX_STACK_DEPTH = 64
+
+# 常驻采样器配置：采样频率、开销预算、滚动窗口
+SAMPLING_ENABLED = os.environ.get('SAMPLING_PROFILER', '1').lower() not in ('0', 'false', 'no')
+SAMPLING_HZ = float(os.environ.get('SAMPLING_PROFILER_HZ', '97'))
+SAMPLING_OVERHEAD_BUDGET = float(os.environ.get('SAMPLING_PROFILER_BUDGET', '0.02'))
+SAMPLING_BUCKET_SECONDS = 60
+SAMPLING_WINDOW_BUCKETS = 10
+
+PROFILE_MODES = {'1': ('cprofile',), 'cprofile': ('cprofile',), 'sample': ('sample',),
+                 'both': ('cprofile', 'sample')}
+
+_slug_pattern = re.compile(r'[^A-Za-z0-9]+')
+_profile_name_pattern = re.compile(r'^[\w.-]+$')
+
+def frame_label(code):
+    """调用栈中一帧的显示名称：函数名 (文件名:首行号)"""
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+# 代码对象到显示名称的缓存，避免每次采样都格式化字符串
+_label_cache = {}
+
+def frame_stack(frame, limit=MAX_STACK_DEPTH):
+    """从最外层到当前帧的调用栈标签列表"""
+    stack = []
+    while frame is not None and len(stack) < limit:
+        code = frame.f_code
+        label = _label_cache.get(code)
+        if label is None:
+            label = _label_cache[code] = frame_label(code)
+        stack.append(label)
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+def _pstats_label(func):
+    filename, line, name = func
+    if filename == '~':
+        return name
+    return f'{name} ({os.path.basename(filename)}:{line})'
+
+def collapse_pstats(stats):
+    """由cProfile的调用关系近似还原调用栈，输出collapsed格式（权重为微秒）
+
+    每个函数的自身耗时按各调用方贡献的累计耗时比例分摊到调用路径上。
+    """
+    children = {}
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, (_, _, _, edge_cumulative) in callers.items():
+            children.setdefault(caller, []).append((func, edge_cumulative))
+    roots = [func for func, entry in stats.stats.items() if not entry[4]]
+
+    weights = Counter()
+
+    def walk(func, path, cumulative):
+        _, _, total_self, total_cumulative, _ = stats.stats[func]
+        if total_cumulative <= 0 or cumulative <= 0:
+            return
+        ratio = min(cumulative / total_cumulative, 1.0)
+        path = path + [_pstats_label(func)]
+        own = int(total_self * ratio * 1e6)
+        if own:
+            weights[';'.join(path)] += own
+        if len(path) >= MAX_STACK_DEPTH:
+            return
+        for child, edge_cumulative in children.get(func, []):
+            if _pstats_label(child) in path:
+                continue
+            walk(child, path, edge_cumulative * ratio)
+
+    for root in roots:
+        walk(root, [], stats.stats[root][3])
+    return weights
+
+class StackSampler:
+    """后台线程定时读取目标线程的调用栈并聚合为collapsed格式"""
+
+    def __init__(self, thread_id, interval_ms=PROFILE_SAMPLE_INTERVAL_MS):
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[';'.join(frame_stack(frame))] += 1
+
+class RequestProfile:
+    """一次被分析请求的运行状态"""
+
+    def __init__(self, modes, meta):
+        self.profile_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.modes = modes
+        self.meta = meta
+        self.profiler = cProfile.Profile() if 'cprofile' in modes else None
+        self.sampler = StackSampler(threading.get_ident()) if 'sample' in modes else None
+        self.started = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.sampler:
+            self.sampler.start()
+        if self.profiler:
+            self.profiler.enable()
+
+    def stop(self):
+        if self.profiler:
+            self.profiler.disable()
+        if self.sampler:
+            self.sampler.stop()
+        self.meta['duration_ms'] = round((time.perf_counter() - self.started) * 1000, 3)
+
+    def save(self, directory=PROFILE_DIR):
+        """保存pstats、collapsed栈和元数据文件"""
+        os.makedirs(directory, exist_ok=True)
+        slug = _slug_pattern.sub('_', self.meta.get('route', '')).strip('_')[:60] or 'request'
+        base = os.path.join(directory, f'{self.profile_id}-{slug}')
+        files = {}
+        if self.profiler:
+            self.profiler.dump_stats(base + '.pstats')
+            files['pstats'] = os.path.basename(base + '.pstats')
+        if self.sampler and self.sampler.samples:
+            collapsed = self.sampler.samples
+        elif self.profiler:
+            collapsed = collapse_pstats(pstats.Stats(self.profiler))
+        else:
+            collapsed = {}
+        if collapsed:
+            with open(base + '.collapsed', 'w', encoding='utf-8') as f:
+                for stack, weight in sorted(collapsed.items()):
+                    f.write(f'{stack} {weight}\n')
+            files['collapsed'] = os.path.basename(base + '.collapsed')
+        self.meta.update({'id': self.profile_id, 'modes': list(self.modes), 'files': files,
+                          'sampler_unit': 'samples' if self.sampler else 'microseconds'})
+        with open(base + '.json', 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=2)
+        prune_profiles(directory)
+        return self.meta
+
+_local = threading.local()
+
+def start_request_profile(mode, meta):
+    """按X-Profile取值开始分析当前请求，取值无效时返回None"""
+    modes = PROFILE_MODES.get(mode.strip().lower())
+    if not modes:
+        return None
+    profile = RequestProfile(modes, meta)
+    _local.profile = profile
+    profile.start()
+    return profile
+
+def current_request_profile():
+    return getattr(_local, 'profile', None)
+
+def finish_request_profile():
+    """结束并保存当前请求的分析结果"""
+    profile = current_request_profile()
+    if profile is None:
+        return None
+    _local.profile = None
+    profile.stop()
+    try:
+        return profile.save()
+    except OSError as e:
+        print(f"保存请求分析结果失败: {e}")
+        return None
+
+# 正在处理请求的线程ID到路由的映射，供常驻采样器归类
+_active_routes = {}
+
+def set_thread_route(route):
+    _active_routes[threading.get_ident()] = route
+
+def clear_thread_route():
+    _active_routes.pop(threading.get_ident(), None)
+
+# 阻塞等待中的最内层帧（文件名, 函数名），无法读取线程CPU时间时据此跳过空闲样本
+IDLE_FRAMES = {
+    ('threading.py', 'wait'), ('threading.py', '_wait_for_tstate_lock'), ('queue.py', 'get'),
+    ('socket.py', 'readinto'), ('socket.py', 'accept'), ('ssl.py', 'read'), ('ssl.py', 'recv_into'),
+    ('selectors.py', 'select'), ('subprocess.py', '_wait'), ('subprocess.py', 'communicate'),
+}
+
+def thread_cpu_time(tid):
+    """线程累计占用的CPU时间（秒），平台不支持时返回None"""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(tid))
+    except (AttributeError, OSError, OverflowError):
+        return None
+
+def is_idle_frame(frame):
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+class ContinuousSampler:
+    """常驻后台采样器：定时读取处理请求中的线程调用栈，按路由聚合到滚动窗口
+
+    只统计占用CPU的样本：两次采样间线程CPU时间几乎没有增长（等锁、等I/O、sleep）时
+    跳过并计入idle_samples，因此样本数约等于CPU时间×采样频率，而不是请求的墙钟耗时。
+    无法读取线程CPU时间的平台上退化为按IDLE_FRAMES识别阻塞帧，直接调用time.sleep等
+    C函数的等待仍会被计入。
+    采样线程自身耗时超过开销预算时自动降低采样频率，回落到预算一半以下时逐步恢复。
+    """
+
+    def __init__(self, hz=SAMPLING_HZ, budget=SAMPLING_OVERHEAD_BUDGET,
+                 bucket_seconds=SAMPLING_BUCKET_SECONDS, window_buckets=SAMPLING_WINDOW_BUCKETS):
+        self.target_hz = hz
+        self.hz = hz
+        self.budget = budget
+        self.bucket_seconds = bucket_seconds
+        self._buckets = deque(maxlen=window_buckets)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.started_at = None
+        self.sample_time = 0.0
+        self.total_samples = 0
+        self.idle_samples = 0
+        self._recent_overhead = 0.0
+        # 线程ID到(上次采样的墙钟时间, CPU时间)
+        self._cpu_seen = {}
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _current_bucket(self, now):
+        bucket_start = int(now // self.bucket_seconds * self.bucket_seconds)
+        if not self._buckets or self._buckets[-1][0] != bucket_start:
+            self._buckets.append((bucket_start, {}))
+        return self._buckets[-1][1]
+
+    def sample_once(self):
+        """采集一次所有处理请求中、正在占用CPU的线程"""
+        started = time.perf_counter()
+        routes = dict(_active_routes)
+        for tid in self._cpu_seen.keys() - routes.keys():
+            del self._cpu_seen[tid]
+        if routes:
+            frames = sys._current_frames()
+            stacks = []
+            idle = 0
+            for tid, route in routes.items():
+                if tid not in frames:
+                    continue
+                if self._is_idle(tid, frames[tid], started):
+                    idle += 1
+                else:
+                    stacks.append((route, ';'.join(frame_stack(frames[tid]))))
+            with self._lock:
+                bucket = self._current_bucket(time.time())
+                for route, stack in stacks:
+                    bucket.setdefault(route, Counter())[stack] += 1
+                self.total_samples += len(stacks)
+                self.idle_samples += idle
+        elapsed = time.perf_counter() - started
+        self.sample_time += elapsed
+        return elapsed
+
+    def _is_idle(self, tid, frame, now):
+        """自上次采样以来线程占用CPU不到墙钟时间的十分之一时视为阻塞等待"""
+        cpu = thread_cpu_time(tid)
+        if cpu is None:
+            return is_idle_frame(frame)
+        previous = self._cpu_seen.get(tid)
+        self._cpu_seen[tid] = (now, cpu)
+        if previous is None:
+            return is_idle_frame(frame)
+        return cpu - previous[1] < (now - previous[0]) * 0.1
+
+    def _run(self):
+        window_started = time.perf_counter()
+        window_busy = 0.0
+        while not self._stop.wait(1 / self.hz):
+            window_busy += self.sample_once()
+            window_elapsed = time.perf_counter() - window_started
+            if window_elapsed >= 5:
+                self._recent_overhead = window_busy / window_elapsed
+                if self._recent_overhead > self.budget:
+                    self.hz = max(self.hz / 2, 1)
+                elif self._recent_overhead < self.budget / 2 and self.hz < self.target_hz:
+                    self.hz = min(self.hz * 2, self.target_hz)
+                window_started = time.perf_counter()
+                window_busy = 0.0
+
+    def overhead(self):
+        """采样线程累计耗时占运行时间的比例"""
+        if not self.started_at:
+            return 0.0
+        elapsed = time.perf_counter() - self.started_at
+        return self.sample_time / elapsed if elapsed else 0.0
+
+    def aggregate(self, window_seconds=None, route=None):
+        """合并滚动窗口内的栈计数，返回{路由: Counter}"""
+        cutoff = time.time() - window_seconds if window_seconds else None
+        merged = {}
+        with self._lock:
+            for bucket_start, routes in self._buckets:
+                if cutoff is not None and bucket_start + self.bucket_seconds < cutoff:
+                    continue
+                for name, stacks in routes.items():
+                    if route and name != route:
+                        continue
+                    merged.setdefault(name, Counter()).update(stacks)
+        return merged
+
+    def report(self, window_seconds=None, route=None, top=20):
+        """各路由的样本数和热点帧（自身/累计样本数）"""
+        routes = []
+        for name, stacks in self.aggregate(window_seconds, route).items():
+            self_counts = Counter()
+            total_counts = Counter()
+            for stack, count in stacks.items():
+                frames = stack.split(';')
+                self_counts[frames[-1]] += count
+                for frame in set(frames):
+                    total_counts[frame] += count
+            samples = sum(stacks.values())
+            routes.append({
+                'route': name,
+                'samples': samples,
+                'top_self': [{'frame': frame, 'samples': count, 'ratio': round(count / samples, 4)}
+                             for frame, count in self_counts.most_common(top)],
+                'top_total': [{'frame': frame, 'samples': count, 'ratio': round(count / samples, 4)}
+                              for frame, count in total_counts.most_common(top)]
+            })
+        routes.sort(key=lambda item: item['samples'], reverse=True)
+        return {
+            'running': self.running,
+            'hz': self.hz,
+            'target_hz': self.target_hz,
+            'overhead': round(self.overhead(), 5),
+            'recent_overhead': round(self._recent_overhead, 5),
+            'budget': self.budget,
+            'total_samples': self.total_samples,
+            'idle_samples': self.idle_samples,
+            'window_seconds': window_seconds or self.bucket_seconds * self._buckets.maxlen,
+            'routes': routes
+        }
+
+    def collapsed(self, window_seconds=None, route=None):
+        """collapsed格式文本，以路由作为根帧"""
+        lines = []
+        for name, stacks in sorted(self.aggregate(window_seconds, route).items()):
+            for stack, count in sorted(stacks.items()):
+                lines.append(f'{name};{stack} {count}')
+        return '\n'.join(lines) + ('\n' if lines else '')
+
+sampler = ContinuousSampler()
+register_cache('sampling_profiler', lambda: sampler._buckets)
+register_cache('frame_labels', lambda: _label_cache)
+
+def prune_profiles(directory=PROFILE_DIR, keep=PROFILE_KEEP):
+    """只保留最近的keep个分析结果"""
+    metas = sorted(name for name in os.listdir(directory) if name.endswith('.json'))
+    for name in metas[:-keep] if keep else []:
+        base = name[:-5]
+        for suffix in ('.json', '.pstats', '.collapsed'):
+            try:
+                os.remove(os.path.join(directory, base + suffix))
+            except FileNotFoundError:
+                pass
+
+def list_profiles(directory=PROFILE_DIR, limit=50):
+    """最近的分析结果元数据，按时间倒序"""
+    if not os.path.isdir(directory):
+        return []
+    result = []
+    for name in sorted((n for n in os.listdir(directory) if n.endswith('.json')), reverse=True)[:limit]:
+        try:
+            with open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+                result.append(json.load(f))
+        except (OSError, json.JSONDecodeError):
+            continue
+    return result
+
+def profile_file_path(filename, directory=PROFILE_DIR):
+    """校验文件名并返回完整路径，不存在或不合法时返回None"""
+    if not _profile_name_pattern.match(filename) or not filename.endswith(('.pstats', '.collapsed', '.json')):
+        return None
+    path = os.path.join(directory, filename)
+    return path if os.path.isfile(path) else None
+
+def format_pstats(path, sort='cumulative', limit=40):
+    """把pstats文件格式化为文本报告"""
+    output = io.StringIO()
+    stats = pstats.Stats(path, stream=output)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return output.getvalue()
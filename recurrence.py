@@ -0,0 +1,159 @@
+import calendar
+from datetime import date, timedelta
+
+# 支持的RRULE子集
+SUPPORTED_FREQUENCIES = ('DAILY', 'WEEKLY', 'MONTHLY')
+
+def parse_rrule(rule):
+    """解析RRULE子集（FREQ/INTERVAL/COUNT/UNTIL），格式错误时抛出ValueError"""
+    if not rule:
+        return None
+    parsed = {'freq': None, 'interval': 1, 'count': None, 'until': None}
+    text = rule.strip()
+    if text.upper().startswith('RRULE:'):
+        text = text[6:]
+    for part in text.split(';'):
+        if not part:
+            continue
+        key, _, value = part.partition('=')
+        key = key.strip().upper()
+        value = value.strip()
+        if key == 'FREQ':
+            if value.upper() not in SUPPORTED_FREQUENCIES:
+                raise ValueError(f'不支持的重复频率: {value}')
+            parsed['freq'] = value.upper()
+        elif key == 'INTERVAL':
+            parsed['interval'] = int(value)
+            if parsed['interval'] < 1:
+                raise ValueError('INTERVAL必须为正整数')
+        elif key == 'COUNT':
+            parsed['count'] = int(value)
+            if parsed['count'] < 1:
+                raise ValueError('COUNT必须为正整数')
+        elif key == 'UNTIL':
+            digits = value[:8] if '-' not in value else value[:10].replace('-', '')
+            parsed['until'] = date(int(digits[:4]), int(digits[4:6]), int(digits[6:8]))
+        else:
+            raise ValueError(f'不支持的重复规则字段: {key}')
+    if not parsed['freq']:
+        raise ValueError('重复规则缺少FREQ')
+    return parsed
+
+def normalize_rrule(rule):
+    """校验并规范化重复规则字符串，空值返回None"""
+    parsed = parse_rrule(rule)
+    if not parsed:
+        return None
+    parts = [f"FREQ={parsed['freq']}"]
+    if parsed['interval'] != 1:
+        parts.append(f"INTERVAL={parsed['interval']}")
+    if parsed['count']:
+        parts.append(f"COUNT={parsed['count']}")
+    if parsed['until']:
+        parts.append(f"UNTIL={parsed['until'].strftime('%Y%m%d')}")
+    return ';'.join(parts)
+
+def _add_months(start, months):
+    """按月偏移，日期超出当月天数时返回None跳过（与RFC 5545一致）；超出date支持的年份时抛出OverflowError"""
+    month_index = start.month - 1 + months
+    year = start.year + month_index // 12
+    month = month_index % 12 + 1
+    if year > date.max.year:
+        raise OverflowError('重复日期超出支持的范围')
+    if start.day > calendar.monthrange(year, month)[1]:
+        return None
+    return date(year, month, start.day)
+
+def iter_occurrences(dtstart, rule, window_start, window_end):
+    """惰性生成落在[window_start, window_end]内的重复日期
+
+    每日/每周规则直接跳到窗口内第一次出现，不会从起始日期逐个遍历；
+    COUNT按从dtstart开始的序号计算。日期超出date支持的范围时结束。
+    """
+    parsed = parse_rrule(rule) if isinstance(rule, str) else rule
+    if not parsed or dtstart > window_end:
+        return
+
+    last = window_end
+    if parsed['until'] and parsed['until'] < last:
+        last = parsed['until']
+    count = parsed['count']
+
+    if parsed['freq'] in ('DAILY', 'WEEKLY'):
+        step = parsed['interval'] * (7 if parsed['freq'] == 'WEEKLY' else 1)
+        index = 0
+        if window_start > dtstart:
+            index = -(-(window_start - dtstart).days // step)
+        while True:
+            if count is not None and index >= count:
+                return
+            try:
+                current = dtstart + timedelta(days=index * step)
+            except OverflowError:
+                return
+            if current > last:
+                return
+            yield current
+            index += 1
+    else:
+        interval = parsed['interval']
+        index = 0
+        produced = 0
+        # 有COUNT时需要从头计数（无效日期不计入次数），否则直接跳到窗口附近
+        if count is None and window_start > dtstart:
+            months_apart = (window_start.year - dtstart.year) * 12 + window_start.month - dtstart.month
+            index = max(months_apart // interval - 1, 0)
+        while True:
+            if count is not None and produced >= count:
+                return
+            try:
+                current = _add_months(dtstart, index * interval)
+            except OverflowError:
+                return
+            index += 1
+            if current is None:
+                continue
+            if current > last:
+                return
+            produced += 1
+            if current >= window_start:
+                yield current
+
+def is_occurrence(dtstart, rule, occurrence_date):
+    """判断某日期是否为重复任务的一次实例"""
+    return next(iter_occurrences(dtstart, rule, occurrence_date, occurrence_date), None) is not None
+
+def load_recurring_occurrences(conn, user_id, window_start, window_end):
+    """读取用户的重复任务并在窗口内展开，返回(任务行, 日期, 例外状态)的生成器"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT t.id, t.title, t.description, t.completed, t.priority, t.due_date,
+               t.start_time, t.end_time, t.list_id, t.is_important, t.recurrence_rule,
+               t.created_at, t.updated_at, t.completed_at,
+               tl.name as list_name, tl.icon as list_icon, tl.color as list_color
+        FROM tasks t
+        LEFT JOIN task_lists tl ON t.list_id = tl.id
+        WHERE t.user_id = ? AND t.recurrence_rule IS NOT NULL AND t.due_date <= ?
+    ''', (user_id, window_end.isoformat()))
+    masters = cursor.fetchall()
+    if not masters:
+        return
+
+    cursor.execute('''
+        SELECT task_id, occurrence_date, status
+        FROM task_recurrence_exceptions
+        WHERE user_id = ? AND occurrence_date BETWEEN ? AND ?
+    ''', (user_id, window_start.isoformat(), window_end.isoformat()))
+    exceptions = {(row['task_id'], row['occurrence_date']): row['status'] for row in cursor.fetchall()}
+
+    for master in masters:
+        try:
+            dtstart = date.fromisoformat(master['due_date'])
+            occurrences = iter_occurrences(dtstart, master['recurrence_rule'], window_start, window_end)
+            for occurrence in occurrences:
+                status = exceptions.get((master['id'], occurrence.isoformat()))
+                if status == 'skipped':
+                    continue
+                yield master, occurrence, status
+        except (ValueError, OverflowError) as e:
+            print(f"展开重复任务{master['id']}失败: {e}")
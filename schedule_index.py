@@ -0,0 +1,352 @@
+import re
+import threading
+from datetime import date, timedelta
+import numpy as np
+from recurrence import parse_rrule, is_occurrence
+from memory_monitor import register_cache
+
+# 未填写结束时间的任务默认占用时长（分钟）
+DEFAULT_DURATION_MINUTES = 60
+# 查找空闲时段时默认的每日工作时间
+DEFAULT_DAY_START = '08:00'
+DEFAULT_DAY_END = '22:00'
+# 每个索引最多缓存的展开重复任务后的单日区间数
+EXPANDED_DAYS_LIMIT = 400
+
+def time_to_minutes(value):
+    """将HH:MM或HH:MM:SS转换为当天分钟数，无法解析时返回None"""
+    if not value:
+        return None
+    try:
+        parts = str(value).split(':')
+        return int(parts[0]) * 60 + int(parts[1])
+    except (ValueError, IndexError):
+        return None
+
+_time_pattern = re.compile(r'^([01]\d|2[0-3]):[0-5]\d$')
+
+def parse_duration(value, default, name='duration'):
+    """解析时长参数（分钟，1到1440的整数），未指定时返回默认值；无效时抛出ValueError"""
+    if value is None:
+        return default
+    if isinstance(value, bool) or not (isinstance(value, int) or (isinstance(value, str) and value.isdigit())):
+        raise ValueError(f'{name}必须是正整数（分钟）')
+    value = int(value)
+    if not 0 < value <= 24 * 60:
+        raise ValueError(f'{name}必须在1到{24 * 60}分钟之间')
+    return value
+
+def parse_day_window(day_start, day_end):
+    """解析每日时间窗口（HH:MM），返回(开始, 结束)；格式无效或开始不早于结束时抛出ValueError"""
+    day_start = DEFAULT_DAY_START if day_start is None else day_start
+    day_end = DEFAULT_DAY_END if day_end is None else day_end
+    for name, value in (('day_start', day_start), ('day_end', day_end)):
+        if not isinstance(value, str) or not _time_pattern.match(value):
+            raise ValueError(f'{name}必须是HH:MM格式')
+    if time_to_minutes(day_start) >= time_to_minutes(day_end):
+        raise ValueError('day_start必须早于day_end')
+    return day_start, day_end
+
+def parse_task_ids(value):
+    """解析任务ID列表，未指定时返回None；不是整数列表时抛出ValueError"""
+    if value is None:
+        return None
+    if not isinstance(value, list) or not all(
+            not isinstance(item, bool) and (isinstance(item, int) or (isinstance(item, str) and item.isdigit()))
+            for item in value):
+        raise ValueError('task_ids必须是任务ID数组')
+    return [int(item) for item in value]
+
+def minutes_to_time(minutes):
+    """将当天分钟数转换为HH:MM"""
+    minutes = int(minutes)
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+class DaySchedule:
+    """单日的区间索引：按开始时间排序的数组，附带结束时间前缀最大值"""
+
+    def __init__(self, starts, ends, task_ids):
+        order = np.argsort(starts, kind='stable')
+        self.starts = np.asarray(starts, dtype=np.int32)[order]
+        self.ends = np.asarray(ends, dtype=np.int32)[order]
+        self.task_ids = np.asarray(task_ids, dtype=np.int64)[order]
+        self.max_ends = np.maximum.accumulate(self.ends) if len(self.ends) else self.ends
+
+    def has_conflict(self, start, end, exclude_id=None):
+        """O(log n)判断[start, end)是否与已有区间重叠"""
+        k = int(np.searchsorted(self.starts, end, side='left'))
+        if k == 0 or self.max_ends[k - 1] <= start:
+            return False
+        if exclude_id is None:
+            return True
+        return bool(len(self.conflicts(start, end, exclude_id)))
+
+    def conflicts(self, start, end, exclude_id=None):
+        """返回与[start, end)重叠的区间下标"""
+        k = int(np.searchsorted(self.starts, end, side='left'))
+        if k == 0 or self.max_ends[k - 1] <= start:
+            return np.zeros(0, dtype=np.int64)
+        mask = self.ends[:k] > start
+        if exclude_id is not None:
+            mask &= self.task_ids[:k] != exclude_id
+        return np.nonzero(mask)[0]
+
+    def busy_intervals(self):
+        """合并重叠区间，返回(开始数组, 结束数组)"""
+        if not len(self.starts):
+            return self.starts, self.ends
+        # 开始时间不小于之前最大结束时间的位置即为新合并段的起点
+        previous_max = np.concatenate(([np.iinfo(np.int32).min], self.max_ends[:-1]))
+        segment_starts = np.nonzero(self.starts >= previous_max)[0]
+        segment_ends = np.concatenate((segment_starts[1:], [len(self.starts)])) - 1
+        return self.starts[segment_starts], self.max_ends[segment_ends]
+
+    def free_slots(self, day_start, day_end, min_duration):
+        """在[day_start, day_end)内求空闲时段"""
+        busy_starts, busy_ends = self.busy_intervals()
+        boundaries_start = np.concatenate(([day_start], busy_ends))
+        boundaries_end = np.concatenate((busy_starts, [day_end]))
+        slot_starts = np.clip(boundaries_start, day_start, day_end)
+        slot_ends = np.clip(boundaries_end, day_start, day_end)
+        keep = slot_ends - slot_starts >= min_duration
+        return list(zip(slot_starts[keep].tolist(), slot_ends[keep].tolist()))
+
+EMPTY_DAY = DaySchedule([], [], [])
+
+class ScheduleIndex:
+    """单个用户的日程区间索引，按日期分桶；重复任务按天惰性展开
+
+    任务变化时用update_tasks只重建受影响日期的区间数组，不重建整个索引。
+    """
+
+    def __init__(self, rows, exceptions=(), version=0):
+        # 索引反映的用户数据版本计数
+        self.version = version
+        self.buckets = {}
+        self.titles = {}
+        # 普通任务所在的日期{任务ID: 日期}
+        self.placements = {}
+        # 重复任务：(任务ID, 起始日期, 解析后的规则, 开始分钟, 结束分钟)
+        self.recurring = []
+        # 已完成或跳过的实例{(任务ID, 日期)}，不占用时间
+        self.exceptions = set(exceptions)
+        for row in rows:
+            self._add(row)
+        self.days = {day: DaySchedule(*bucket) for day, bucket in self.buckets.items()}
+        self._expanded = {}
+
+    def _add(self, row):
+        """加入一个任务，返回其所在日期（重复任务或无法安排时返回None）"""
+        start = time_to_minutes(row['start_time'])
+        if start is None or not row['due_date']:
+            return None
+        end = time_to_minutes(row['end_time'])
+        if end is None or end <= start:
+            end = min(start + DEFAULT_DURATION_MINUTES, 24 * 60)
+        self.titles[row['id']] = row['title']
+        if row['recurrence_rule']:
+            try:
+                self.recurring.append((row['id'], date.fromisoformat(row['due_date']),
+                                       parse_rrule(row['recurrence_rule']), start, end))
+            except ValueError:
+                pass
+            return None
+        bucket = self.buckets.setdefault(row['due_date'], ([], [], []))
+        bucket[0].append(start)
+        bucket[1].append(end)
+        bucket[2].append(row['id'])
+        self.placements[row['id']] = row['due_date']
+        return row['due_date']
+
+    def update_tasks(self, task_ids, rows, exceptions, version):
+        """用任务的当前状态替换索引中的旧区间，只重建受影响日期的区间数组
+
+        rows为这些任务中仍需占用时间的行，exceptions为这些任务当前的例外{(任务ID, 日期)}。
+        """
+        task_ids = set(task_ids)
+        dirty_days = set()
+        for task_id in task_ids:
+            self.titles.pop(task_id, None)
+            day = self.placements.pop(task_id, None)
+            if day is None:
+                continue
+            starts, ends, ids = self.buckets[day]
+            keep = [i for i, item in enumerate(ids) if item != task_id]
+            # 替换整个分桶而不是原地修改，并发读取的线程不会看到修改到一半的列表
+            self.buckets[day] = ([starts[i] for i in keep], [ends[i] for i in keep], [ids[i] for i in keep])
+            dirty_days.add(day)
+
+        recurring_changed = any(item[0] in task_ids for item in self.recurring) or \
+            any(item[0] in task_ids for item in self.exceptions) or bool(exceptions)
+        self.recurring = [item for item in self.recurring if item[0] not in task_ids]
+        self.exceptions = {item for item in self.exceptions if item[0] not in task_ids} | set(exceptions)
+        for row in rows:
+            if row['recurrence_rule']:
+                recurring_changed = True
+            day = self._add(row)
+            if day is not None:
+                dirty_days.add(day)
+
+        for day in dirty_days:
+            bucket = self.buckets[day]
+            if bucket[2]:
+                self.days[day] = DaySchedule(*bucket)
+            else:
+                del self.buckets[day]
+                self.days.pop(day, None)
+        if recurring_changed:
+            self._expanded = {}
+        else:
+            for day in dirty_days:
+                self._expanded.pop(day, None)
+        self.version = version
+
+    def day(self, day):
+        if not self.recurring:
+            return self.days.get(day, EMPTY_DAY)
+        schedule = self._expanded.get(day)
+        if schedule is None:
+            starts, ends, task_ids = (list(values) for values in self.buckets.get(day, ([], [], [])))
+            current = date.fromisoformat(day)
+            for task_id, dtstart, rule, start, end in self.recurring:
+                if dtstart <= current and (task_id, day) not in self.exceptions \
+                        and is_occurrence(dtstart, rule, current):
+                    starts.append(start)
+                    ends.append(end)
+                    task_ids.append(task_id)
+            schedule = DaySchedule(starts, ends, task_ids) if task_ids else EMPTY_DAY
+            if len(self._expanded) >= EXPANDED_DAYS_LIMIT:
+                self._expanded.clear()
+            self._expanded[day] = schedule
+        return schedule
+
+    def find_conflicts(self, day, start_time, end_time, exclude_id=None):
+        """返回与指定时间段冲突的任务列表"""
+        start = time_to_minutes(start_time)
+        if start is None:
+            return []
+        end = time_to_minutes(end_time)
+        if end is None or end <= start:
+            end = min(start + DEFAULT_DURATION_MINUTES, 24 * 60)
+
+        schedule = self.day(day)
+        if not schedule.has_conflict(start, end, exclude_id):
+            return []
+        return [{
+            'id': int(schedule.task_ids[i]),
+            'title': self.titles.get(int(schedule.task_ids[i])),
+            'start_time': minutes_to_time(schedule.starts[i]),
+            'end_time': minutes_to_time(schedule.ends[i])
+        } for i in schedule.conflicts(start, end, exclude_id)]
+
+    def free_slots(self, start_date, end_date, day_start=DEFAULT_DAY_START,
+                   day_end=DEFAULT_DAY_END, min_duration=30):
+        """求日期范围内每天的空闲时段"""
+        day_start_minutes = time_to_minutes(day_start)
+        day_end_minutes = time_to_minutes(day_end)
+        result = []
+        current = start_date
+        while current <= end_date:
+            slots = self.day(current.isoformat()).free_slots(day_start_minutes, day_end_minutes, min_duration)
+            result.append({
+                'date': current.isoformat(),
+                'slots': [{'start_time': minutes_to_time(s), 'end_time': minutes_to_time(e)} for s, e in slots]
+            })
+            current += timedelta(days=1)
+        return result
+
+def plan_auto_schedule(index, tasks, start_date, end_date, duration=DEFAULT_DURATION_MINUTES,
+                       day_start=DEFAULT_DAY_START, day_end=DEFAULT_DAY_END):
+    """按顺序把未安排时间的任务贪心填入最早可用的空闲时段
+
+    tasks为按优先顺序排列的任务行（需含id、title、due_date），
+    有截止日期的任务只会安排在截止日期当天或之前。
+    """
+    free = {day['date']: [[time_to_minutes(s['start_time']), time_to_minutes(s['end_time'])]
+                          for s in day['slots']]
+            for day in index.free_slots(start_date, end_date, day_start, day_end, duration)}
+    plan = []
+    for task in tasks:
+        latest = task['due_date'] or end_date.isoformat()
+        for day in sorted(free):
+            if day > latest:
+                break
+            slot = next((s for s in free[day] if s[1] - s[0] >= duration), None)
+            if slot:
+                plan.append({
+                    'id': task['id'],
+                    'title': task['title'],
+                    'due_date': day,
+                    'start_time': minutes_to_time(slot[0]),
+                    'end_time': minutes_to_time(slot[0] + duration)
+                })
+                slot[0] += duration
+                break
+    return plan
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+register_cache('schedule_index', lambda: _indexes)
+
+# 需要占用时间的任务（未完成且有日期和开始时间）
+SCHEDULED_TASKS_QUERY = '''
+    SELECT id, title, due_date, start_time, end_time, recurrence_rule
+    FROM tasks
+    WHERE user_id = ? AND completed = 0 AND due_date IS NOT NULL AND start_time IS NOT NULL
+'''
+
+def changed_task_ids(conn, user_id, since_version):
+    """返回版本since_version之后变化过的任务ID；变更记录已被清理、无法确定时返回None"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT MIN(version) FROM task_change_log WHERE user_id = ?', (user_id,))
+    oldest = cursor.fetchone()[0]
+    if oldest is None or oldest > since_version + 1:
+        return None
+    cursor.execute('SELECT DISTINCT task_id FROM task_change_log WHERE user_id = ? AND version > ?',
+                   (user_id, since_version))
+    return [row[0] for row in cursor.fetchall()]
+
+def _update_index(conn, user_id, index, version):
+    """把索引更新到指定版本，只重新读取期间变化的任务；无法增量更新时返回False"""
+    task_ids = changed_task_ids(conn, user_id, index.version)
+    if task_ids is None:
+        return False
+    rows, exceptions = [], []
+    for offset in range(0, len(task_ids), 500):
+        chunk = task_ids[offset:offset + 500]
+        placeholders = ','.join('?' * len(chunk))
+        cursor = conn.cursor()
+        cursor.execute(f'{SCHEDULED_TASKS_QUERY} AND id IN ({placeholders})', [user_id] + chunk)
+        rows.extend(cursor.fetchall())
+        cursor.execute(f'''
+            SELECT task_id, occurrence_date FROM task_recurrence_exceptions
+            WHERE user_id = ? AND task_id IN ({placeholders})
+        ''', [user_id] + chunk)
+        exceptions.extend((row['task_id'], row['occurrence_date']) for row in cursor.fetchall())
+    index.update_tasks(task_ids, rows, exceptions, version)
+    return True
+
+def get_schedule_index(user_id, data_version, conn):
+    """获取用户日程索引；数据版本变化时按变更记录增量更新，落后过多时重建"""
+    with _indexes_lock:
+        cached = _indexes.get(user_id)
+        if cached and cached[0] == data_version:
+            return cached[1]
+
+        cursor = conn.cursor()
+        cursor.execute('SELECT version FROM user_data_versions WHERE user_id = ?', (user_id,))
+        row = cursor.fetchone()
+        version = row[0] if row else 0
+        if cached and cached[1].version <= version and _update_index(conn, user_id, cached[1], version):
+            index = cached[1]
+        else:
+            cursor.execute(SCHEDULED_TASKS_QUERY, (user_id,))
+            rows = cursor.fetchall()
+            exceptions = ()
+            if any(row['recurrence_rule'] for row in rows):
+                cursor.execute('SELECT task_id, occurrence_date FROM task_recurrence_exceptions WHERE user_id = ?',
+                               (user_id,))
+                exceptions = [(row['task_id'], row['occurrence_date']) for row in cursor.fetchall()]
+            index = ScheduleIndex(rows, exceptions, version)
+        _indexes[user_id] = (data_version, index)
+        return index
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+SQLite语句分析器 - 按规范化语句聚合耗时，记录慢查询及其查询计划
+
+生产环境按连接抽样开启（SQL_PROFILE_SAMPLE_RATE），基准测试中设置为1.0全量开启。
+慢查询日志默认只记录规范化后的语句；SQL_SLOW_LOG_PARAMETERS=true时附带绑定参数展开后的SQL（可能含敏感数据，仅用于本地排查）。
+查看报告: python sql_profiler.py --top 20
+"""
+
+import argparse
+import atexit
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from memory_monitor import register_cache
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    try:
+        import msvcrt
+    except ImportError:
+        msvcrt = None
+
+# 默认配置，可通过环境变量覆盖
+DEFAULT_SAMPLE_RATE = float(os.environ.get('SQL_PROFILE_SAMPLE_RATE', '0.01'))
+DEFAULT_SLOW_MS = float(os.environ.get('SQL_SLOW_QUERY_MS', '50'))
+DEFAULT_PROFILE_DIR = os.environ.get('SQL_PROFILE_DIR', 'logs')
+DEFAULT_LOG_PARAMETERS = os.environ.get('SQL_SLOW_LOG_PARAMETERS', 'false').lower() in ('1', 'true', 'yes')
+STATS_FILE = 'sql_profile.json'
+SLOW_LOG_FILE = 'slow_queries.log'
+
+# 统计数据写盘间隔（秒）
+FLUSH_INTERVAL = 10
+
+_whitespace_pattern = re.compile(r'\s+')
+_string_pattern = re.compile(r"'(?:[^']|'')*'")
+_number_pattern = re.compile(r'\b\d+(?:\.\d+)?\b')
+_in_list_pattern = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_tasks_alias_pattern = re.compile(
+    r'\btasks\s+(?:AS\s+)?(?!WHERE|LEFT|JOIN|INNER|ON|SET|ORDER|GROUP|LIMIT|VALUES)(\w+)', re.IGNORECASE)
+_full_scan_pattern = re.compile(r'^SCAN (\w+)(?:\s+LEFT-JOIN)?$')
+
+def normalize_sql(sql):
+    """把语句中的字面量和IN列表替换为占位符，合并空白"""
+    sql = _string_pattern.sub('?', sql)
+    sql = _number_pattern.sub('?', sql)
+    sql = _in_list_pattern.sub('IN (?...)', sql)
+    return _whitespace_pattern.sub(' ', sql).strip()
+
+def find_tasks_full_scans(sql, plan):
+    """根据查询计划判断是否对tasks表做了全表扫描（考虑表别名）"""
+    names = {'tasks'} | {alias.lower() for alias in _tasks_alias_pattern.findall(sql)}
+    scans = []
+    for detail in plan:
+        match = _full_scan_pattern.match(detail)
+        if match and match.group(1).lower() in names:
+            scans.append(detail)
+    return scans
+
+class SQLProfiler:
+    """聚合语句统计并写出慢查询日志"""
+
+    def __init__(self, sample_rate=DEFAULT_SAMPLE_RATE, slow_ms=DEFAULT_SLOW_MS,
+                 profile_dir=DEFAULT_PROFILE_DIR, log_parameters=DEFAULT_LOG_PARAMETERS):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.profile_dir = profile_dir
+        self.log_parameters = log_parameters
+        self._stats = {}
+        self._plans = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.time()
+        self._dirty = False
+
+    def attach(self, conn):
+        """按抽样率决定是否分析该连接；需要记录绑定参数时挂上trace回调捕获展开后的SQL"""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return conn
+        conn.profiled = True
+        if self.log_parameters:
+            conn.last_traced_sql = None
+            conn.set_trace_callback(lambda statement: setattr(conn, 'last_traced_sql', statement))
+        return conn
+
+    def on_statement(self, conn, sql, parameters, duration):
+        """计时包装器回调：聚合统计，超过阈值时写慢查询日志"""
+        if not getattr(conn, 'profiled', False) or getattr(conn, 'explaining', False):
+            return
+        normalized = normalize_sql(sql)
+        duration_ms = duration * 1000
+        # explain()执行的EXPLAIN语句也会触发trace回调，需在其之前取出本语句展开后的SQL
+        traced_sql = getattr(conn, 'last_traced_sql', None)
+
+        plan = self._plans.get(normalized)
+        if plan is None and parameters is not None:
+            plan = self.explain(conn, sql, parameters)
+            self._plans[normalized] = plan
+        full_scans = find_tasks_full_scans(sql, plan or [])
+
+        with self._lock:
+            entry = self._stats.get(normalized)
+            if entry is None:
+                entry = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'slow_count': 0,
+                         'tasks_full_scan': bool(full_scans), 'plan': plan or []}
+                self._stats[normalized] = entry
+            entry['count'] += 1
+            entry['total_ms'] += duration_ms
+            entry['max_ms'] = max(entry['max_ms'], duration_ms)
+            if duration_ms >= self.slow_ms:
+                entry['slow_count'] += 1
+            self._dirty = True
+
+        if duration_ms >= self.slow_ms:
+            record = {
+                'timestamp': datetime.now().isoformat(),
+                'duration_ms': round(duration_ms, 3),
+                'statement': normalized,
+                'plan': plan or [],
+                'tasks_full_scan': full_scans
+            }
+            if self.log_parameters and traced_sql:
+                record['sql'] = traced_sql
+            self._write_slow_log(record)
+
+        if time.time() - self._last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def explain(self, conn, sql, parameters):
+        """获取语句的查询计划（使用原始游标，避免递归触发分析）"""
+        conn.explaining = True
+        try:
+            cursor = conn.cursor(sqlite3.Cursor)
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', parameters)
+            return [row[3] for row in cursor.fetchall()]
+        except sqlite3.Error:
+            return []
+        finally:
+            conn.explaining = False
+
+    def _write_slow_log(self, record):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        with open(os.path.join(self.profile_dir, SLOW_LOG_FILE), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def snapshot(self):
+        with self._lock:
+            return {sql: dict(entry) for sql, entry in self._stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._dirty = True
+
+    def flush(self):
+        """把聚合统计与已有文件合并写盘（多进程共享同一文件）"""
+        with self._lock:
+            if not self._dirty:
+                return
+            stats = {sql: dict(entry) for sql, entry in self._stats.items()}
+            self._stats.clear()
+            self._dirty = False
+            self._last_flush = time.time()
+
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, STATS_FILE)
+        # 读取-合并-写回需持有文件锁，否则多个进程同时写盘会丢失彼此的统计
+        with file_lock(path + '.lock'):
+            self._merge_into(path, stats)
+
+    def _merge_into(self, path, stats):
+        merged = load_stats(path)
+        for sql, entry in stats.items():
+            existing = merged.get(sql)
+            if existing is None:
+                merged[sql] = entry
+                continue
+            existing['count'] += entry['count']
+            existing['total_ms'] += entry['total_ms']
+            existing['max_ms'] = max(existing['max_ms'], entry['max_ms'])
+            existing['slow_count'] += entry['slow_count']
+            existing['tasks_full_scan'] = existing['tasks_full_scan'] or entry['tasks_full_scan']
+            existing['plan'] = entry['plan'] or existing['plan']
+
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(merged, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, path)
+
+@contextmanager
+def file_lock(path):
+    """跨进程的排他文件锁（fcntl/msvcrt都不可用时不加锁）"""
+    with open(path, 'a+') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def load_stats(path):
+    """读取统计文件，不存在时返回空字典"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+profiler = SQLProfiler()
+atexit.register(profiler.flush)
+register_cache('sql_profile_stats', lambda: profiler._stats)
+register_cache('sql_query_plans', lambda: profiler._plans)
+
+def format_report(stats, top=20, sort_key='total_ms'):
+    """生成按指定字段排序的前N条语句报告"""
+    rows = sorted(stats.items(), key=lambda item: item[1].get(sort_key, 0), reverse=True)[:top]
+    lines = [f"{'总耗时ms':>10} {'次数':>8} {'平均ms':>9} {'最大ms':>9} {'慢':>5}  语句"]
+    for sql, entry in rows:
+        average = entry['total_ms'] / entry['count'] if entry['count'] else 0
+        flag = ' [tasks全表扫描]' if entry.get('tasks_full_scan') else ''
+        lines.append(f"{entry['total_ms']:>10.2f} {entry['count']:>8} {average:>9.3f} "
+                     f"{entry['max_ms']:>9.3f} {entry['slow_count']:>5}  {sql[:160]}{flag}")
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite语句分析报告')
+    parser.add_argument('--dir', default=DEFAULT_PROFILE_DIR, help='分析数据目录')
+    parser.add_argument('--top', type=int, default=20, help='显示前N条语句')
+    parser.add_argument('--sort', default='total_ms', choices=['total_ms', 'count', 'max_ms', 'slow_count'],
+                        help='排序字段')
+    parser.add_argument('--scans-only', action='store_true', help='只显示对tasks全表扫描的语句')
+    parser.add_argument('--reset', action='store_true', help='清空已收集的统计')
+    args = parser.parse_args()
+
+    path = os.path.join(args.dir, STATS_FILE)
+    if args.reset:
+        if os.path.exists(path):
+            os.remove(path)
+        print("已清空SQL分析统计")
+        return
+
+    stats = load_stats(path)
+    if not stats:
+        print(f"没有找到分析数据: {path}")
+        return
+    if args.scans_only:
+        stats = {sql: entry for sql, entry in stats.items() if entry.get('tasks_full_scan')}
+
+    print(format_report(stats, args.top, args.sort))
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,11 @@ let showCompleted = true;
 let moreMenuOpen = false;
 let isAddingTask = false; // 防止重复添加任务的标志
 let aiAssistantOpen = false; // AI助手面板状态
+let aiUiConfig = null; // 启动时获取的AI界面配置
+let bootstrapHistory = null; // 启动时预取的对话历史，首次打开AI面板时使用
+let currentStats = null; // 当前显示的统计信息，变更推送按增量更新
+let changeFeed = null; // 变更推送连接（EventSource）
+let changeFeedConnected = false; // 推送已连接时修改操作不再重新拉取列表和统计
 
 // AI助手拖动相关变量
 let isDragging = false;
@@ -102,8 +107,45 @@ window.addEventListener('resize', function() {
     checkMobileView();
 });
     
+// 读取服务端渲染首页时嵌入的初始状态，没有时返回null
+function readInitialState() {
+    const element = document.getElementById('initialState');
+    if (!element) return null;
+    try {
+        return JSON.parse(element.textContent);
+    } catch (error) {
+        console.error('解析初始状态失败:', error);
+        return null;
+    }
+}
+
+// 获取启动数据（认证状态、列表、偏好、统计、默认列表任务），失败时返回null
+async function fetchBootstrap() {
+    try {
+        const response = await fetch('/api/bootstrap');
+        if (!response.ok) return null;
+        return await response.json();
+    } catch (error) {
+        console.error('获取启动数据失败:', error);
+        return null;
+    }
+}
+
 // 检查用户认证状态
 async function checkAuthStatus() {
+    const bootstrap = readInitialState() || await fetchBootstrap();
+    if (bootstrap) {
+        if (!bootstrap.authenticated) {
+            window.location.href = '/login';
+            return;
+        }
+        currentUser = bootstrap.user;
+        updateUserDisplay();
+        await initializeApp(bootstrap);
+        return;
+    }
+    
+    // 启动接口不可用时逐个请求
     try {
         const response = await fetch('/api/auth/check');
         const data = await response.json();
@@ -226,23 +268,39 @@ document.addEventListener('click', function(event) {
 });
     
 // 初始化应用
-async function initializeApp() {
+async function initializeApp(bootstrap = null) {
     try {
-        await loadTaskLists();
-        await loadUserPreferences();
-        await loadStats();
+        if (bootstrap) {
+            applyBootstrap(bootstrap);
+        } else {
+            await loadTaskLists();
+            await loadUserPreferences();
+            await loadStats();
+        }
         setupEventListeners();
         renderSidebar();
         
         // 初始化AI助手拖动功能
         initializeAIDrag();
         
+        // 订阅变更推送，其他标签页或设备的修改也会实时同步
+        connectChangeFeed();
+        connectServiceWorker();
+        
         // 检查PWA安装提示
         checkPWAInstallPrompt();
         
-        // 默认显示"我的一天"列表
+        // 默认显示启动数据中的默认列表，其次是"我的一天"列表
         const todayList = taskLists.find(list => list.name === '我的一天');
-        if (todayList) {
+        if (bootstrap && bootstrap.default_list_id) {
+            const page = bootstrap.tasks;
+            const settings = JSON.parse(localStorage.getItem('appSettings') || '{}');
+            if (bootstrap.rendered && !page.has_more && settings.taskSort !== 'suggested') {
+                hydrateTaskList(bootstrap.default_list_id, page.items);
+            } else {
+                navigateToList(bootstrap.default_list_id, page.has_more ? null : page.items);
+            }
+        } else if (todayList) {
             navigateToList(todayList.id);
         } else if (taskLists.length > 0) {
             navigateToList(taskLists[0].id);
@@ -253,6 +311,25 @@ async function initializeApp() {
     }
 }
 
+// 接管服务端已渲染的任务列表，只恢复状态不重新渲染（避免首屏闪烁和重复的进入动画）
+function hydrateTaskList(listId, items) {
+    currentListId = listId;
+    tasks = items;
+    updateSidebarActiveState(listId);
+}
+
+// 使用启动数据填充全局状态
+function applyBootstrap(bootstrap) {
+    taskLists = bootstrap.task_lists;
+    userPreferences = bootstrap.preferences;
+    showCompleted = userPreferences.show_completed;
+    applyTheme(userPreferences.theme);
+    updateShowCompletedIcon();
+    renderStats(bootstrap.stats);
+    aiUiConfig = bootstrap.ai.config;
+    bootstrapHistory = bootstrap.ai.history;
+}
+
 // 设置事件监听器
 function setupEventListeners() {
     // 搜索框
@@ -340,6 +417,7 @@ async function loadStats() {
 
 // 渲染统计信息
 function renderStats(stats) {
+    currentStats = stats;
     const statsInfo = document.getElementById('statsInfo');
     statsInfo.innerHTML = `
         <div class="space-y-1">
@@ -363,6 +441,204 @@ function renderStats(stats) {
     `;
 }
 
+// 连接变更推送（SSE），断线后浏览器按Last-Event-ID自动重连补发
+function connectChangeFeed() {
+    if (!window.EventSource || changeFeed) return;
+    
+    changeFeed = new EventSource('/api/changes/stream');
+    changeFeed.onopen = () => { changeFeedConnected = true; };
+    changeFeed.onerror = () => { changeFeedConnected = false; };
+    
+    // 服务端数据有变化，Service Worker中缓存的接口响应随之失效
+    const listen = (type, handler) => changeFeed.addEventListener(type, event => {
+        postToServiceWorker({ type: 'INVALIDATE_API' });
+        handler(event);
+    });
+    
+    listen('task.upserted', event => applyTaskUpsert(JSON.parse(event.data).task));
+    listen('task.deleted', event => applyTaskDelete(JSON.parse(event.data).id));
+    listen('lists.counts', event => applyListCounts(JSON.parse(event.data).lists));
+    listen('stats.delta', event => applyStatsDelta(JSON.parse(event.data).stats));
+    listen('list.created', event => {
+        const list = JSON.parse(event.data).list;
+        if (!taskLists.some(l => l.id === list.id)) {
+            taskLists.push(list);
+            renderSidebar();
+            updateSidebarActiveState(currentListId);
+        }
+    });
+    listen('list.updated', event => applyListUpdate(JSON.parse(event.data).list));
+    listen('list.deleted', event => applyListDelete(JSON.parse(event.data).id));
+    // 推送积压溢出或补发不完整，重新拉取全部数据
+    listen('resync', () => refreshAllData());
+}
+
+// 配合Service Worker的离线发件箱：联网时提交排队的修改，同步完成后刷新
+function connectServiceWorker() {
+    if (!('serviceWorker' in navigator)) return;
+    
+    navigator.serviceWorker.addEventListener('message', event => {
+        const message = event.data || {};
+        if (message.type === 'OUTBOX_QUEUED') {
+            // 稍后显示，避免被操作本身的成功提示覆盖
+            setTimeout(() => showNotification('网络不可用，修改已保存，联网后自动同步', 'info'), 500);
+        } else if (message.type === 'OUTBOX_FLUSHED') {
+            refreshAllData();
+            if (message.rejected > 0) {
+                showNotification(`已同步 ${message.synced - message.rejected} 项离线修改，${message.rejected} 项未能保存`, 'error');
+            } else {
+                showNotification(`已同步 ${message.synced} 项离线修改`);
+            }
+        }
+    });
+    window.addEventListener('online', () => postToServiceWorker({ type: 'FLUSH_OUTBOX' }));
+    // 告知Service Worker当前登录用户，换号后清除上一用户的缓存和离线修改
+    navigator.serviceWorker.ready.then(registration => {
+        if (registration.active && currentUser) {
+            registration.active.postMessage({ type: 'SET_USER', payload: { userId: currentUser.id } });
+        }
+    });
+}
+
+// 创建类请求的幂等键：请求超时或断网后由Service Worker重放时，服务端据此避免重复创建
+function newIdempotencyKey() {
+    return window.crypto && window.crypto.randomUUID
+        ? window.crypto.randomUUID()
+        : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
+function postToServiceWorker(message) {
+    if (navigator.serviceWorker && navigator.serviceWorker.controller) {
+        navigator.serviceWorker.controller.postMessage(message);
+    }
+}
+
+// 修改任务后刷新界面；变更推送已连接时由推送事件更新
+async function refreshAfterTaskChange() {
+    if (changeFeedConnected) return;
+    await loadTasks(currentListId);
+    await loadStats();
+    updateTaskListStats();
+}
+
+async function refreshAllData() {
+    try {
+        await loadTaskLists();
+        renderSidebar();
+        updateSidebarActiveState(currentListId);
+        await loadStats();
+        if (currentListId) {
+            await loadTasks(currentListId);
+        }
+    } catch (error) {
+        console.error('重新同步失败:', error);
+    }
+}
+
+// 与服务端列表排序一致：重要优先，截止日期升序（无日期在前），创建时间降序
+function compareTasks(a, b) {
+    if (a.is_important !== b.is_important) return a.is_important ? -1 : 1;
+    const dueA = a.due_date || '';
+    const dueB = b.due_date || '';
+    if (dueA !== dueB) return dueA < dueB ? -1 : 1;
+    return (b.created_at || '').localeCompare(a.created_at || '');
+}
+
+async function renderChangedTasks() {
+    const settings = JSON.parse(localStorage.getItem('appSettings') || '{}');
+    if (settings.taskSort === 'suggested') {
+        await sortTasksBySuggestedPriority();
+    } else {
+        tasks.sort(compareTasks);
+    }
+    renderTasks();
+}
+
+function applyTaskUpsert(task) {
+    const index = tasks.findIndex(t => t.id === task.id);
+    const visible = task.list_id === currentListId && (showCompleted || !task.completed);
+    if (index >= 0 && visible) {
+        tasks[index] = task;
+    } else if (index >= 0) {
+        tasks.splice(index, 1);
+    } else if (visible) {
+        tasks.push(task);
+    } else {
+        return;
+    }
+    renderChangedTasks();
+}
+
+function applyTaskDelete(taskId) {
+    const index = tasks.findIndex(t => t.id === taskId);
+    if (index < 0) return;
+    tasks.splice(index, 1);
+    renderTasks();
+}
+
+async function applyListCounts(deltas) {
+    let unknownList = false;
+    Object.entries(deltas).forEach(([listId, delta]) => {
+        const list = taskLists.find(l => l.id === Number(listId));
+        if (!list) {
+            unknownList = true;
+            return;
+        }
+        list.total_tasks = (list.total_tasks || 0) + (delta.total_tasks || 0);
+        list.completed_tasks = (list.completed_tasks || 0) + (delta.completed_tasks || 0);
+    });
+    if (unknownList) {
+        await loadTaskLists();
+    }
+    renderSidebar();
+    updateSidebarActiveState(currentListId);
+}
+
+function applyListUpdate(list) {
+    const index = taskLists.findIndex(l => l.id === list.id);
+    if (index >= 0) {
+        taskLists[index] = list;
+    } else {
+        taskLists.push(list);
+    }
+    renderSidebar();
+    updateSidebarActiveState(currentListId);
+    if (list.id === currentListId && !document.getElementById('tasksList').classList.contains('hidden')) {
+        updatePageHeader(list.name, getListDescription(list.name));
+    }
+}
+
+function applyListDelete(listId) {
+    const index = taskLists.findIndex(l => l.id === listId);
+    if (index < 0) return;
+    taskLists.splice(index, 1);
+    renderSidebar();
+    if (listId === currentListId) {
+        // 当前查看的列表在其他设备上被删除，切换到第一个列表
+        currentListId = null;
+        tasks = [];
+        renderTasks();
+        if (taskLists.length > 0) {
+            navigateToList(taskLists[0].id);
+        }
+    } else {
+        updateSidebarActiveState(currentListId);
+    }
+}
+
+function applyStatsDelta(delta) {
+    if (!currentStats) return;
+    const stats = { ...currentStats };
+    Object.entries(delta).forEach(([key, value]) => {
+        stats[key] = (stats[key] || 0) + value;
+    });
+    stats.pending_tasks = stats.total_tasks - stats.completed_tasks;
+    stats.completion_rate = stats.total_tasks > 0
+        ? Math.round(stats.completed_tasks / stats.total_tasks * 1000) / 10
+        : 0;
+    renderStats(stats);
+}
+
 // 渲染侧边栏导航
 function renderSidebar() {
     const sidebarNav = document.getElementById('sidebarNav');
@@ -424,14 +700,14 @@ function updateTaskListStats() {
 }
 
 // 导航到指定列表
-async function navigateToList(listId) {
+async function navigateToList(listId, preloadedTasks = null) {
     if (currentListId === listId) return;
 
     currentListId = listId;
     updateSidebarActiveState(listId);
     
     try {
-        await loadTasks(listId);
+        await loadTasks(listId, preloadedTasks);
         showPage('tasksList');
         
         const list = taskLists.find(l => l.id === listId);
@@ -470,12 +746,34 @@ function updateSidebarActiveState(listId) {
     }
 }
 
+// 列表接口的列式格式（{columns, rows}）还原为对象数组
+function decodeColumnar(data) {
+    if (!data || !Array.isArray(data.columns)) return data;
+    const { columns, rows } = data;
+    return rows.map(row => {
+        const item = {};
+        for (let i = 0; i < columns.length; i++) {
+            item[columns[i]] = row[i];
+        }
+        return item;
+    });
+}
+
 // 加载任务列表
-async function loadTasks(listId = null) {
+async function loadTasks(listId = null, preloadedTasks = null) {
     try {
-        const url = listId ? `/api/tasks?list_id=${listId}&show_completed=${showCompleted}` : `/api/tasks?show_completed=${showCompleted}`;
-        const response = await fetch(url);
-        tasks = await response.json();
+        if (preloadedTasks) {
+            tasks = preloadedTasks;
+        } else {
+            const url = listId ? `/api/tasks?list_id=${listId}&show_completed=${showCompleted}&format=columnar` : `/api/tasks?show_completed=${showCompleted}&format=columnar`;
+            const response = await fetch(url);
+            tasks = decodeColumnar(await response.json());
+        }
+        
+        const settings = JSON.parse(localStorage.getItem('appSettings') || '{}');
+        if (settings.taskSort === 'suggested') {
+            await sortTasksBySuggestedPriority();
+        }
         renderTasks();
     } catch (error) {
         console.error('加载任务失败:', error);
@@ -483,6 +781,20 @@ async function loadTasks(listId = null) {
     }
 }
 
+// 按服务端建议优先级排序（未完成任务在前，已完成任务保持原顺序）
+async function sortTasksBySuggestedPriority() {
+    try {
+        const response = await fetch('/api/suggestions/priority');
+        if (!response.ok) return;
+        const data = await response.json();
+        
+        const ranks = new Map(data.suggestions.map(item => [item.id, item.rank]));
+        tasks.sort((a, b) => (ranks.get(a.id) ?? Infinity) - (ranks.get(b.id) ?? Infinity));
+    } catch (error) {
+        console.error('获取建议优先级失败:', error);
+    }
+}
+
 // 渲染任务列表
 function renderTasks() {
     const tasksList = document.getElementById('tasksList');
@@ -617,9 +929,7 @@ async function toggleTaskComplete(taskId) {
         });
 
         if (response.ok) {
-            await loadTasks(currentListId);
-            await loadStats();
-            updateTaskListStats(); // 更新侧边栏统计（不重新加载整个列表）
+            await refreshAfterTaskChange();
             showNotification(task.completed ? '任务已标记为未完成' : '任务已完成');
         } else {
             throw new Error('更新失败');
@@ -645,7 +955,7 @@ async function toggleTaskImportant(taskId) {
         });
 
         if (response.ok) {
-            await loadTasks(currentListId);
+            await refreshAfterTaskChange();
             showNotification(task.is_important ? '已取消重要标记' : '已标记为重要');
         } else {
             throw new Error('更新失败');
@@ -692,6 +1002,7 @@ async function addQuickTask(event) {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
+                'Idempotency-Key': newIdempotencyKey()
             },
             body: JSON.stringify({
                 title: title,
@@ -701,9 +1012,7 @@ async function addQuickTask(event) {
 
         if (response.ok) {
             input.value = '';
-            await loadTasks(currentListId);
-            await loadStats();
-            updateTaskListStats(); // 更新侧边栏统计
+            await refreshAfterTaskChange();
             showNotification('任务已添加');
         } else {
             throw new Error('创建失败');
@@ -817,19 +1126,20 @@ async function saveTask(event) {
         const url = currentEditingTaskId ? `/api/tasks/${currentEditingTaskId}` : '/api/tasks';
         const method = currentEditingTaskId ? 'PUT' : 'POST';
         
+        const headers = { 'Content-Type': 'application/json' };
+        if (!currentEditingTaskId) {
+            headers['Idempotency-Key'] = newIdempotencyKey();
+        }
+        
         const response = await fetch(url, {
             method: method,
-            headers: {
-                'Content-Type': 'application/json',
-            },
+            headers: headers,
             body: JSON.stringify(formData)
         });
 
         if (response.ok) {
             hideTaskModal();
-            await loadTasks(currentListId);
-            await loadStats();
-            updateTaskListStats(); // 更新侧边栏统计
+            await refreshAfterTaskChange();
             showNotification(currentEditingTaskId ? '任务已更新' : '任务已创建');
         } else {
             throw new Error('保存失败');
@@ -852,9 +1162,7 @@ async function deleteTask(taskId) {
         });
 
         if (response.ok) {
-            await loadTasks(currentListId);
-            await loadStats();
-            updateTaskListStats(); // 更新侧边栏统计
+            await refreshAfterTaskChange();
             showNotification('任务已删除');
         } else {
             throw new Error('删除失败');
@@ -881,8 +1189,8 @@ async function handleSearch() {
     }
 
     try {
-        const response = await fetch(`/api/search?q=${encodeURIComponent(query)}`);
-        const results = await response.json();
+        const response = await fetch(`/api/search?q=${encodeURIComponent(query)}&format=columnar`);
+        const results = decodeColumnar(await response.json());
         renderSearchResults(results, query);
         showPage('searchResults');
         updatePageHeader('搜索结果', `搜索 "${query}" 的结果`);
@@ -1128,6 +1436,7 @@ async function saveNewList(event) {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
+                'Idempotency-Key': newIdempotencyKey()
             },
             body: JSON.stringify({
                 name: listName,
@@ -1430,8 +1739,14 @@ function stopVoiceInput() {
 // 加载对话历史
 async function loadConversationHistory() {
     try {
-        const response = await fetch('/api/ai/history');
-        const data = await response.json();
+        let data;
+        if (bootstrapHistory) {
+            data = { history: bootstrapHistory };
+            bootstrapHistory = null;
+        } else {
+            const response = await fetch('/api/ai/history');
+            data = await response.json();
+        }
         
         const messagesContainer = document.getElementById('aiChatMessages');
         messagesContainer.innerHTML = '';
@@ -1521,16 +1836,15 @@ async function sendAIMessage() {
     showAITyping();
     
     try {
-        // 调用后端AI接口
-        const response = await fetch('/api/ai/chat', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                message: message
-            })
-        });
+        // 调用后端AI接口；同一条消息的重试使用相同的幂等键，其中的创建操作不会重复执行
+        const response = await fetchAIChat(message, newIdempotencyKey());
+        
+        // 流式回复：操作结果逐条到达，立即刷新界面
+        const contentType = response.headers.get('Content-Type') || '';
+        if (contentType.includes('text/event-stream')) {
+            await readAIStream(response);
+            return;
+        }
         
         const data = await response.json();
         
@@ -1569,6 +1883,89 @@ async function sendAIMessage() {
     }
 }
 
+// 发送聊天请求，网络中断或服务端异常时重试；请求可能已到达服务端，重试携带相同的幂等键
+async function fetchAIChat(message, idempotencyKey, retries = 1) {
+    try {
+        const response = await fetch('/api/ai/chat', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Idempotency-Key': idempotencyKey
+            },
+            body: JSON.stringify({
+                message: message
+            })
+        });
+        if (response.status < 500 || retries <= 0) {
+            return response;
+        }
+    } catch (error) {
+        if (retries <= 0) throw error;
+    }
+    await new Promise(resolve => setTimeout(resolve, 1000));
+    return fetchAIChat(message, idempotencyKey, retries - 1);
+}
+
+// 读取流式AI回复（SSE）：文本增量逐段显示，每个操作结果到达时单独处理
+async function readAIStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let finished = false;
+    let streamMessage = null;
+    let streamText = '';
+    
+    while (!finished) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        
+        for (const rawEvent of events) {
+            let eventName = 'message';
+            let eventData = '';
+            for (const line of rawEvent.split('\n')) {
+                if (line.startsWith('event:')) {
+                    eventName = line.slice(6).trim();
+                } else if (line.startsWith('data:')) {
+                    eventData += line.slice(5).trim();
+                }
+            }
+            if (!eventData) continue;
+            
+            const payload = JSON.parse(eventData);
+            if (eventName === 'delta') {
+                streamText += payload.content || '';
+                if (!streamMessage) {
+                    hideAITyping();
+                    streamMessage = addAIMessage(streamText, 'assistant');
+                } else {
+                    updateAIMessage(streamMessage, streamText);
+                }
+            } else if (eventName === 'action') {
+                await handleAIActions([payload]);
+            } else if (eventName === 'done') {
+                hideAITyping();
+                // 完成后用整理过的回复（含操作结果）替换逐段显示的原始文本
+                if (streamMessage) {
+                    updateAIMessage(streamMessage, payload.response);
+                } else {
+                    addAIMessage(payload.response, 'assistant');
+                }
+                console.log('AI回复来源:', payload.source);
+                finished = true;
+            }
+        }
+    }
+    
+    if (!finished) {
+        hideAITyping();
+        addAIMessage('抱歉，我无法处理你的请求。请稍后再试。', 'assistant');
+    }
+}
+
 // 处理AI执行的操作
 async function handleAIActions(actions) {
     console.log('处理AI操作:', actions);
@@ -1604,7 +2001,10 @@ async function handleAIActions(actions) {
         }
     }
     
-    // 执行刷新操作
+    // 执行刷新操作（变更推送已连接时由推送事件更新界面）
+    if (changeFeedConnected) {
+        needsListsRefresh = needsRefresh = needsStatsRefresh = false;
+    }
     if (needsListsRefresh) {
         await loadTaskLists();
         renderSidebar();
@@ -1680,7 +2080,36 @@ function addAIMessage(message, sender) {
     
     const content = document.createElement('div');
     content.className = 'ai-message-content';
+    renderAIMessageContent(content, message);
+    
+    messageDiv.appendChild(avatar);
+    messageDiv.appendChild(content);
+    messagesContainer.appendChild(messageDiv);
+    
+    // 滚动到底部
+    messagesContainer.scrollTop = messagesContainer.scrollHeight;
     
+    // 移除动画类
+    setTimeout(() => {
+        messageDiv.classList.remove('ai-message-enter');
+    }, 300);
+    return messageDiv;
+}
+
+// 更新已显示的消息内容（流式回复逐段追加文本）
+function updateAIMessage(messageDiv, message) {
+    const messagesContainer = document.getElementById('aiChatMessages');
+    const content = messageDiv.querySelector('.ai-message-content');
+    // 用户没有向上翻看历史时保持在底部
+    const atBottom = messagesContainer.scrollHeight - messagesContainer.scrollTop - messagesContainer.clientHeight < 40;
+    content.innerHTML = '';
+    renderAIMessageContent(content, message);
+    if (atBottom) {
+        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    }
+}
+
+function renderAIMessageContent(content, message) {
     // 处理多行消息
     const lines = message.split('\n');
     if (lines.length > 1) {
@@ -1704,18 +2133,6 @@ function addAIMessage(message, sender) {
         p.textContent = message;
         content.appendChild(p);
     }
-    
-    messageDiv.appendChild(avatar);
-    messageDiv.appendChild(content);
-    messagesContainer.appendChild(messageDiv);
-    
-    // 滚动到底部
-    messagesContainer.scrollTop = messagesContainer.scrollHeight;
-    
-    // 移除动画类
-    setTimeout(() => {
-        messageDiv.classList.remove('ai-message-enter');
-    }, 300);
 }
 
 function showAITyping() {
@@ -2965,10 +3382,15 @@ function formatDateToISO(date) {
 async function loadCalendarWeek() {
     try {
         const weekStartStr = formatDateToISO(currentWeekStart);
-        const response = await fetch(`/api/calendar/week?week_start=${weekStartStr}`);
+        const weekEnd = new Date(currentWeekStart);
+        weekEnd.setDate(weekEnd.getDate() + 6);
+        const weekEndStr = formatDateToISO(weekEnd);
+        
+        // 范围接口在服务端预取相邻周，前后翻页通常直接命中缓存
+        const response = await fetch(`/api/calendar/range?start=${weekStartStr}&end=${weekEndStr}&granularity=day`);
         const data = await response.json();
         
-        weekTasks = data.days || [];
+        weekTasks = expandCalendarRange(data, currentWeekStart, 7);
         updateWeekTitle();
         
     } catch (error) {
@@ -2977,6 +3399,39 @@ async function loadCalendarWeek() {
     }
 }
 
+// 将紧凑的日历范围数据展开为按天排列的任务对象
+function expandCalendarRange(data, startDate, dayCount) {
+    const lists = data.lists || {};
+    const buckets = new Map((data.buckets || []).map(bucket => [bucket.key, bucket.tasks]));
+    const days = [];
+    
+    for (let i = 0; i < dayCount; i++) {
+        const current = new Date(startDate);
+        current.setDate(current.getDate() + i);
+        const dateStr = formatDateToISO(current);
+        
+        const rows = buckets.get(dateStr) || [];
+        days.push({
+            date: dateStr,
+            tasks: rows.map(row => {
+                const task = {};
+                data.columns.forEach((column, index) => { task[column] = row[index]; });
+                task.completed = Boolean(task.completed);
+                task.is_important = Boolean(task.is_important);
+                if (task.recurrence_rule) {
+                    task.occurrence_date = task.due_date;
+                }
+                const list = lists[task.list_id] || [];
+                task.list_name = list[0] || null;
+                task.list_icon = list[1] || null;
+                task.list_color = list[2] || null;
+                return task;
+            })
+        });
+    }
+    return days;
+}
+
 // 更新周标题
 function updateWeekTitle() {
     const weekEnd = new Date(currentWeekStart);
@@ -3159,6 +3614,10 @@ function createCalendarTaskBlock(task) {
     const taskBlock = document.createElement('div');
     taskBlock.className = `calendar-task-block priority-${task.priority} ${task.completed ? 'completed' : ''}`;
     taskBlock.dataset.taskId = task.id;
+    if (task.occurrence_date) {
+        // 重复任务的单次实例：拖动只移动这一次
+        taskBlock.dataset.occurrenceDate = task.occurrence_date;
+    }
     taskBlock.draggable = true;
     
     // 计算位置和高度
@@ -3294,7 +3753,7 @@ function handleCalendarDrop(e) {
         const newHour = parseInt(timeSlot.dataset.hour);
         
         // 更新任务时间
-        updateTaskTime(taskId, newDate, newHour);
+        updateTaskTime(taskId, newDate, newHour, false, draggedTask.dataset.occurrenceDate || null);
     }
     
     hideDropZone(timeSlot);
@@ -3325,15 +3784,18 @@ function hideDropZone() {
     }
 }
 
-// 更新任务时间
-async function updateTaskTime(taskId, newDate, newHour) {
+// 更新任务时间；occurrenceDate为重复任务的实例日期时只移动该次实例，不影响整个系列
+async function updateTaskTime(taskId, newDate, newHour, allowConflict = false, occurrenceDate = null) {
     try {
         const startTime = `${newHour.toString().padStart(2, '0')}:00`;
         const endTime = `${(newHour + 1).toString().padStart(2, '0')}:00`;
         
         console.log(`更新任务时间: 任务ID=${taskId}, 日期=${newDate}, 开始时间=${startTime}, 结束时间=${endTime}, 小时=${newHour}`);
         
-        const response = await fetch(`/api/tasks/${taskId}/time`, {
+        const url = occurrenceDate
+            ? `/api/tasks/${taskId}/occurrences/${occurrenceDate}`
+            : `/api/tasks/${taskId}/time`;
+        const response = await fetch(url, {
             method: 'PUT',
             headers: {
                 'Content-Type': 'application/json',
@@ -3341,10 +3803,21 @@ async function updateTaskTime(taskId, newDate, newHour) {
             body: JSON.stringify({
                 due_date: newDate,
                 start_time: startTime,
-                end_time: endTime
+                end_time: endTime,
+                allow_conflict: allowConflict
             })
         });
         
+        if (response.status === 409) {
+            // 与已有日程冲突，由用户确认是否仍然安排
+            const data = await response.json();
+            const titles = data.conflicts.map(c => `${c.title} (${c.start_time}-${c.end_time})`).join('\n');
+            if (confirm(`该时间段与以下任务冲突：\n${titles}\n\n仍然安排吗？`)) {
+                await updateTaskTime(taskId, newDate, newHour, true, occurrenceDate);
+            }
+            return;
+        }
+        
         if (response.ok) {
             showNotification(`任务时间已更新到 ${startTime}`);
             await loadCalendarWeek();
@@ -1,6 +1,6 @@
-const CACHE_NAME = 'microsoft-todo-v1.0.0';
-const STATIC_CACHE = 'static-cache-v1.0.0';
-const DYNAMIC_CACHE = 'dynamic-cache-v1.0.0';
+const CACHE_NAME = 'microsoft-todo-v1.1.0';
+const STATIC_CACHE = 'static-cache-v1.1.0';
+const DYNAMIC_CACHE = 'dynamic-cache-v1.1.0';
 
 // 需要缓存的静态资源
 const STATIC_ASSETS = [
@@ -21,6 +21,33 @@ const CACHEABLE_PATTERNS = [
   /^\/api\/calendar\/week/
 ];
 
+// 同一接口地址在后台重新验证的最小间隔
+const API_REVALIDATE_INTERVAL = 30 * 1000;
+
+// 带内容哈希的构建资源，内容不会变化，可以一直使用缓存
+const IMMUTABLE_PATTERN = /^\/static\/dist\/.+\.[0-9a-f]{10}\.\w+$/;
+
+// 离线时写入发件箱、联网后重放的写接口
+const QUEUEABLE_PATTERNS = [
+  /^\/api\/tasks/,
+  /^\/api\/task_lists/,
+  /^\/api\/user_preferences$/
+];
+
+// 离线发件箱（IndexedDB）
+const OUTBOX_DB = 'todo-outbox';
+const OUTBOX_STORE = 'requests';
+// 记录发件箱所属的登录用户，Service Worker重启后仍可确定
+const OUTBOX_META_STORE = 'meta';
+const OUTBOX_SYNC_TAG = 'outbox-sync';
+// 每次批量提交的请求数，与服务端BATCH_MAX_REQUESTS一致
+const OUTBOX_BATCH_SIZE = 20;
+
+// 各接口地址上次后台更新的时间
+const lastRevalidated = new Map();
+// 写入后递增，之前发出的读请求返回后不再写入缓存
+let cacheGeneration = 0;
+
 // 安装Service Worker
 self.addEventListener('install', event => {
   console.log('Service Worker installing...');
@@ -64,6 +91,7 @@ self.addEventListener('activate', event => {
         console.log('Service Worker activated');
         return self.clients.claim();
       })
+      .then(() => flushOutbox())
   );
 });
 
@@ -78,59 +106,177 @@ self.addEventListener('fetch', event => {
   }
   
   // 处理API请求
-  if (url.pathname.startsWith('/api/')) {
-    return handleAPIRequest(event);
+  if (url.origin === self.location.origin && url.pathname.startsWith('/api/')) {
+    if (request.method === 'GET') {
+      return handleAPIRequest(event);
+    }
+    return handleAPIMutation(event);
+  }
+  
+  if (request.method !== 'GET') {
+    return;
+  }
+  
+  // 页面导航优先走网络，离线时返回缓存的页面
+  if (request.mode === 'navigate') {
+    return handleNavigationRequest(event);
   }
   
   // 处理静态资源请求
   return handleStaticRequest(event);
 });
 
-// 处理API请求
+// 处理API读请求
 function handleAPIRequest(event) {
   const { request } = event;
   const url = new URL(request.url);
   
-  // 只缓存GET请求的特定API
-  if (request.method === 'GET' && 
-      CACHEABLE_PATTERNS.some(pattern => pattern.test(url.pathname))) {
-    
-    event.respondWith(
-      caches.open(DYNAMIC_CACHE)
-        .then(cache => {
-          return cache.match(request)
-            .then(response => {
-              if (response) {
-                // 返回缓存的响应，同时在后台更新
-                fetchAndCacheAPI(request, cache);
-                return response;
+  // 只缓存特定的接口，其余（包括变更推送长连接）交给浏览器直接处理
+  if (!CACHEABLE_PATTERNS.some(pattern => pattern.test(url.pathname))) {
+    return;
+  }
+  
+  event.respondWith(
+    caches.open(DYNAMIC_CACHE)
+      .then(cache => {
+        return cache.match(request)
+          .then(response => {
+            if (response) {
+              // 返回缓存的响应，同一接口在间隔内最多在后台更新一次
+              if (shouldRevalidate(request.url)) {
+                event.waitUntil(
+                  fetchAndCacheAPI(request, cache)
+                    .catch(error => {
+                      console.log('Background API update failed:', error);
+                    })
+                );
               }
-              
-              // 网络请求
-              return fetch(request)
-                .then(response => {
-                  if (response.ok) {
-                    // 缓存成功的响应
-                    cache.put(request, response.clone());
-                  }
-                  return response;
-                })
-                .catch(() => {
-                  // 网络失败，尝试返回缓存的响应
-                  return cache.match(request);
-                });
+              return response;
+            }
+            
+            // 网络请求，失败时返回离线错误
+            return fetchAndCacheAPI(request, cache)
+              .catch(() => offlineResponse());
+          });
+      })
+  );
+}
+
+// 处理API写请求：发件箱中有未提交的请求时先提交以保证顺序，离线时写入发件箱
+function handleAPIMutation(event) {
+  const { request } = event;
+  const url = new URL(request.url);
+  const queueable = QUEUEABLE_PATTERNS.some(pattern => pattern.test(url.pathname));
+  // 请求体只能读取一次，先复制一份用于离线排队
+  const body = queueable ? request.clone().text() : null;
+  
+  event.respondWith(
+    flushOutbox()
+      .then(remaining => {
+        if (remaining > 0 && queueable) {
+          return queueRequest(event, request, url, body);
+        }
+        return fetch(request)
+          .then(response => {
+            if (response.ok) {
+              event.waitUntil(invalidateAPICache());
+              if (url.pathname === '/api/auth/login' || url.pathname === '/api/auth/logout') {
+                event.waitUntil(handleAuthResponse(url.pathname, response.clone()));
+              }
+            }
+            return response;
+          })
+          .catch(() => queueable ? queueRequest(event, request, url, body) : offlineResponse());
+      })
+  );
+}
+
+// 写入发件箱，返回202响应并通知页面
+// 请求自带幂等键时沿用，请求可能已到达服务端，重放时不会重复执行
+// 不知道当前登录用户时不排队，避免之后以其他用户的身份重放
+function queueRequest(event, request, url, body) {
+  const key = request.headers.get('Idempotency-Key');
+  return Promise.all([body, getOutboxUser()])
+    .then(([text, user]) => {
+      if (user === null) {
+        throw new Error('unknown user');
+      }
+      return enqueue(request.method, url.pathname + url.search, text ? JSON.parse(text) : null, key, user);
+    })
+    .then(entry => {
+      if (self.registration.sync) {
+        self.registration.sync.register(OUTBOX_SYNC_TAG).catch(() => {});
+      }
+      notifyClients({ type: 'OUTBOX_QUEUED', path: entry.path });
+      return new Response(JSON.stringify({
+        queued: true,
+        idempotency_key: entry.key,
+        message: '网络不可用，修改已保存，联网后自动同步'
+      }), { status: 202, headers: { 'Content-Type': 'application/json' } });
+    })
+    .catch(error => {
+      console.error('Failed to queue offline request:', error);
+      return offlineResponse();
+    });
+}
+
+function offlineResponse() {
+  return new Response(JSON.stringify({ error: '网络不可用，请稍后重试' }), {
+    status: 503,
+    headers: { 'Content-Type': 'application/json' }
+  });
+}
+
+// 处理页面导航请求
+function handleNavigationRequest(event) {
+  const { request } = event;
+  
+  event.respondWith(
+    fetch(request)
+      .then(response => {
+        // 保存最新的首页，离线时使用；未登录时被重定向到的登录页不保存
+        if (response.ok && !response.redirected && new URL(request.url).pathname === '/') {
+          const responseToCache = response.clone();
+          caches.open(STATIC_CACHE)
+            .then(cache => {
+              cache.put('/', responseToCache);
             });
-        })
-    );
-  } else {
-    // 对于其他API请求，直接走网络
-    event.respondWith(fetch(request));
-  }
+        }
+        if (new URL(request.url).pathname === '/logout') {
+          event.waitUntil(switchUser(null));
+        }
+        return response;
+      })
+      .catch(() => {
+        return caches.match(request)
+          .then(response => response || caches.match('/'));
+      })
+  );
 }
 
 // 处理静态资源请求
 function handleStaticRequest(event) {
   const { request } = event;
+  const url = new URL(request.url);
+  
+  // 未带哈希的本站资源可能随部署变化，优先走网络
+  if (url.origin === self.location.origin && !IMMUTABLE_PATTERN.test(url.pathname)) {
+    event.respondWith(
+      fetch(request)
+        .then(response => {
+          if (response.ok) {
+            const responseToCache = response.clone();
+            caches.open(STATIC_CACHE)
+              .then(cache => {
+                cache.put(request, responseToCache);
+              });
+          }
+          return response;
+        })
+        .catch(() => caches.match(request))
+    );
+    return;
+  }
   
   event.respondWith(
     caches.match(request)
@@ -155,28 +301,277 @@ function handleStaticRequest(event) {
               });
             
             return response;
-          })
-          .catch(() => {
-            // 对于HTML请求，返回离线页面
-            if (request.destination === 'document') {
-              return caches.match('/');
-            }
           });
       })
   );
 }
 
-// 后台更新API缓存
+// 同一接口地址距上次后台更新超过间隔时才重新验证
+function shouldRevalidate(url) {
+  return Date.now() - (lastRevalidated.get(url) || 0) >= API_REVALIDATE_INTERVAL;
+}
+
+// 请求接口并更新缓存
 function fetchAndCacheAPI(request, cache) {
-  fetch(request)
+  const generation = cacheGeneration;
+  lastRevalidated.set(request.url, Date.now());
+  return fetch(request)
     .then(response => {
-      if (response.ok) {
+      // 请求期间发生过写入时响应可能已过期，不写入缓存；登录失效时被重定向到登录页，也不写入
+      if (response.ok && !response.redirected && generation === cacheGeneration) {
         cache.put(request, response.clone());
       }
-    })
+      return response;
+    });
+}
+
+// 数据发生变化后丢弃缓存的接口响应
+function invalidateAPICache() {
+  cacheGeneration++;
+  lastRevalidated.clear();
+  return caches.delete(DYNAMIC_CACHE);
+}
+
+// 清除与登录用户相关的缓存：接口响应和服务端渲染的首页
+function clearUserCaches() {
+  return Promise.all([
+    invalidateAPICache(),
+    caches.open(STATIC_CACHE).then(cache => cache.delete('/'))
+  ]);
+}
+
+// 登录用户变化（登录、登出、换号）时清除缓存，并丢弃不属于新用户的离线修改
+function switchUser(userId) {
+  return getOutboxUser()
+    .then(previous => previous === userId ? null : Promise.all([setOutboxUser(userId), clearUserCaches()]))
+    .then(() => readOutbox())
+    .then(entries => deleteOutboxEntries(entries
+      .filter(entry => entry.user !== userId && !inFlight.has(entry.id))
+      .map(entry => entry.id)));
+}
+
+// 登录成功后切换到返回的用户，登出后清空
+function handleAuthResponse(path, response) {
+  if (path === '/api/auth/logout') {
+    return switchUser(null);
+  }
+  return response.json()
+    .then(data => data.user ? switchUser(data.user.id).then(() => flushOutbox()) : null)
     .catch(error => {
-      console.log('Background API update failed:', error);
+      console.log('Failed to switch outbox user:', error);
+    });
+}
+
+// 通知所有页面
+function notifyClients(message) {
+  return self.clients.matchAll({ type: 'window' })
+    .then(clients => {
+      clients.forEach(client => client.postMessage(message));
+    });
+}
+
+// ---------- 离线发件箱 ----------
+
+let outboxDB = null;
+// 正在提交的请求ID，合并编辑时跳过
+const inFlight = new Set();
+let flushing = null;
+
+function openOutbox() {
+  if (!outboxDB) {
+    outboxDB = new Promise((resolve, reject) => {
+      const open = indexedDB.open(OUTBOX_DB, 2);
+      open.onupgradeneeded = () => {
+        const db = open.result;
+        if (!db.objectStoreNames.contains(OUTBOX_STORE)) {
+          db.createObjectStore(OUTBOX_STORE, { keyPath: 'id', autoIncrement: true });
+        }
+        if (!db.objectStoreNames.contains(OUTBOX_META_STORE)) {
+          db.createObjectStore(OUTBOX_META_STORE, { keyPath: 'key' });
+        }
+      };
+      open.onsuccess = () => resolve(open.result);
+      open.onerror = () => {
+        outboxDB = null;
+        reject(open.error);
+      };
     });
+  }
+  return outboxDB;
+}
+
+// 在一个事务内执行操作，事务完成后返回操作的结果
+function outboxTransaction(mode, operation, storeName = OUTBOX_STORE) {
+  return openOutbox().then(db => new Promise((resolve, reject) => {
+    const transaction = db.transaction(storeName, mode);
+    let result;
+    Promise.resolve(operation(transaction.objectStore(storeName)))
+      .then(value => { result = value; }, reject);
+    transaction.oncomplete = () => resolve(result);
+    transaction.onerror = () => reject(transaction.error);
+    transaction.onabort = () => reject(transaction.error);
+  }));
+}
+
+function requestResult(request) {
+  return new Promise((resolve, reject) => {
+    request.onsuccess = () => resolve(request.result);
+    request.onerror = () => reject(request.error);
+  });
+}
+
+function readOutbox() {
+  return outboxTransaction('readonly', store => requestResult(store.getAll()));
+}
+
+// 发件箱所属的用户ID，未登录或未知时为null
+function getOutboxUser() {
+  return outboxTransaction('readonly', store => requestResult(store.get('user')), OUTBOX_META_STORE)
+    .then(record => record ? record.id : null);
+}
+
+function setOutboxUser(userId) {
+  return outboxTransaction('readwrite', store => {
+    store.put({ key: 'user', id: userId });
+  }, OUTBOX_META_STORE);
+}
+
+function newIdempotencyKey() {
+  return self.crypto && self.crypto.randomUUID
+    ? self.crypto.randomUUID()
+    : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
+// 写入发件箱并标记所属用户，合并对同一任务的连续修改：PUT与之前未提交的PUT合并，DELETE取代之前的PUT
+function enqueue(method, path, body, key, user) {
+  return outboxTransaction('readwrite', store => {
+    const entry = { method, path, body, key: key || newIdempotencyKey(), user, created_at: Date.now() };
+    const coalesce = /^\/api\/tasks\/\d+$/.test(path) && (method === 'PUT' || method === 'DELETE');
+    if (!coalesce) {
+      return requestResult(store.add(entry)).then(id => Object.assign(entry, { id }));
+    }
+    
+    // IndexedDB事务在回调之间不能等待其他Promise，这里全部使用请求回调
+    return new Promise((resolve, reject) => {
+      const getAll = store.getAll();
+      getAll.onerror = () => reject(getAll.error);
+      getAll.onsuccess = () => {
+        const samePath = getAll.result.filter(item => item.path === path && item.user === user && !inFlight.has(item.id));
+        const last = samePath[samePath.length - 1];
+        if (method === 'PUT' && last && last.method === 'PUT' && isObject(last.body) && isObject(body)) {
+          // 内容变化后使用新的幂等键
+          const merged = Object.assign({}, last, {
+            body: Object.assign({}, last.body, body),
+            key: entry.key
+          });
+          store.put(merged);
+          resolve(merged);
+          return;
+        }
+        if (method === 'DELETE') {
+          samePath.filter(item => item.method === 'PUT').forEach(item => store.delete(item.id));
+        }
+        const add = store.add(entry);
+        add.onsuccess = () => resolve(Object.assign(entry, { id: add.result }));
+        add.onerror = () => reject(add.error);
+      };
+    });
+  });
+}
+
+function isObject(value) {
+  return value !== null && typeof value === 'object' && !Array.isArray(value);
+}
+
+function deleteOutboxEntries(ids) {
+  return outboxTransaction('readwrite', store => {
+    ids.forEach(id => store.delete(id));
+  });
+}
+
+// 按顺序通过批量接口提交发件箱，返回剩余的请求数；同一时间只有一次提交
+function flushOutbox() {
+  if (!flushing) {
+    flushing = submitOutbox()
+      .catch(error => {
+        console.log('Outbox flush failed:', error);
+        return getOutboxUser()
+          .then(user => user === null ? [] : readUserOutbox(user))
+          .then(entries => entries.length, () => 0);
+      })
+      .finally(() => {
+        flushing = null;
+      });
+  }
+  return flushing;
+}
+
+// 只提交属于当前登录用户的请求
+async function readUserOutbox(user) {
+  return (await readOutbox()).filter(entry => entry.user === user);
+}
+
+async function submitOutbox() {
+  // 未登录时没有可以提交的请求
+  const user = await getOutboxUser();
+  if (user === null) {
+    return 0;
+  }
+  let entries = await readUserOutbox(user);
+  let synced = 0;
+  let rejected = 0;
+  
+  while (entries.length > 0) {
+    const chunk = entries.slice(0, OUTBOX_BATCH_SIZE);
+    chunk.forEach(entry => inFlight.add(entry.id));
+    let results;
+    try {
+      const response = await fetch('/api/batch', {
+        method: 'POST',
+        credentials: 'same-origin',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          requests: chunk.map(entry => ({
+            method: entry.method,
+            path: entry.path,
+            body: entry.body,
+            headers: { 'Idempotency-Key': entry.key }
+          }))
+        })
+      });
+      // 登录已失效（被重定向到登录页）：清除该用户的缓存，请求保留到同一用户重新登录后提交
+      if (response.redirected || response.status === 401) {
+        await Promise.all([setOutboxUser(null), clearUserCaches()]);
+        break;
+      }
+      // 服务端异常时保留发件箱，稍后重试
+      if (!response.ok) break;
+      results = (await response.json()).responses;
+    } catch (error) {
+      // 仍然离线
+      break;
+    } finally {
+      chunk.forEach(entry => inFlight.delete(entry.id));
+    }
+    
+    // 依次移除已完成的请求；遇到服务端错误时停止，之后的请求带着幂等键稍后重放
+    const done = [];
+    for (let i = 0; i < chunk.length; i++) {
+      if (!results[i] || results[i].status >= 500) break;
+      if (results[i].status >= 400) rejected++;
+      done.push(chunk[i].id);
+    }
+    await deleteOutboxEntries(done);
+    synced += done.length;
+    if (done.length < chunk.length) break;
+    entries = await readUserOutbox(user);
+  }
+  
+  if (synced > 0) {
+    await invalidateAPICache();
+    notifyClients({ type: 'OUTBOX_FLUSHED', synced, rejected });
+  }
+  return (await readUserOutbox(user)).length;
 }
 
 // 监听消息事件
@@ -211,6 +606,18 @@ self.addEventListener('message', event => {
           event.ports[0].postMessage({ success: false, error: error.message });
         });
       break;
+      
+    case 'FLUSH_OUTBOX':
+      event.waitUntil(flushOutbox());
+      break;
+      
+    case 'INVALIDATE_API':
+      event.waitUntil(invalidateAPICache());
+      break;
+      
+    case 'SET_USER':
+      event.waitUntil(switchUser(payload.userId).then(() => flushOutbox()));
+      break;
   }
 });
 
@@ -224,17 +631,23 @@ function clearAllCaches() {
     });
 }
 
-// 同步离线数据
+// 同步离线数据：提交发件箱中的请求
 function syncOfflineData() {
-  // 这里可以实现离线数据同步逻辑
-  // 例如：同步离线创建的任务、更新等
-  return Promise.resolve({ synced: 0 });
+  return flushOutbox()
+    .then(remaining => ({ remaining }));
 }
 
-// 后台同步
+// 后台同步：发件箱未清空时抛出错误，由浏览器稍后重试
 self.addEventListener('sync', event => {
-  if (event.tag === 'background-sync') {
-    event.waitUntil(syncOfflineData());
+  if (event.tag === OUTBOX_SYNC_TAG || event.tag === 'background-sync') {
+    event.waitUntil(
+      flushOutbox()
+        .then(remaining => {
+          if (remaining > 0) {
+            throw new Error(`${remaining} requests still queued`);
+          }
+        })
+    );
   }
 });
 
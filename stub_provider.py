@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+本地AI服务桩 - 兼容OpenAI的/chat/completions接口（普通与SSE流式）
+
+用于离线压测聊天链路、复现服务商故障：支持脚本化回复（可包含操作指令JSON）、
+可配置的延迟分布、错误注入和限流（429）。运行时可通过 POST /_stub/config 修改配置。
+示例:
+    python stub_provider.py --port 8001 --latency lognormal:400,0.5 --error-rate 0.05 --rate-limit 20
+    然后把AI配置中的 api_base 设为 http://127.0.0.1:8001/v1
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 未匹配任何脚本规则时的默认回复
+DEFAULT_SCRIPT = [
+    {
+        'match': '创建|添加|新建|create|add',
+        'content': '好的，我来帮你创建这个任务。\n```json\n{"action": "create_task", "data": '
+                   '{"title": "压测任务", "priority": "medium", "list_name": "任务"}}\n```'
+    },
+    {
+        'match': '找|搜索|查|search|find',
+        'content': '我帮你查一下相关任务。\n```json\n{"action": "search_tasks", "data": {"query": "报告"}}\n```'
+    },
+    {
+        'match': '安排|日程|schedule',
+        'content': '我会把未安排的任务放进空闲时段。\n```json\n{"action": "auto_schedule", "data": {"duration": 60}}\n```'
+    },
+    {
+        'match': '',
+        'content': '你好！这是本地测试服务返回的回复。建议先处理高优先级且临近截止日期的任务。'
+    }
+]
+
+def parse_latency(spec):
+    """解析延迟分布（毫秒）：fixed:MS、uniform:A-B、normal:均值,标准差、lognormal:中位数,sigma"""
+    kind, _, value = spec.partition(':')
+    kind = kind.strip().lower()
+    try:
+        if kind == 'fixed':
+            ms = float(value)
+            return lambda rng: ms
+        if kind == 'uniform':
+            low, _, high = value.partition('-')
+            low, high = float(low), float(high or low)
+            return lambda rng: rng.uniform(low, high)
+        if kind == 'normal':
+            mean, _, stddev = value.partition(',')
+            mean, stddev = float(mean), float(stddev or 0)
+            return lambda rng: max(rng.gauss(mean, stddev), 0.0)
+        if kind == 'lognormal':
+            median, _, sigma = value.partition(',')
+            mu, sigma = math.log(float(median)), float(sigma or 0.5)
+            return lambda rng: rng.lognormvariate(mu, sigma)
+    except ValueError:
+        pass
+    raise ValueError(f'无效的延迟分布: {spec}（可用 fixed:MS、uniform:A-B、normal:M,S、lognormal:M,S）')
+
+class StubConfig:
+    """服务桩的运行配置，可在运行中整体替换字段"""
+
+    FIELDS = ('latency', 'chunk_latency', 'chunk_size', 'error_rate', 'error_status',
+              'rate_limit', 'retry_after', 'timeout_rate', 'malformed_rate', 'script', 'seed')
+
+    def __init__(self, latency='fixed:0', chunk_latency='fixed:0', chunk_size=4, error_rate=0.0,
+                 error_status=500, rate_limit=0, retry_after=1, timeout_rate=0.0, malformed_rate=0.0,
+                 script=None, seed=None):
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.chunk_size = chunk_size
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.timeout_rate = timeout_rate
+        self.malformed_rate = malformed_rate
+        self.script = script or DEFAULT_SCRIPT
+        self.seed = seed
+        self.compile()
+
+    def compile(self):
+        """校验并预编译分布和脚本规则，配置有误时抛出ValueError"""
+        self._latency = parse_latency(self.latency)
+        self._chunk_latency = parse_latency(self.chunk_latency)
+        self._rules = [(re.compile(rule.get('match') or '', re.IGNORECASE), rule) for rule in self.script]
+        self.rng = random.Random(self.seed)
+
+    def update(self, values):
+        unknown = set(values) - set(self.FIELDS)
+        if unknown:
+            raise ValueError(f"未知配置项: {', '.join(sorted(unknown))}")
+        previous = self.to_dict()
+        for key, value in values.items():
+            setattr(self, key, value)
+        try:
+            self.compile()
+        except (ValueError, re.error):
+            for key, value in previous.items():
+                setattr(self, key, value)
+            self.compile()
+            raise
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def sample_latency(self):
+        return self._latency(self.rng) / 1000
+
+    def sample_chunk_latency(self):
+        return self._chunk_latency(self.rng) / 1000
+
+    def pick_response(self, messages):
+        """按最后一条用户消息匹配脚本规则"""
+        user_text = next((m.get('content') or '' for m in reversed(messages) if m.get('role') == 'user'), '')
+        for pattern, rule in self._rules:
+            if pattern.search(user_text):
+                return rule
+        return {'content': ''}
+
+class RateLimiter:
+    """固定一秒窗口的请求计数限流"""
+
+    def __init__(self):
+        self._window = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def allow(self, limit):
+        if not limit:
+            return True
+        with self._lock:
+            window = int(time.time())
+            if window != self._window:
+                self._window = window
+                self._count = 0
+            self._count += 1
+            return self._count <= limit
+
+class StubStats:
+    """按结果统计请求数"""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def inc(self, outcome):
+        with self._lock:
+            self._counts[outcome] = self._counts.get(outcome, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        return json.loads(raw or b'{}')
+
+    def do_GET(self):
+        if self.path.rstrip('/') in ('/v1/models', '/models'):
+            self._send_json(200, {'object': 'list', 'data': [{'id': 'stub-model', 'object': 'model'}]})
+        elif self.path == '/_stub/stats':
+            self._send_json(200, self.server.stats.snapshot())
+        elif self.path == '/_stub/config':
+            self._send_json(200, self.server.config.to_dict())
+        else:
+            self._send_json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        try:
+            payload = self._read_json()
+        except json.JSONDecodeError:
+            self._send_json(400, {'error': {'message': 'invalid json', 'type': 'invalid_request_error'}})
+            return
+
+        if self.path == '/_stub/config':
+            try:
+                self.server.config.update(payload)
+            except (ValueError, re.error) as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            self._send_json(200, self.server.config.to_dict())
+        elif self.path == '/_stub/reset':
+            self.server.stats.reset()
+            self._send_json(200, {'success': True})
+        elif self.path.rstrip('/') in ('/v1/chat/completions', '/chat/completions'):
+            self._chat_completions(payload)
+        else:
+            self._send_json(404, {'error': {'message': 'not found'}})
+
+    def _chat_completions(self, payload):
+        config = self.server.config
+        stats = self.server.stats
+
+        if not self.server.limiter.allow(config.rate_limit):
+            stats.inc('rate_limited')
+            self._send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'rate_limit_error'}},
+                            {'Retry-After': str(config.retry_after)})
+            return
+
+        time.sleep(config.sample_latency())
+
+        roll = config.rng.random()
+        if roll < config.timeout_rate:
+            # 模拟服务商无响应：保持连接直到客户端超时
+            stats.inc('timeout')
+            time.sleep(self.server.hang_seconds)
+            self.close_connection = True
+            return
+        roll -= config.timeout_rate
+        if roll < config.error_rate:
+            stats.inc('error')
+            self._send_json(config.error_status, {'error': {'message': 'Injected upstream error',
+                                                            'type': 'server_error'}})
+            return
+        roll -= config.error_rate
+        if roll < config.malformed_rate:
+            stats.inc('malformed')
+            body = b'{"choices": [{"message": '
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        rule = config.pick_response(payload.get('messages') or [])
+        content = rule.get('content', '')
+        model = payload.get('model') or 'stub-model'
+        if payload.get('stream'):
+            stats.inc('stream')
+            self._stream(content, model, rule.get('chunk_size') or config.chunk_size)
+        else:
+            stats.inc('success')
+            self._send_json(200, {
+                'id': f'chatcmpl-stub-{int(time.time() * 1000)}',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                             'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': len(content), 'total_tokens': len(content)}
+            })
+
+    def _stream(self, content, model, chunk_size):
+        """按固定字符数切片，以SSE逐段发送"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        created = int(time.time())
+
+        def send(delta, finish_reason=None):
+            chunk = {'id': f'chatcmpl-stub-{created}', 'object': 'chat.completion.chunk', 'created': created,
+                     'model': model, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        try:
+            send({'role': 'assistant'})
+            for start in range(0, len(content), chunk_size):
+                time.sleep(self.server.config.sample_chunk_latency())
+                send({'content': content[start:start + chunk_size]})
+            send({}, 'stop')
+            self.wfile.write(b'data: [DONE]\n\n')
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config, verbose=False, hang_seconds=60):
+        super().__init__(address, StubHandler)
+        self.config = config
+        self.stats = StubStats()
+        self.limiter = RateLimiter()
+        self.verbose = verbose
+        self.hang_seconds = hang_seconds
+
+    @property
+    def api_base(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+def start_stub_server(config=None, host='127.0.0.1', port=0, **kwargs):
+    """在后台线程启动服务桩并返回服务器对象（api_base属性为接口地址）"""
+    server = StubServer((host, port), config or StubConfig(), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def load_script(path):
+    """读取脚本文件：[{"match": "正则", "content": "回复", "chunk_size": 8}, ...]"""
+    with open(path, 'r', encoding='utf-8') as f:
+        script = json.load(f)
+    if not isinstance(script, list):
+        raise ValueError('脚本文件必须是规则数组')
+    return script
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenAI兼容的本地AI服务桩')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', default='fixed:0', help='首字节延迟分布（毫秒）')
+    parser.add_argument('--chunk-latency', default='fixed:0', help='流式模式下每段间隔分布（毫秒）')
+    parser.add_argument('--chunk-size', type=int, default=4, help='流式模式下每段字符数')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回错误状态码的比例')
+    parser.add_argument('--error-status', type=int, default=500, help='注入错误时的状态码')
+    parser.add_argument('--rate-limit', type=int, default=0, help='每秒允许的请求数，超出返回429（0为不限）')
+    parser.add_argument('--retry-after', type=int, default=1, help='429响应的Retry-After秒数')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='不响应直到客户端超时的比例')
+    parser.add_argument('--hang-seconds', type=float, default=60, help='模拟超时时保持连接的秒数')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='返回损坏JSON的比例')
+    parser.add_argument('--script', help='脚本化回复文件（JSON规则数组）')
+    parser.add_argument('--seed', type=int, help='随机种子')
+    parser.add_argument('--verbose', action='store_true', help='输出访问日志')
+    args = parser.parse_args()
+
+    try:
+        config = StubConfig(
+            latency=args.latency, chunk_latency=args.chunk_latency, chunk_size=args.chunk_size,
+            error_rate=args.error_rate, error_status=args.error_status, rate_limit=args.rate_limit,
+            retry_after=args.retry_after, timeout_rate=args.timeout_rate, malformed_rate=args.malformed_rate,
+            script=load_script(args.script) if args.script else None, seed=args.seed)
+    except (ValueError, re.error) as e:
+        parser.error(str(e))
+
+    server = StubServer((args.host, args.port), config, verbose=args.verbose, hang_seconds=args.hang_seconds)
+    print(f'AI服务桩已启动: {server.api_base}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
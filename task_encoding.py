@@ -0,0 +1,119 @@
+from collections import OrderedDict
+
+# 任务可返回的字段：字段名 -> (SQL表达式, 是否转换为布尔值)；查询中tasks别名为t，task_lists别名为tl
+TASK_FIELDS = OrderedDict([
+    ('id', ('t.id', False)),
+    ('title', ('t.title', False)),
+    ('description', ('t.description', False)),
+    ('completed', ('t.completed', True)),
+    ('priority', ('t.priority', False)),
+    ('due_date', ('t.due_date', False)),
+    ('start_time', ('t.start_time', False)),
+    ('end_time', ('t.end_time', False)),
+    ('list_id', ('t.list_id', False)),
+    ('created_at', ('t.created_at', False)),
+    ('updated_at', ('t.updated_at', False)),
+    ('completed_at', ('t.completed_at', False)),
+    ('is_important', ('t.is_important', True)),
+    ('recurrence_rule', ('t.recurrence_rule', False)),
+    ('list_name', ('tl.name', False)),
+    ('list_icon', ('tl.icon', False)),
+    ('list_color', ('tl.color', False))
+])
+
+# 需要关联task_lists表的字段
+LIST_FIELDS = ('list_name', 'list_icon', 'list_color')
+
+# 各接口未指定fields时返回的字段
+TASK_DEFAULT_FIELDS = ['id', 'title', 'description', 'completed', 'priority', 'due_date', 'start_time', 'end_time',
+                       'list_id', 'created_at', 'updated_at', 'completed_at', 'is_important', 'recurrence_rule']
+SEARCH_DEFAULT_FIELDS = ['id', 'title', 'description', 'completed', 'priority', 'due_date', 'list_id',
+                         'list_name', 'list_icon']
+CALENDAR_WEEK_DEFAULT_FIELDS = ['id', 'title', 'description', 'completed', 'priority', 'start_time', 'end_time',
+                                'list_id', 'is_important', 'list_name', 'list_icon', 'list_color']
+
+FORMATS = ('objects', 'columnar')
+
+def parse_fields(value, default):
+    """解析逗号分隔的fields参数，未指定时返回默认字段；包含未知字段时抛出ValueError"""
+    if not value:
+        return list(default)
+    fields = []
+    for name in value.split(','):
+        name = name.strip()
+        if not name or name in fields:
+            continue
+        if name not in TASK_FIELDS:
+            raise ValueError(f'未知字段: {name}')
+        fields.append(name)
+    if not fields:
+        raise ValueError('fields不能为空')
+    return fields
+
+def parse_format(value):
+    """解析format参数，默认返回对象数组"""
+    value = value or 'objects'
+    if value not in FORMATS:
+        raise ValueError(f"不支持的格式: {value}，可选值: {'/'.join(FORMATS)}")
+    return value
+
+def select_clause(fields):
+    """按字段生成SELECT列表，列名与字段名一致"""
+    return ', '.join(f'{TASK_FIELDS[name][0]} AS {name}' for name in fields)
+
+def join_clause(fields):
+    """请求了列表字段时需要的关联语句"""
+    if any(name in LIST_FIELDS for name in fields):
+        return 'LEFT JOIN task_lists tl ON t.list_id = tl.id'
+    return ''
+
+class TaskEncoder:
+    """任务行编码器：对象格式返回字典，列式格式返回与columns对应的数组"""
+
+    def __init__(self, fields=TASK_DEFAULT_FIELDS, columnar=False, extra_columns=()):
+        self.fields = list(fields)
+        self.columnar = columnar
+        # 附加在字段之后的列（如重复任务实例日期）：列式格式中普通行为None，对象格式中只在传入时出现
+        self.extra_columns = [name for name in extra_columns if name not in self.fields]
+        self.columns = self.fields + self.extra_columns
+        self._count = len(self.fields)
+        self._positions = {name: index for index, name in enumerate(self.fields)}
+        self._bool_indexes = [index for index, name in enumerate(self.fields) if TASK_FIELDS[name][1]]
+
+    def encode(self, row, **extra):
+        """编码按select_clause(fields)查询的行，字段位于行首"""
+        return self._finish(list(row[:self._count]), extra)
+
+    def encode_named(self, row, **extra):
+        """按列名取值编码，用于列顺序不同的查询结果"""
+        return self._finish([row[name] for name in self.fields], extra)
+
+    def _finish(self, values, extra):
+        for index in self._bool_indexes:
+            values[index] = bool(values[index])
+        if self.columnar:
+            # extra中与字段同名的值覆盖行中的值（如重复任务实例的完成状态）
+            for name, value in extra.items():
+                if name in self._positions:
+                    values[self._positions[name]] = value
+            values.extend(extra.get(name) for name in self.extra_columns)
+            return values
+        item = dict(zip(self.fields, values))
+        for name, value in extra.items():
+            if name in self._positions or name in self.extra_columns:
+                item[name] = value
+        return item
+
+    def wrap(self, items):
+        """包装编码后的任务集合"""
+        if self.columnar:
+            return {'columns': self.columns, 'rows': items}
+        return items
+
+def encoder_from_args(args, default_fields, extra_columns=()):
+    """根据请求参数fields和format创建编码器，参数无效时抛出ValueError"""
+    fields = parse_fields(args.get('fields'), default_fields)
+    columnar = parse_format(args.get('format')) == 'columnar'
+    return TaskEncoder(fields, columnar, extra_columns)
+
+default_encoder = TaskEncoder()
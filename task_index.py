@@ -0,0 +1,229 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+import numpy as np
+from memory_monitor import register_cache
+
+# 字符n-gram范围：中文按二元/三元字串切分效果较好，英文同样适用
+NGRAM_RANGE = (2, 3)
+# 判定为疑似重复任务的相似度阈值
+DUPLICATE_THRESHOLD = 0.85
+# 内存中最多保留的用户索引数，超出时淘汰最久未使用的用户
+TASK_INDEX_MAX_USERS = int(os.environ.get('TASK_INDEX_MAX_USERS', '200'))
+
+_whitespace_pattern = re.compile(r'\s+')
+
+def extract_ngrams(text):
+    """将文本规范化后切分为字符n-gram"""
+    text = _whitespace_pattern.sub(' ', (text or '').lower()).strip()
+    if not text:
+        return []
+    padded = f' {text} '
+    ngrams = []
+    for n in range(NGRAM_RANGE[0], NGRAM_RANGE[1] + 1):
+        ngrams.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return ngrams
+
+def task_text(title, description):
+    """拼接用于建立索引的任务文本"""
+    return f'{title or ""} {description or ""}'
+
+class TaskSimilarityIndex:
+    """单个用户任务的TF-IDF向量索引（字符n-gram，稀疏行存储）"""
+
+    def __init__(self):
+        self._vocab = {}
+        self._df = np.zeros(1024, dtype=np.int32)
+        # task_id -> (词项ID数组, 对数词频数组)
+        self._rows = {}
+        self._lock = threading.Lock()
+        self._matrix = None
+        # 文档频率降为0的词项数（近似值，压缩词表前重新统计）
+        self._dead_terms = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _vectorize(self, text, grow):
+        """将文本转换为(词项ID, 对数词频)，grow为True时扩充词表"""
+        counts = {}
+        for gram in extract_ngrams(text):
+            term_id = self._vocab.get(gram)
+            if term_id is None:
+                if not grow:
+                    continue
+                term_id = len(self._vocab)
+                self._vocab[gram] = term_id
+            counts[term_id] = counts.get(term_id, 0) + 1
+
+        indices = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+        weights = 1.0 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+        return indices, weights.astype(np.float32)
+
+    def upsert(self, task_id, title, description):
+        """新增或更新一条任务"""
+        with self._lock:
+            self._remove_locked(task_id)
+            indices, weights = self._vectorize(task_text(title, description), grow=True)
+            while len(self._vocab) > len(self._df):
+                self._df = np.concatenate([self._df, np.zeros(len(self._df), dtype=np.int32)])
+            self._df[indices] += 1
+            self._rows[task_id] = (indices, weights)
+            self._matrix = None
+
+    def remove(self, task_id):
+        """从索引中移除一条任务"""
+        with self._lock:
+            self._remove_locked(task_id)
+
+    def _remove_locked(self, task_id):
+        row = self._rows.pop(task_id, None)
+        if row is not None:
+            self._df[row[0]] -= 1
+            self._dead_terms += int(np.count_nonzero(self._df[row[0]] == 0))
+            self._matrix = None
+
+    def compact(self):
+        """已无任务使用的词项超过词表一半时压缩词表，避免删除和编辑过的词项持续占用内存"""
+        with self._lock:
+            if self._dead_terms * 2 <= len(self._vocab):
+                return
+            df = self._df[:len(self._vocab)]
+            live = np.flatnonzero(df > 0)
+            self._dead_terms = len(self._vocab) - len(live)
+            if self._dead_terms * 2 <= len(self._vocab):
+                return
+            remap = np.full(len(self._vocab), -1, dtype=np.int32)
+            remap[live] = np.arange(len(live), dtype=np.int32)
+            self._vocab = {gram: int(remap[term_id]) for gram, term_id in self._vocab.items() if remap[term_id] >= 0}
+            self._df = np.zeros(max(1024, len(live)), dtype=np.int32)
+            self._df[:len(live)] = df[live]
+            self._rows = {task_id: (remap[indices], weights) for task_id, (indices, weights) in self._rows.items()}
+            self._dead_terms = 0
+            self._matrix = None
+
+    def _build_matrix(self):
+        """把各行拼接为CSR数组并按当前IDF预计算行范数"""
+        task_ids = np.fromiter(self._rows.keys(), dtype=np.int64, count=len(self._rows))
+        rows = list(self._rows.values())
+        lengths = np.array([len(row[0]) for row in rows], dtype=np.int64)
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        indices = np.concatenate([row[0] for row in rows]) if rows else np.zeros(0, dtype=np.int32)
+        weights = np.concatenate([row[1] for row in rows]) if rows else np.zeros(0, dtype=np.float32)
+
+        idf = self._idf()
+        data = weights * idf[indices]
+        norms = self._segment_sum(data * data, indptr)
+        np.sqrt(norms, out=norms)
+        norms[norms == 0] = 1.0
+        self._matrix = (task_ids, indptr, indices, data / np.repeat(norms, lengths), idf)
+        return self._matrix
+
+    def _idf(self):
+        """平滑IDF"""
+        doc_count = max(len(self._rows), 1)
+        df = self._df[:len(self._vocab)].astype(np.float32)
+        return np.log((1.0 + doc_count) / (1.0 + df)) + 1.0
+
+    @staticmethod
+    def _segment_sum(values, indptr):
+        """按CSR行求和（允许空行）"""
+        sums = np.zeros(len(indptr) - 1, dtype=np.float32)
+        non_empty = indptr[1:] > indptr[:-1]
+        if values.size and non_empty.any():
+            sums[non_empty] = np.add.reduceat(values, indptr[:-1][non_empty])
+        return sums
+
+    def query(self, text, top_k=5, exclude_ids=None):
+        """返回与文本最相似的任务 [(task_id, 相似度)]，按相似度降序"""
+        with self._lock:
+            if not self._rows:
+                return []
+            matrix = self._matrix or self._build_matrix()
+            indices, weights = self._vectorize(text, grow=False)
+            # 已无任务使用的词项不参与查询，否则会拉低所有得分
+            live = self._df[indices] > 0
+            indices, weights = indices[live], weights[live]
+
+        task_ids, indptr, doc_indices, doc_data, idf = matrix
+        if not len(indices):
+            return []
+
+        query_vector = np.zeros(len(idf), dtype=np.float32)
+        query_vector[indices] = weights * idf[indices]
+        query_norm = np.linalg.norm(query_vector)
+        if query_norm == 0:
+            return []
+        query_vector /= query_norm
+
+        scores = self._segment_sum(doc_data * query_vector[doc_indices], indptr)
+        if exclude_ids:
+            scores[np.isin(task_ids, list(exclude_ids))] = 0.0
+
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(task_ids[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+# 按最近使用排序的用户索引{用户ID: 索引}
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+register_cache('task_index', lambda: _indexes)
+
+def get_user_index(user_id, conn):
+    """获取用户索引，首次访问时从数据库构建，超出数量上限时淘汰最久未使用的用户"""
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+        if index is not None:
+            _indexes.move_to_end(user_id)
+            return index
+
+    index = TaskSimilarityIndex()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, title, description FROM tasks WHERE user_id = ?', (user_id,))
+    for task_id, title, description in cursor.fetchall():
+        index.upsert(task_id, title, description)
+
+    with _indexes_lock:
+        index = _indexes.setdefault(user_id, index)
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > max(TASK_INDEX_MAX_USERS, 1):
+            _indexes.popitem(last=False)
+        return index
+
+def refresh_tasks(user_id, task_ids, conn):
+    """任务写入后增量同步索引（索引尚未构建时跳过）"""
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+    if index is None or not task_ids:
+        return
+
+    task_ids = [int(task_id) for task_id in task_ids if str(task_id).isdigit()]
+    if not task_ids:
+        return
+    placeholders = ','.join('?' * len(task_ids))
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT id, title, description FROM tasks
+        WHERE user_id = ? AND id IN ({placeholders})
+    ''', [user_id] + task_ids)
+    found = set()
+    for task_id, title, description in cursor.fetchall():
+        index.upsert(task_id, title, description)
+        found.add(task_id)
+    for task_id in task_ids:
+        if task_id not in found:
+            index.remove(task_id)
+    index.compact()
+
+def invalidate_user_index(user_id):
+    """丢弃用户索引，下次访问时重建"""
+    with _indexes_lock:
+        _indexes.pop(user_id, None)
+
+def find_similar_tasks(user_id, text, conn, top_k=5, min_score=0.0, exclude_ids=None):
+    """查询用户任务中与文本相似的任务"""
+    index = get_user_index(user_id, conn)
+    return [(task_id, score) for task_id, score in index.query(text, top_k, exclude_ids) if score >= min_score]
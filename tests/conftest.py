@@ -0,0 +1,32 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# 应用在导入时按DATABASE_PATH初始化数据库，必须在导入前指向临时文件
+_tmpdir = tempfile.mkdtemp(prefix='todo-test-')
+os.environ['DATABASE_PATH'] = os.path.join(_tmpdir, 'test.db')
+os.environ.setdefault('IDEMPOTENCY_SWEEP_MINUTES', '0')
+os.environ.setdefault('SAMPLING_PROFILER', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+USERNAME = 'testuser'
+PASSWORD = 'password123'
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app
+    return app
+
+@pytest.fixture(scope='session')
+def client(app):
+    client = app.test_client()
+    response = client.post('/api/auth/register', json={
+        'username': USERNAME, 'email': 'test@example.com', 'password': PASSWORD, 'full_name': 'Test'
+    })
+    assert response.status_code in (200, 201), response.get_json()
+    response = client.post('/api/auth/login', json={'username': USERNAME, 'password': PASSWORD})
+    assert response.status_code == 200, response.get_json()
+    client.post('/api/tasks', json={'title': '已有任务', 'priority': 'high'})
+    return client
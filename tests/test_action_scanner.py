@@ -0,0 +1,34 @@
+import pytest
+
+ACTION = '{"action": "create_task", "data": {"title": "写周报 {草稿} \\"v2\\""}}'
+
+def scan(app_module, text, step):
+    scanner = app_module.IncrementalActionScanner()
+    actions = []
+    for offset in range(0, len(text), step):
+        actions.extend(scanner.feed(text[offset:offset + step]))
+    return actions
+
+@pytest.fixture
+def app_module(app):
+    import app as app_module
+    return app_module
+
+@pytest.mark.parametrize('step', [1, 5, 10000])
+@pytest.mark.parametrize('prefix', [
+    '好的，',
+    '集合用 { 表示。',
+    'a {{{{ ',
+    '{ 没闭合的"引号 ',
+    '{not json} ',
+    '{"a": 1, x} ',
+    '{"note": "不是指令"} ',
+])
+def test_unbalanced_braces_do_not_hide_later_actions(app_module, prefix, step):
+    actions = scan(app_module, prefix + ACTION + ' 然后 ' + ACTION, step)
+    assert [action['data']['title'] for action in actions] == ['写周报 {草稿} "v2"'] * 2
+
+def test_resyncs_after_length_cap(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'AI_ACTION_MAX_CHARS', 200)
+    text = '{"note": "没闭合的字符串 ' + 'x' * 500 + ' ' + ACTION
+    assert len(scan(app_module, text, 7)) == 1
@@ -0,0 +1,95 @@
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from asset_pipeline import AssetBuild, minify_css, minify_js, minify_json, resolve_static
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NODE = shutil.which('node')
+
+def test_minify_css():
+    css = '''
+    /* 注释 */
+    .a  >  .b ,  .c {
+        color: red ;
+        content: "  /* 保留 */  ";
+    }
+    @media (max-width: 600px) { .a { margin: 0 auto; } }
+    .d :hover { color: blue }
+    '''
+    assert minify_css(css) == ('.a>.b,.c{color:red;content:"  /* 保留 */  "}'
+                               '@media (max-width:600px){.a{margin:0 auto}}'
+                               # 选择器中冒号前的空格有含义，必须保留
+                               '.d :hover{color:blue}')
+
+@pytest.mark.parametrize('source, expected', [
+    ('var a = 1; // 注释\nvar b = 2;', 'var a=1;var b=2;'),
+    ('/* 块注释 */ let s = "a // b" + \'/* c */\';', 'let s="a // b"+\'/* c */\';'),
+    ('x = a + +b - -c', 'x=a+ +b- -c'),
+    ('return /a\\/b[/]/g.test(s)', 'return/a\\/b[/]/g.test(s)'),
+    ('y = a / b / c', 'y=a/b/c'),
+    ('t = `a ${ {b: 1}.b } // ${`x${y}`}`', 't=`a ${{b:1}.b} // ${`x${y}`}`'),
+    ('let a = b\nlet c = d', 'let a=b\nlet c=d'),
+    ('f(a,\n  b)', 'f(a,b)'),
+    ('n = 1 .toFixed()', 'n=1 .toFixed()'),
+])
+def test_minify_js(source, expected):
+    assert minify_js(source) == expected
+
+def test_minify_json():
+    assert minify_json('{\n  "名称": [1, 2],\n  "a": {"b": null}\n}') == '{"名称":[1,2],"a":{"b":null}}'
+
+@pytest.mark.skipif(NODE is None, reason='需要node')
+def test_minified_js_keeps_behavior(tmp_path):
+    source = '''
+    const items = [3, 1, 2]
+    const pattern = /^(\\d+)\\/(\\d+)$/
+    let total = 0
+    for (const item of items) total += item / 2
+    ++total
+    console.log(JSON.stringify({total, match: '10/20'.match(pattern).slice(1),
+        text: `共${items.length}项 ${items.map(x => `<${x}>`).join('')}`}))
+    '''
+    outputs = []
+    for name, text in (('source.js', source), ('minified.js', minify_js(source))):
+        path = tmp_path / name
+        path.write_text(text, encoding='utf-8')
+        outputs.append(subprocess.run([NODE, str(path)], capture_output=True, text=True, check=True).stdout)
+    assert outputs[0] == outputs[1]
+
+@pytest.mark.skipif(NODE is None, reason='需要node')
+@pytest.mark.parametrize('name', ['static/js/main.js', 'static/sw.js'])
+def test_minified_static_scripts_parse(tmp_path, name):
+    with open(os.path.join(ROOT, name), encoding='utf-8') as f:
+        minified = minify_js(f.read())
+    path = tmp_path / os.path.basename(name)
+    path.write_text(minified, encoding='utf-8')
+    subprocess.run([NODE, '--check', str(path)], check=True)
+
+def test_build_writes_hashed_assets(tmp_path):
+    static_dir, template_dir = tmp_path / 'static', tmp_path / 'templates'
+    (static_dir / 'css').mkdir(parents=True)
+    template_dir.mkdir()
+    (static_dir / 'css' / 'site.css').write_text('body {  color: red; }', encoding='utf-8')
+    (static_dir / 'sw.js').write_text("const CACHE_NAME = 'todo-v1';\nconst STATIC_ASSETS = [\n  '/',\n"
+                                      "  '/static/css/site.css'\n];\n", encoding='utf-8')
+    (template_dir / 'index.html').write_text('<link href="/static/css/site.css"><style>p { margin: 0 }</style>',
+                                             encoding='utf-8')
+
+    manifest = AssetBuild(str(static_dir), str(template_dir), str(tmp_path / 'build')).run()
+    css_path = manifest['assets']['css/site.css']
+    assert (static_dir / css_path).read_text(encoding='utf-8') == 'body{color:red}'
+    html = (tmp_path / 'build' / 'index.html').read_text(encoding='utf-8')
+    assert f'href="/static/{css_path}"' in html
+    assert f'/static/{manifest["assets"]["inline/index.css"]}' in html
+    sw = (static_dir / manifest['aliases']['sw.js']).read_text(encoding='utf-8')
+    assert f"'/static/{css_path}'" in sw and f"todo-{manifest['version']}" in sw
+    assert json.loads((static_dir / 'dist' / 'asset-manifest.json').read_text(encoding='utf-8')) == manifest
+
+    loaded = dict(manifest, immutable=set(manifest['assets'].values()))
+    assert resolve_static(loaded, css_path) == (css_path, True)
+    assert resolve_static(loaded, 'sw.js') == (manifest['aliases']['sw.js'], False)
+    assert resolve_static(None, 'sw.js') == ('sw.js', False)
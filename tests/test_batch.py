@@ -0,0 +1,52 @@
+import pytest
+
+def batch(client, *requests):
+    response = client.post('/api/batch', json={'requests': list(requests)})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['responses']
+
+def find_task(tasks, task_id):
+    return next((task for task in tasks if task['id'] == task_id), None)
+
+def test_reads_match_direct_requests(client):
+    paths = ['/api/tasks', '/api/task_lists', '/api/stats']
+    results = batch(client, *({'method': 'GET', 'path': path} for path in paths))
+    for path, result in zip(paths, results):
+        direct = client.get(path)
+        assert result['status'] == direct.status_code == 200
+        assert result['body'] == direct.get_json()
+
+def test_write_then_read_sees_write(client):
+    results = batch(client,
+                    {'method': 'POST', 'path': '/api/tasks', 'body': {'title': '批量创建的任务'}},
+                    {'method': 'GET', 'path': '/api/tasks'})
+    assert results[0]['status'] == 200
+    task_id = results[0]['body']['id']
+    assert find_task(results[1]['body'], task_id)['title'] == '批量创建的任务'
+    assert find_task(client.get('/api/tasks').get_json(), task_id) is not None
+
+def test_failing_write_is_rolled_back(client):
+    task_id = client.post('/api/tasks', json={'title': '原标题'}).get_json()['id']
+    # 第一条更新执行后第二条因参数类型出错，未提交的第一条不能被后续子请求提交
+    results = batch(client,
+                    {'method': 'POST', 'path': '/api/tasks/batch',
+                     'body': {'updates': [{'id': task_id, 'title': '新标题'}, {'id': task_id, 'title': ['无效']}]}},
+                    {'method': 'POST', 'path': '/api/tasks', 'body': {'title': '之后的写入'}},
+                    {'method': 'GET', 'path': '/api/tasks'})
+    assert results[0]['status'] == 500
+    assert results[1]['status'] == 200
+    assert find_task(results[2]['body'], task_id)['title'] == '原标题'
+    assert find_task(client.get('/api/tasks').get_json(), task_id)['title'] == '原标题'
+
+@pytest.mark.parametrize('path', ['/api/batch', '/api/batch/', '/login', 'api/tasks', '/api/changes/stream'])
+def test_rejects_unsupported_paths(client, path):
+    response = client.post('/api/batch', json={'requests': [{'method': 'GET', 'path': path}]})
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+def test_bootstrap_after_write_uses_batch_transaction(client):
+    results = batch(client,
+                    {'method': 'POST', 'path': '/api/tasks', 'body': {'title': '启动前写入'}},
+                    {'method': 'GET', 'path': '/api/bootstrap'})
+    assert [result['status'] for result in results] == [200, 200]
+    assert find_task(client.get('/api/tasks').get_json(), results[0]['body']['id']) is not None
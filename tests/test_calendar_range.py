@@ -0,0 +1,71 @@
+import sqlite3
+from datetime import date
+
+import pytest
+
+import calendar_range
+from calendar_range import adjacent_windows, bucket_key
+
+def titles_by_bucket(data, prefix):
+    title = data['columns'].index('title')
+    return {bucket['key']: [task[title] for task in bucket['tasks'] if task[title].startswith(prefix)]
+            for bucket in data['buckets']}
+
+@pytest.fixture(scope='module')
+def range_tasks(client):
+    # 2032-03-01是周一，2032-03-07是周日
+    for title, due_date in (('日历-a', '2032-03-01'), ('日历-b', '2032-03-07'), ('日历-c', '2032-03-08'),
+                            ('日历-d', '2032-04-02')):
+        assert client.post('/api/tasks', json={'title': title, 'due_date': due_date}).status_code == 200
+    client.post('/api/tasks', json={'title': '日历-每周', 'due_date': '2032-03-03', 'recurrence_rule': 'FREQ=WEEKLY'})
+    return client
+
+@pytest.mark.parametrize('granularity, expected', [
+    ('day', {'2032-03-01': ['日历-a'], '2032-03-03': ['日历-每周'], '2032-03-07': ['日历-b'],
+             '2032-03-08': ['日历-c'], '2032-03-10': ['日历-每周']}),
+    ('week', {'2032-03-01': ['日历-a', '日历-每周', '日历-b'], '2032-03-08': ['日历-c', '日历-每周']}),
+    ('month', {'2032-03-01': ['日历-a', '日历-每周', '日历-b', '日历-c', '日历-每周']}),
+])
+def test_buckets_by_granularity(range_tasks, granularity, expected):
+    response = range_tasks.get(f'/api/calendar/range?start=2032-03-01&end=2032-03-14&granularity={granularity}')
+    assert response.status_code == 200
+    buckets = {key: titles for key, titles in titles_by_bucket(response.get_json(), '日历-').items() if titles}
+    assert buckets == expected
+
+def test_cache_is_invalidated_by_writes(range_tasks):
+    path = '/api/calendar/range?start=2032-04-01&end=2032-04-30'
+    range_tasks.get(path)
+    assert range_tasks.get(path).get_json()['cached'] is True
+
+    range_tasks.post('/api/tasks', json={'title': '日历-e', 'due_date': '2032-04-02'})
+    data = range_tasks.get(path).get_json()
+    assert data['cached'] is False
+    assert titles_by_bucket(data, '日历-')['2032-04-02'] == ['日历-d', '日历-e']
+
+@pytest.mark.parametrize('day', [date(2032, 2, 29), date(2032, 3, 1), date(2032, 3, 7), date(2032, 12, 31)])
+def test_bucket_key_matches_sql(day):
+    conn = sqlite3.connect(':memory:')
+    for granularity, expression in calendar_range.BUCKET_EXPRESSIONS.items():
+        sql_key = conn.execute(f'SELECT {expression} FROM (SELECT ? AS due_date)', (day.isoformat(),)).fetchone()[0]
+        assert bucket_key(day, granularity) == sql_key
+
+def test_adjacent_windows():
+    assert adjacent_windows(date(2032, 3, 1), date(2032, 3, 7), 'day') == [
+        (date(2032, 2, 23), date(2032, 2, 29)), (date(2032, 3, 8), date(2032, 3, 14))]
+    assert adjacent_windows(date(2032, 2, 1), date(2032, 2, 29), 'month') == [
+        (date(2032, 1, 1), date(2032, 1, 31)), (date(2032, 3, 1), date(2032, 3, 31))]
+
+def test_prefetch_skips_windows_already_pending(monkeypatch):
+    submitted = []
+    monkeypatch.setattr(calendar_range, '_get_executor', lambda: type('Executor', (), {
+        'submit': staticmethod(lambda worker: submitted.append(worker))})())
+    monkeypatch.setattr(calendar_range, '_pending', set())
+    args = (None, -1, 'v1', date(2032, 3, 1), date(2032, 3, 7))
+    calendar_range.prefetch_adjacent(*args)
+    calendar_range.prefetch_adjacent(*args)
+    assert len(submitted) == 1
+    assert len(calendar_range._pending) == 2
+
+    monkeypatch.setattr(calendar_range, 'PREFETCH_MAX_PENDING', 2)
+    calendar_range.prefetch_adjacent(None, -1, 'v1', date(2033, 3, 1), date(2033, 3, 7))
+    assert len(submitted) == 1
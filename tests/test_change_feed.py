@@ -0,0 +1,127 @@
+import json
+import sqlite3
+from datetime import date
+
+import pytest
+
+import change_feed
+from change_feed import RESYNC, ChangeFeed, Subscription, task_change_events
+
+TODAY = date.today().isoformat()
+
+def task(task_id, list_id=1, completed=0, due_date=None, is_important=0, title='任务'):
+    return {'id': task_id, 'title': title, 'list_id': list_id, 'completed': completed,
+            'due_date': due_date, 'is_important': is_important}
+
+def events_by_type(events):
+    return {event_type: payload for event_type, payload in events}
+
+def test_created_task_counts():
+    events = events_by_type(task_change_events({}, {5: task(5, due_date=TODAY, is_important=1)}))
+    assert events['task.upserted'] == {'task': task(5, due_date=TODAY, is_important=1)}
+    assert events['lists.counts'] == {'lists': {1: {'total_tasks': 1}}}
+    assert events['stats.delta'] == {'stats': {'total_tasks': 1, 'important_tasks': 1,
+                                               'today_due_tasks': 1, 'week_due_tasks': 1}}
+
+def test_completed_and_moved_task_counts():
+    events = events_by_type(task_change_events({5: task(5, due_date=TODAY)},
+                                               {5: task(5, list_id=2, completed=1, due_date=TODAY)}))
+    assert events['lists.counts'] == {'lists': {1: {'total_tasks': -1}, 2: {'total_tasks': 1, 'completed_tasks': 1}}}
+    assert events['stats.delta'] == {'stats': {'completed_tasks': 1, 'today_due_tasks': -1, 'week_due_tasks': -1}}
+
+def test_deleted_and_unchanged_tasks():
+    events = task_change_events({5: task(5), 6: task(6)}, {6: task(6)})
+    assert events == [('task.deleted', {'id': 5, 'list_id': 1}),
+                      ('lists.counts', {'lists': {1: {'total_tasks': -1}}}),
+                      ('stats.delta', {'stats': {'total_tasks': -1}})]
+    # 只改标题不影响计数
+    assert task_change_events({5: task(5)}, {5: task(5, title='新标题')}) == [
+        ('task.upserted', {'task': task(5, title='新标题')})]
+
+@pytest.fixture
+def feed_conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('''
+        CREATE TABLE change_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            event_type TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            origin TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    yield conn
+    conn.close()
+
+def test_publish_delivers_to_same_user_only(feed_conn):
+    feed = ChangeFeed()
+    mine, other = feed.subscribe(1), feed.subscribe(2)
+    published = feed.publish(feed_conn, 1, [('task.deleted', {'id': 5})])
+    assert mine.get(0) is published[0]
+    assert json.loads(published[0].data) == {'id': 5}
+    assert other.get(0) is None
+    feed.unsubscribe(mine)
+    feed.unsubscribe(other)
+    assert feed.subscriber_count() == 0
+
+def test_replay_after_last_event_id(feed_conn):
+    feed = ChangeFeed()
+    ids = [event.event_id for event in feed.publish(feed_conn, 1, [('a', {}), ('b', {}), ('c', {})])]
+    feed.publish(feed_conn, 2, [('other', {})])
+    events, complete = feed.replay(feed_conn, 1, ids[0])
+    assert [event.event_type for event in events] == ['b', 'c']
+    assert complete
+
+    # 请求的位置之后的事件已被清理，不能保证完整
+    feed_conn.execute('DELETE FROM change_events WHERE id <= ?', (ids[1],))
+    events, complete = feed.replay(feed_conn, 1, ids[0])
+    assert [event.event_type for event in events] == ['c']
+    assert not complete
+
+def test_replay_reports_truncation(feed_conn, monkeypatch):
+    monkeypatch.setattr(change_feed, 'CHANGE_FEED_REPLAY_LIMIT', 2)
+    feed = ChangeFeed()
+    feed.publish(feed_conn, 1, [('a', {}), ('b', {}), ('c', {})])
+    events, complete = feed.replay(feed_conn, 1, 0)
+    assert [event.event_type for event in events] == ['a', 'b']
+    assert not complete
+
+def test_replay_when_all_events_pruned(feed_conn):
+    feed = ChangeFeed()
+    last_id = feed.publish(feed_conn, 1, [('a', {})])[0].event_id
+    feed_conn.execute('DELETE FROM change_events')
+    assert feed.replay(feed_conn, 1, last_id) == ([], True)
+    assert feed.replay(feed_conn, 1, last_id - 1) == ([], False)
+
+def test_slow_subscriber_gets_resync():
+    subscription = Subscription(1, maxsize=2)
+    for event_id in range(3):
+        subscription.put(event_id)
+    assert subscription.get(0) is RESYNC
+    assert subscription.get(0) is None
+
+def test_stats_delta_matches_stats_endpoint(client):
+    import app
+    user_id = int(client.get('/api/bootstrap').get_json()['user']['id'])
+    subscription = app.change_feed.subscribe(user_id)
+    try:
+        before = client.get('/api/stats').get_json()
+        task_id = client.post('/api/tasks', json={'title': '统计增量', 'due_date': TODAY,
+                                                  'is_important': True}).get_json()['id']
+        client.put(f'/api/tasks/{task_id}', json={'completed': True})
+        after = client.get('/api/stats').get_json()
+        expected = dict(before)
+        while True:
+            event = subscription.get(0)
+            if event is None:
+                break
+            if event.event_type == 'stats.delta':
+                for key, value in json.loads(event.data)['stats'].items():
+                    expected[key] += value
+    finally:
+        app.change_feed.unsubscribe(subscription)
+    # 完成率由客户端根据计数重新计算
+    expected.pop('completion_rate')
+    after.pop('completion_rate')
+    assert expected == after
@@ -0,0 +1,72 @@
+import gzip
+import os
+
+import pytest
+from werkzeug.http import parse_accept_header
+
+import compression
+from compression import negotiate, precompress_file, send_static
+
+def accept(value):
+    return parse_accept_header(value)
+
+@pytest.mark.parametrize('header, expected', [
+    ('gzip, deflate', 'gzip'),
+    ('br;q=1, gzip;q=0.5', 'br'),
+    ('gzip;q=0, identity', None),
+    ('', None),
+    ('*', 'br'),
+])
+def test_negotiate(header, expected):
+    assert negotiate(accept(header), ['br', 'gzip']) == expected
+
+def test_negotiate_without_brotli(monkeypatch):
+    monkeypatch.setattr(compression, 'brotli', None)
+    assert negotiate(accept('br, gzip;q=0.5')) == 'gzip'
+    assert negotiate(accept('br')) is None
+
+@pytest.fixture(scope='module')
+def large_list(client):
+    for number in range(20):
+        client.post('/api/tasks', json={'title': f'压缩测试任务{number}', 'description': '重复的描述文字' * 5})
+    return client
+
+def test_dynamic_response_is_gzipped(large_list):
+    plain = large_list.get('/api/tasks')
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+
+    response = large_list.get('/api/tasks', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.get_data()) == plain.get_data()
+
+def test_small_responses_are_not_compressed(client):
+    response = client.get('/api/auth/check', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+
+def test_disabled_compression(large_list, monkeypatch):
+    monkeypatch.setattr(compression, 'COMPRESSION_ENABLED', False)
+    response = large_list.get('/api/tasks', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+def test_send_static_prefers_fresh_precompressed_file(app, tmp_path):
+    path = tmp_path / 'app.js'
+    path.write_text('console.log("预压缩");\n' * 100)
+    assert 'gzip' in [result[0] for result in precompress_file(str(path))]
+
+    def fetch(accept_encoding):
+        with app.test_request_context('/static/app.js', headers={'Accept-Encoding': accept_encoding}):
+            response = send_static(str(tmp_path), 'app.js')
+            response.direct_passthrough = False
+            return response.headers.get('Content-Encoding'), response.get_data()
+
+    encoding, data = fetch('gzip')
+    assert encoding == 'gzip'
+    assert gzip.decompress(data) == path.read_bytes()
+    assert fetch('identity') == (None, path.read_bytes())
+
+    # 原文件更新后预压缩文件过期，回退到原文件
+    os.utime(path, (os.path.getmtime(path) + 10,) * 2)
+    assert fetch('gzip') == (None, path.read_bytes())
@@ -0,0 +1,134 @@
+import json
+import uuid
+
+import pytest
+from flask import Response
+
+from idempotency import REPLAYED_HEADER, request_fingerprint
+
+@pytest.fixture
+def store(app):
+    from app import idempotency_store
+    return idempotency_store
+
+@pytest.fixture
+def user_id(client):
+    return int(client.get('/api/bootstrap').get_json()['user']['id'])
+
+def new_key():
+    return uuid.uuid4().hex
+
+def saved(store, user_id, key):
+    conn, owned = store.connection()
+    try:
+        row = conn.execute('SELECT status, body FROM idempotency_keys WHERE user_id = ? AND idempotency_key = ?',
+                           (user_id, key)).fetchone()
+        return tuple(row) if row is not None else None
+    finally:
+        if owned:
+            conn.close()
+
+def count_tasks(client, title):
+    return sum(task['title'] == title for task in client.get('/api/tasks').get_json())
+
+def test_retry_replays_first_response(client):
+    key = new_key()
+    headers = {'Idempotency-Key': key}
+    first = client.post('/api/tasks', json={'title': '幂等创建', 'priority': 'low'}, headers=headers)
+    # JSON字段顺序和空白不同仍视为同一请求
+    retry = client.post('/api/tasks', data='{"priority": "low",  "title": "幂等创建"}',
+                        content_type='application/json', headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.get_json() == first.get_json()
+    assert retry.headers[REPLAYED_HEADER] == 'true'
+    assert REPLAYED_HEADER not in first.headers
+    assert count_tasks(client, '幂等创建') == 1
+
+def test_same_key_for_different_request_is_rejected(client):
+    headers = {'Idempotency-Key': new_key()}
+    assert client.post('/api/tasks', json={'title': '幂等-甲'}, headers=headers).status_code == 200
+    assert client.post('/api/tasks', json={'title': '幂等-乙'}, headers=headers).status_code == 422
+    assert client.post('/api/task_lists', json={'name': '幂等-甲'}, headers=headers).status_code == 422
+    assert count_tasks(client, '幂等-乙') == 0
+
+def test_keys_are_scoped_per_user(client, store, user_id):
+    key = new_key()
+    conn, owned = store.connection()
+    try:
+        assert store.claim(conn, user_id + 1000, key, 'other') is None
+    finally:
+        if owned:
+            conn.close()
+    assert client.post('/api/tasks', json={'title': '幂等-用户'}, headers={'Idempotency-Key': key}).status_code == 200
+
+@pytest.mark.parametrize('key', ['', '   ', 'k' * 256])
+def test_invalid_key(client, key):
+    response = client.post('/api/tasks', json={'title': '无效键'}, headers={'Idempotency-Key': key})
+    assert response.status_code == 400
+
+def test_request_in_progress_returns_409(client, store, user_id):
+    key = new_key()
+    fingerprint = request_fingerprint('POST', '/api/tasks', {'title': '处理中'})
+    conn, owned = store.connection()
+    try:
+        assert store.claim(conn, user_id, key, fingerprint) is None
+    finally:
+        if owned:
+            conn.close()
+    response = client.post('/api/tasks', json={'title': '处理中'}, headers={'Idempotency-Key': key})
+    assert response.status_code == 409
+
+def test_once_saves_only_successful_results(store, user_id):
+    calls = []
+
+    def execute(result):
+        calls.append(result)
+        return result
+
+    key = new_key()
+    assert store.once(user_id, key, {'n': 1}, lambda: execute({'success': False})) == {'success': False}
+    assert saved(store, user_id, key) is None
+    assert store.once(user_id, key, {'n': 1}, lambda: execute({'success': True, 'id': 9})) == {'success': True, 'id': 9}
+    assert store.once(user_id, key, {'n': 1}, lambda: execute({'success': True, 'id': 10})) == {
+        'success': True, 'id': 9, 'replayed': True}
+    assert len(calls) == 2
+
+    failing = new_key()
+    with pytest.raises(RuntimeError):
+        store.once(user_id, failing, {}, lambda: (_ for _ in ()).throw(RuntimeError('失败')))
+    assert saved(store, user_id, failing) is None
+
+def stream_response(chunks):
+    return Response(iter(chunks), mimetype='text/event-stream')
+
+def claim(store, user_id, key):
+    conn, owned = store.connection()
+    try:
+        assert store.claim(conn, user_id, key, 'stream') is None
+    finally:
+        if owned:
+            conn.close()
+
+def test_stream_is_saved_after_it_finishes(store, user_id):
+    key = new_key()
+    claim(store, user_id, key)
+    chunks = ['data: 一\n\n', b'data: two\n\n']
+    assert list(store.record_stream(user_id, key, stream_response(chunks))) == chunks
+    assert saved(store, user_id, key) == (200, 'data: 一\n\ndata: two\n\n'.encode('utf-8'))
+
+def test_interrupted_stream_releases_key(store, user_id):
+    key = new_key()
+    claim(store, user_id, key)
+    stream = store.record_stream(user_id, key, stream_response(['a', 'b']))
+    assert next(stream) == 'a'
+    stream.close()
+    assert saved(store, user_id, key) is None
+
+def test_ai_chat_replay(client):
+    headers = {'Idempotency-Key': new_key()}
+    first = client.post('/api/ai/chat', json={'message': '你好'}, headers=headers)
+    retry = client.post('/api/ai/chat', json={'message': '你好'}, headers=headers)
+    assert first.status_code == 200
+    assert retry.headers[REPLAYED_HEADER] == 'true'
+    assert json.loads(retry.get_data()) == json.loads(first.get_data())
+    assert client.post('/api/ai/chat', json={'message': '再见'}, headers=headers).status_code == 422
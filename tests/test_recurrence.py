@@ -0,0 +1,52 @@
+from datetime import date
+
+import pytest
+
+from recurrence import is_occurrence, iter_occurrences, normalize_rrule, parse_rrule
+
+def occurrences(start, rule, window_start, window_end):
+    return list(iter_occurrences(start, rule, window_start, window_end))
+
+def test_daily_jumps_to_window():
+    result = occurrences(date(2020, 1, 1), 'FREQ=DAILY;INTERVAL=3', date(2025, 1, 1), date(2025, 1, 7))
+    assert result == [date(2025, 1, 1), date(2025, 1, 4), date(2025, 1, 7)]
+
+def test_weekly_respects_until():
+    result = occurrences(date(2025, 1, 6), 'FREQ=WEEKLY;UNTIL=20250120', date(2025, 1, 1), date(2025, 2, 28))
+    assert result == [date(2025, 1, 6), date(2025, 1, 13), date(2025, 1, 20)]
+
+def test_monthly_skips_missing_days_and_counts_only_valid_dates():
+    result = occurrences(date(2025, 1, 31), 'FREQ=MONTHLY;COUNT=3', date(2025, 1, 1), date(2025, 12, 31))
+    assert result == [date(2025, 1, 31), date(2025, 3, 31), date(2025, 5, 31)]
+
+def test_is_occurrence():
+    assert is_occurrence(date(2025, 1, 15), 'FREQ=MONTHLY;INTERVAL=2', date(2025, 3, 15))
+    assert not is_occurrence(date(2025, 1, 15), 'FREQ=MONTHLY;INTERVAL=2', date(2025, 2, 15))
+
+@pytest.mark.parametrize('rule', ['FREQ=MONTHLY', 'FREQ=MONTHLY;INTERVAL=5', 'FREQ=DAILY', 'FREQ=WEEKLY;INTERVAL=3'])
+@pytest.mark.parametrize('day', [15, 31])
+def test_expansion_stops_at_max_date(rule, day):
+    # 超出date支持的年份时必须结束，不能无限循环或抛出OverflowError
+    result = occurrences(date(2025, 1, day), rule, date(9999, 12, 1), date.max)
+    assert all(date(9999, 12, 1) <= item <= date.max for item in result)
+
+def test_normalize_rrule():
+    assert normalize_rrule('rrule:freq=weekly;interval=1;count=4') == 'FREQ=WEEKLY;COUNT=4'
+    with pytest.raises(ValueError):
+        parse_rrule('FREQ=YEARLY')
+
+@pytest.mark.parametrize('path', [
+    '/api/calendar/range?start=9999-12-01&end=9999-12-31',
+    '/api/calendar/range?start=1000-01-01&end=1000-01-31',
+    '/api/calendar/week?week_start=9999-12-27',
+    '/api/calendar/week?week_start=not-a-date',
+])
+def test_calendar_rejects_out_of_range_dates(client, path):
+    client.post('/api/tasks', json={'title': '每月任务', 'due_date': '2025-01-31', 'recurrence_rule': 'FREQ=MONTHLY'})
+    assert client.get(path).status_code == 400
+
+def test_calendar_range_expands_monthly_task(client):
+    client.post('/api/tasks', json={'title': '月度汇报', 'due_date': '2025-01-31', 'recurrence_rule': 'FREQ=MONTHLY'})
+    data = client.get('/api/calendar/range?start=2025-02-01&end=2025-03-31').get_json()
+    due_dates = [task[5] for bucket in data['buckets'] for task in bucket['tasks'] if task[1] == '月度汇报']
+    assert due_dates == ['2025-03-31']
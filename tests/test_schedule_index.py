@@ -0,0 +1,84 @@
+from datetime import date
+
+import pytest
+
+from schedule_index import ScheduleIndex
+
+def row(task_id, due_date, start_time, end_time=None, recurrence_rule=None):
+    return {'id': task_id, 'title': f'任务{task_id}', 'due_date': due_date,
+            'start_time': start_time, 'end_time': end_time, 'recurrence_rule': recurrence_rule}
+
+def conflict_ids(index, day, start_time, end_time, exclude_id=None):
+    return sorted(item['id'] for item in index.find_conflicts(day, start_time, end_time, exclude_id))
+
+def test_find_conflicts():
+    index = ScheduleIndex([row(1, '2025-03-03', '09:00', '10:00'), row(2, '2025-03-03', '09:30', '11:00'),
+                           row(3, '2025-03-03', '13:00')])
+    assert conflict_ids(index, '2025-03-03', '09:45', '10:15') == [1, 2]
+    assert conflict_ids(index, '2025-03-03', '11:00', '12:00') == []
+    assert conflict_ids(index, '2025-03-03', '09:45', '10:15', exclude_id=1) == [2]
+    # 没有结束时间的任务按默认时长占用
+    assert conflict_ids(index, '2025-03-03', '13:20', '13:40') == [3]
+    assert conflict_ids(index, '2025-03-04', '09:00', '10:00') == []
+
+def test_free_slots_merge_overlapping_tasks():
+    index = ScheduleIndex([row(1, '2025-03-03', '09:00', '10:00'), row(2, '2025-03-03', '09:30', '11:00'),
+                           row(3, '2025-03-03', '14:00', '14:20')])
+    days = index.free_slots(date(2025, 3, 3), date(2025, 3, 4), '08:00', '18:00', min_duration=30)
+    assert days[0]['slots'] == [{'start_time': '08:00', 'end_time': '09:00'},
+                                {'start_time': '11:00', 'end_time': '14:00'},
+                                {'start_time': '14:20', 'end_time': '18:00'}]
+    assert days[1]['slots'] == [{'start_time': '08:00', 'end_time': '18:00'}]
+
+def test_recurring_tasks_and_exceptions():
+    index = ScheduleIndex([row(1, '2025-03-03', '09:00', '10:00', 'FREQ=WEEKLY')], exceptions={(1, '2025-03-10')})
+    assert conflict_ids(index, '2025-03-17', '09:30', '09:45') == [1]
+    assert conflict_ids(index, '2025-03-10', '09:30', '09:45') == []
+    assert conflict_ids(index, '2025-03-18', '09:30', '09:45') == []
+
+def test_update_tasks_matches_rebuild():
+    rows = [row(1, '2025-03-03', '09:00', '10:00'), row(2, '2025-03-03', '10:00', '11:00'),
+            row(3, '2025-03-04', '09:00', '10:00'), row(4, '2025-03-03', '08:00', '09:00', 'FREQ=DAILY')]
+    index = ScheduleIndex(rows)
+    conflict_ids(index, '2025-03-05', '08:00', '09:00')
+    # 任务2移到第二天，任务3删除，任务4跳过3月5日，新增任务5
+    changed = [row(2, '2025-03-04', '12:00', '13:00'), row(4, '2025-03-03', '08:00', '09:00', 'FREQ=DAILY'),
+               row(5, '2025-03-03', '15:00', '16:00')]
+    index.update_tasks([2, 3, 4, 5], changed, [(4, '2025-03-05')], version=7)
+    rebuilt = ScheduleIndex([rows[0]] + changed, exceptions={(4, '2025-03-05')})
+
+    assert index.version == 7
+    assert index.placements == rebuilt.placements
+    for day in ('2025-03-03', '2025-03-04', '2025-03-05'):
+        for start_time, end_time in (('08:00', '09:00'), ('09:30', '10:30'), ('12:00', '16:00')):
+            assert conflict_ids(index, day, start_time, end_time) == conflict_ids(rebuilt, day, start_time, end_time)
+
+def create_timed_task(client, title, due_date, start_time, end_time):
+    response = client.post('/api/tasks', json={'title': title, 'due_date': due_date,
+                                               'start_time': start_time, 'end_time': end_time})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['id']
+
+def test_update_task_time_checks_conflicts_after_writes(client):
+    first = create_timed_task(client, '晨会', '2031-04-01', '09:00', '10:00')
+    second = create_timed_task(client, '评审', '2031-04-02', '09:00', '10:00')
+    move = {'due_date': '2031-04-01', 'start_time': '09:30', 'end_time': '10:30'}
+
+    response = client.put(f'/api/tasks/{second}/time', json=move)
+    assert response.status_code == 409
+    assert [item['id'] for item in response.get_json()['conflicts']] == [first]
+
+    # 移走冲突任务后索引应立即反映新的时间
+    assert client.put(f'/api/tasks/{first}/time', json={'due_date': '2031-04-01', 'start_time': '14:00',
+                                                         'end_time': '15:00'}).status_code == 200
+    assert client.put(f'/api/tasks/{second}/time', json=move).status_code == 200
+    slots = client.get('/api/calendar/free_slots?start=2031-04-01&end=2031-04-01'
+                       '&day_start=09:00&day_end=18:00').get_json()['days'][0]['slots']
+    assert slots == [{'start_time': '09:00', 'end_time': '09:30'}, {'start_time': '10:30', 'end_time': '14:00'},
+                     {'start_time': '15:00', 'end_time': '18:00'}]
+
+@pytest.mark.parametrize('due_date', ['2031-13-01', 'tomorrow', 20310401])
+def test_update_task_time_rejects_invalid_date(client, due_date):
+    task_id = create_timed_task(client, '无效日期', '2031-05-01', '09:00', '10:00')
+    response = client.put(f'/api/tasks/{task_id}/time', json={'due_date': due_date, 'start_time': '09:00'})
+    assert response.status_code == 400
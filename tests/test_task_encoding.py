@@ -0,0 +1,58 @@
+import pytest
+
+from task_encoding import TASK_DEFAULT_FIELDS, TaskEncoder, parse_fields, parse_format
+
+def test_parse_fields():
+    assert parse_fields(None, ['id']) == ['id']
+    assert parse_fields(' title, id ,title,', ['id']) == ['title', 'id']
+    with pytest.raises(ValueError):
+        parse_fields('id,password_hash', ['id'])
+    with pytest.raises(ValueError):
+        parse_fields(',', ['id'])
+
+def test_parse_format():
+    assert parse_format(None) == 'objects'
+    assert parse_format('columnar') == 'columnar'
+    with pytest.raises(ValueError):
+        parse_format('csv')
+
+def test_encoder_objects_and_columnar():
+    row = (7, '周会', 1, 'extra')
+    objects = TaskEncoder(['id', 'title', 'completed'])
+    assert objects.encode(row) == {'id': 7, 'title': '周会', 'completed': True}
+
+    columnar = TaskEncoder(['id', 'title', 'completed'], columnar=True, extra_columns=('occurrence_date',))
+    assert columnar.columns == ['id', 'title', 'completed', 'occurrence_date']
+    assert columnar.encode(row) == [7, '周会', True, None]
+    assert columnar.encode(row, completed=False, occurrence_date='2025-01-06') == [7, '周会', False, '2025-01-06']
+    assert columnar.wrap([[7]]) == {'columns': columnar.columns, 'rows': [[7]]}
+    assert objects.wrap([{'id': 7}]) == [{'id': 7}]
+
+def test_tasks_fields_and_columnar(client):
+    client.post('/api/tasks', json={'title': '编码测试', 'description': '列式', 'is_important': True})
+    objects = client.get('/api/tasks').get_json()
+    assert set(objects[0]) == set(TASK_DEFAULT_FIELDS)
+
+    projected = client.get('/api/tasks?fields=id,title').get_json()
+    assert all(set(task) == {'id', 'title'} for task in projected)
+
+    columnar = client.get('/api/tasks?format=columnar').get_json()
+    assert columnar['columns'] == TASK_DEFAULT_FIELDS
+    assert [dict(zip(columnar['columns'], row)) for row in columnar['rows']] == objects
+
+@pytest.mark.parametrize('path', ['/api/tasks?fields=nope', '/api/tasks?format=xml',
+                                  '/api/search?q=a&fields=nope', '/api/calendar/week?fields=nope'])
+def test_rejects_invalid_encoding_arguments(client, path):
+    assert client.get(path).status_code == 400
+
+def test_search_list_fields(client):
+    client.post('/api/tasks', json={'title': '编码搜索'})
+    results = client.get('/api/search?q=编码搜索&fields=title,list_name&format=columnar').get_json()
+    assert results['columns'] == ['title', 'list_name']
+    assert [row[0] for row in results['rows']] == ['编码搜索']
+
+def test_calendar_week_columnar_occurrences(client):
+    client.post('/api/tasks', json={'title': '编码-每周', 'due_date': '2033-01-03', 'recurrence_rule': 'FREQ=WEEKLY'})
+    data = client.get('/api/calendar/week?week_start=2033-01-10&format=columnar&fields=title,completed').get_json()
+    assert data['columns'] == ['title', 'completed', 'recurrence_rule', 'occurrence_date']
+    assert data['days'][0]['tasks'] == [['编码-每周', False, 'FREQ=WEEKLY', '2033-01-10']]
@@ -0,0 +1,61 @@
+import sqlite3
+
+import pytest
+
+import task_index
+from task_index import TaskSimilarityIndex, extract_ngrams
+
+def build(*tasks):
+    index = TaskSimilarityIndex()
+    for task_id, title in tasks:
+        index.upsert(task_id, title, '')
+    return index
+
+def test_extract_ngrams_normalizes_text():
+    assert extract_ngrams('  AB\tc ') == [' a', 'ab', 'b ', ' c', 'c ', ' ab', 'ab ', 'b c', ' c ']
+    assert extract_ngrams(None) == []
+
+def test_query_ranks_by_similarity():
+    index = build((1, '提交季度财务报告'), (2, '季度财务报告评审'), (3, '买牛奶'))
+    results = index.query('财务报告', top_k=3)
+    assert {task_id for task_id, _ in results} == {1, 2}
+    assert all(0 < score <= 1.0001 for _, score in results)
+    assert index.query('提交季度财务报告')[0][0] == 1
+    assert index.query('完全无关的内容') == []
+    assert [task_id for task_id, _ in index.query('财务报告', exclude_ids={1})] == [2]
+
+def test_upsert_replaces_previous_text():
+    index = build((1, '写周报'), (2, '买牛奶'))
+    index.upsert(1, '修理自行车', '')
+    assert len(index) == 2
+    assert index.query('写周报') == []
+    assert index.query('修理自行车')[0][0] == 1
+
+def test_remove_and_compact_keep_results():
+    index = build(*((task_id, f'临时任务{task_id}号 草稿') for task_id in range(1, 40)), (100, '准备年度预算'))
+    before = index.query('年度预算')
+    for task_id in range(1, 40):
+        index.remove(task_id)
+    vocab_size = len(index._vocab)
+    index.compact()
+    assert len(index._vocab) < vocab_size
+    assert set(index._vocab) == set(extract_ngrams('准备年度预算 '))
+    assert index.query('年度预算') == pytest.approx(before)
+    assert index.query('临时任务') == []
+
+def test_user_indexes_are_evicted_least_recently_used(monkeypatch):
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE tasks (id INTEGER, user_id INTEGER, title TEXT, description TEXT)')
+    conn.execute("INSERT INTO tasks VALUES (1, -1, '季度财务报告', NULL)")
+    monkeypatch.setattr(task_index, '_indexes', task_index.OrderedDict())
+    monkeypatch.setattr(task_index, 'TASK_INDEX_MAX_USERS', 2)
+    for user_id in (-1, -2, -1, -3):
+        task_index.get_user_index(user_id, conn)
+    assert list(task_index._indexes) == [-1, -3]
+    assert task_index.find_similar_tasks(-1, '财务报告', conn)[0][0] == 1
+
+def test_duplicate_check_sees_updated_titles(client):
+    task_id = client.post('/api/tasks', json={'title': '整理发票报销材料'}).get_json()['id']
+    client.put(f'/api/tasks/{task_id}', json={'title': '预约体检'})
+    response = client.post('/api/tasks', json={'title': '预约体检'})
+    assert task_id in [item['id'] for item in response.get_json().get('similar_tasks', [])]
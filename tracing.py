@@ -0,0 +1,230 @@
+import functools
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from urllib.parse import urlsplit
+from memory_monitor import register_cache
+
+# 默认配置，可通过环境变量覆盖
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.01'))
+TRACE_SLOW_MS = float(os.environ.get('TRACE_SLOW_MS', '500'))
+TRACE_BUFFER_SIZE = int(os.environ.get('TRACE_BUFFER_SIZE', '100'))
+TRACE_DIR = os.environ.get('TRACE_DIR', 'logs')
+# 单个追踪最多保留的span数，超出部分只计数
+TRACE_MAX_SPANS = 1000
+
+_trace_id_pattern = re.compile(r'^[0-9a-fA-F-]{8,64}$')
+
+class Trace:
+    """一次请求的追踪记录，span按开始时间记录相对偏移"""
+
+    def __init__(self, name, trace_id=None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.name = name
+        self.started_at = datetime.now()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.attributes = {}
+        self.spans = []
+        self.dropped_spans = 0
+        self._stack = []
+        self._next_id = 1
+
+    def _offset_ms(self, moment):
+        return round((moment - self.started) * 1000, 3)
+
+    def add_span(self, name, started, duration, attributes=None, parent=None):
+        """记录一个已结束的span，返回span ID"""
+        if len(self.spans) >= TRACE_MAX_SPANS:
+            self.dropped_spans += 1
+            return None
+        span_id = self._next_id
+        self._next_id += 1
+        self.spans.append({
+            'id': span_id,
+            'parent': parent if parent is not None else (self._stack[-1] if self._stack else None),
+            'name': name,
+            'start_ms': self._offset_ms(started),
+            'duration_ms': round(duration * 1000, 3),
+            'attributes': attributes or {}
+        })
+        return span_id
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': round((self.duration or 0) * 1000, 3),
+            'attributes': self.attributes,
+            'spans': sorted(self.spans, key=lambda span: span['start_ms']),
+            'dropped_spans': self.dropped_spans
+        }
+
+    def summary(self):
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': round((self.duration or 0) * 1000, 3),
+            'status': self.attributes.get('status'),
+            'span_count': len(self.spans)
+        }
+
+_local = threading.local()
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+def current_trace_id():
+    trace = current_trace()
+    return trace.trace_id if trace else None
+
+def start_trace(name, trace_id=None):
+    """开始当前线程的追踪；传入的trace_id格式不合法时重新生成"""
+    if trace_id and not _trace_id_pattern.match(trace_id):
+        trace_id = None
+    trace = Trace(name, trace_id)
+    _local.trace = trace
+    return trace
+
+class _Span:
+    """span上下文管理器，未处于追踪中时不做任何记录"""
+
+    __slots__ = ('name', 'attributes', 'trace', 'started', 'span_id')
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.trace = current_trace()
+        if self.trace is None:
+            return self
+        self.started = time.perf_counter()
+        # 先占位，结束时补全耗时，子span可引用该ID
+        self.span_id = self.trace.add_span(self.name, self.started, 0, self.attributes)
+        if self.span_id is not None:
+            self.trace._stack.append(self.span_id)
+        return self
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.trace is None or self.span_id is None:
+            return False
+        self.trace._stack.pop()
+        for span in reversed(self.trace.spans):
+            if span['id'] == self.span_id:
+                span['duration_ms'] = round((time.perf_counter() - self.started) * 1000, 3)
+                if exc_type is not None:
+                    span['attributes']['error'] = exc_type.__name__
+                break
+        return False
+
+def span(name, **attributes):
+    """创建嵌套span：with span('ai.call', model=...) as s: ..."""
+    return _Span(name, attributes)
+
+def traced(name=None):
+    """把函数调用记录为span的装饰器"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if current_trace() is None:
+                return func(*args, **kwargs)
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_statement(connection, sql, parameters, duration):
+    """SQL语句监听器：为当前追踪添加数据库span"""
+    trace = current_trace()
+    if trace is None:
+        return
+    from sql_profiler import normalize_sql
+    trace.add_span('db.statement', time.perf_counter() - duration, duration,
+                   {'sql': normalize_sql(sql)[:300], 'many': parameters is None})
+
+def instrument_requests():
+    """为requests库的出站HTTP调用自动添加span"""
+    import requests
+    original = requests.Session.request
+    if getattr(original, '_traced', False):
+        return
+
+    @functools.wraps(original)
+    def request(self, method, url, *args, **kwargs):
+        if current_trace() is None:
+            return original(self, method, url, *args, **kwargs)
+        parts = urlsplit(url)
+        with span('http.client', method=method.upper(), host=parts.netloc, path=parts.path) as http_span:
+            response = original(self, method, url, *args, **kwargs)
+            http_span.set('status', response.status_code)
+            return response
+
+    request._traced = True
+    requests.Session.request = request
+
+class TraceStore:
+    """保留慢追踪的内存缓冲区，并把抽样和慢追踪导出为JSON Lines"""
+
+    def __init__(self, sample_rate=TRACE_SAMPLE_RATE, slow_ms=TRACE_SLOW_MS,
+                 buffer_size=TRACE_BUFFER_SIZE, directory=TRACE_DIR):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.directory = directory
+        self._buffer = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+
+    def finish(self, trace):
+        """结束追踪：慢追踪进入缓冲区，慢追踪和抽样追踪写入文件"""
+        trace.duration = time.perf_counter() - trace.started
+        slow = trace.duration * 1000 >= self.slow_ms
+        if slow:
+            with self._lock:
+                self._buffer.append(trace)
+        if slow or random.random() < self.sample_rate:
+            self._export(trace)
+
+    def _export(self, trace):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"traces-{datetime.now().strftime('%Y%m%d')}.jsonl")
+        line = json.dumps(trace.to_dict(), ensure_ascii=False, separators=(',', ':'), default=str) + '\n'
+        with self._lock:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    def recent(self, min_ms=0):
+        with self._lock:
+            traces = list(self._buffer)
+        return [trace.summary() for trace in reversed(traces) if trace.duration * 1000 >= min_ms]
+
+    def get(self, trace_id):
+        with self._lock:
+            for trace in self._buffer:
+                if trace.trace_id == trace_id:
+                    return trace.to_dict()
+        return None
+
+store = TraceStore()
+register_cache('slow_traces', lambda: store._buffer)
+
+def end_trace():
+    """结束并清除当前线程的追踪"""
+    trace = current_trace()
+    if trace is None:
+        return None
+    _local.trace = None
+    store.finish(trace)
+    return trace
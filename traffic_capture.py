@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+流量录制与回放 - 录制脱敏后的真实请求序列，回放到本地实例并对比延迟
+
+录制默认关闭，设置 TRAFFIC_CAPTURE=1 开启；按用户分桶抽样（TRAFFIC_CAPTURE_SAMPLE_RATE），
+同一用户的请求序列完整保留。请求体只保存结构：自由文本替换为长度占位符，ID替换为类型占位符。
+查看流量构成: python traffic_capture.py summary logs/traffic-20250101.ndjson
+回放:         python traffic_capture.py replay logs/traffic-20250101.ndjson --base-url http://127.0.0.1:5000 --speed 2
+"""
+
+import argparse
+import atexit
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+
+CAPTURE_ENABLED = os.environ.get('TRAFFIC_CAPTURE', '').lower() in ('1', 'true', 'yes')
+CAPTURE_DIR = os.environ.get('TRAFFIC_CAPTURE_DIR', 'logs')
+CAPTURE_SAMPLE_RATE = float(os.environ.get('TRAFFIC_CAPTURE_SAMPLE_RATE', '1.0'))
+CAPTURE_SALT = os.environ.get('TRAFFIC_CAPTURE_SALT', '')
+USER_BUCKETS = 1000
+
+# 缓冲的记录数达到该值或距上次写盘超过间隔时写盘
+FLUSH_RECORDS = 200
+FLUSH_INTERVAL = 5
+
+# 值为ID的字段及其类型，回放时替换为目标实例上同一用户的对应ID
+ID_FIELDS = {'id': 'task', 'task_id': 'task', 'list_id': 'list', 'default_list_id': 'list'}
+# 可以原样保留的枚举类字段
+ENUM_FIELDS = {'priority', 'granularity', 'status', 'format', 'theme', 'language', 'view_mode',
+               'font_size', 'accent_color', 'show_completed', 'remember', 'sort'}
+# 回放时默认跳过的路由（会改变账号或全局配置）
+DEFAULT_SKIP = {('POST', '/api/auth/register'), ('POST', '/api/auth/logout'), ('GET', '/logout'),
+                ('PUT', '/api/ai/config'), ('DELETE', '/api/ai/history')}
+
+_date_pattern = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+_time_pattern = re.compile(r'^\d{2}:\d{2}(:\d{2})?$')
+_cjk_pattern = re.compile(r'[㐀-鿿]')
+_placeholder_pattern = re.compile(r'^<(str|cjk):(\d+)>$')
+
+def user_bucket(user_id):
+    """把用户ID映射为稳定的匿名分桶"""
+    if user_id is None:
+        return None
+    digest = hashlib.sha1(f'{CAPTURE_SALT}:{user_id}'.encode('utf-8')).hexdigest()
+    return int(digest[:8], 16) % USER_BUCKETS
+
+def shape(value, key=None):
+    """提取JSON值的结构，去掉可能含个人信息的文本"""
+    if isinstance(value, dict):
+        return {k: shape(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [shape(item, key) for item in value]
+    if key in ID_FIELDS and value not in (None, ''):
+        return f'<{ID_FIELDS[key]}_id>'
+    if isinstance(value, str):
+        if _date_pattern.match(value) or _time_pattern.match(value):
+            return value
+        if key in ENUM_FIELDS and len(value) <= 32:
+            return value
+        kind = 'cjk' if _cjk_pattern.search(value) else 'str'
+        return f'<{kind}:{len(value)}>'
+    return value
+
+class TrafficRecorder:
+    """把请求摘要缓冲后追加写入按天切分的NDJSON文件"""
+
+    def __init__(self, directory=CAPTURE_DIR, sample_rate=CAPTURE_SAMPLE_RATE):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._last_flush = time.time()
+
+    def should_record(self, bucket):
+        """按用户分桶抽样，匿名请求按请求随机抽样"""
+        if bucket is None:
+            return random.random() < self.sample_rate
+        return bucket < self.sample_rate * USER_BUCKETS
+
+    def record(self, request, response, user_id, duration):
+        """记录一次请求（在after_request中调用）"""
+        if request.url_rule is None or request.endpoint == 'static':
+            return
+        bucket = user_bucket(user_id)
+        if not self.should_record(bucket):
+            return
+
+        entry = {
+            't': round(time.time() * 1000),
+            'm': request.method,
+            'r': request.url_rule.rule,
+            'u': bucket,
+            's': response.status_code,
+            'd': round(duration * 1000, 3)
+        }
+        if request.view_args:
+            entry['a'] = shape(request.view_args)
+        if request.args:
+            entry['q'] = shape(request.args.to_dict())
+        if request.is_json:
+            body = request.get_json(silent=True)
+            if body is not None:
+                entry['b'] = shape(body)
+        if not response.is_streamed:
+            entry['n'] = response.calculate_content_length()
+
+        with self._lock:
+            self._buffer.append(entry)
+            due = len(self._buffer) >= FLUSH_RECORDS or time.time() - self._last_flush >= FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            entries, self._buffer = self._buffer, []
+            self._last_flush = time.time()
+        if not entries:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"traffic-{datetime.now().strftime('%Y%m%d')}.ndjson")
+        lines = ''.join(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n'
+                        for entry in entries)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+
+recorder = TrafficRecorder() if CAPTURE_ENABLED else None
+if recorder:
+    atexit.register(recorder.flush)
+
+def load_records(path):
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    records.sort(key=lambda entry: entry['t'])
+    return records
+
+FILLER_EN = 'review the weekly report and plan next steps '
+FILLER_CJK = '整理本周项目报告并安排下一步计划'
+
+def _filler(kind, length):
+    source = FILLER_CJK if kind == 'cjk' else FILLER_EN
+    return (source * (length // len(source) + 1))[:length]
+
+class ReplayUser:
+    """目标实例上与某个分桶对应的已登录用户"""
+
+    def __init__(self, username, session, task_ids, list_ids):
+        self.username = username
+        self.session = session
+        self.task_ids = task_ids or [0]
+        self.list_ids = list_ids or [0]
+
+def materialize(value, user, rng):
+    """把结构占位符还原为可发送的值"""
+    if isinstance(value, dict):
+        return {k: materialize(v, user, rng) for k, v in value.items()}
+    if isinstance(value, list):
+        return [materialize(item, user, rng) for item in value]
+    if value == '<task_id>':
+        return rng.choice(user.task_ids)
+    if value == '<list_id>':
+        return rng.choice(user.list_ids)
+    if isinstance(value, str):
+        match = _placeholder_pattern.match(value)
+        if match:
+            return _filler(match.group(1), int(match.group(2)))
+    return value
+
+def build_path(rule, args):
+    """按路由模板和参数拼出请求路径"""
+    def replace(match):
+        return str(args.get(match.group(2), ''))
+    return re.sub(r'<(?:(\w+):)?(\w+)>', replace, rule)
+
+class Replayer:
+    """按录制时的时间间隔（可缩放）把请求重放到目标实例"""
+
+    def __init__(self, base_url, password, user_format, user_count, workers, seed, skip):
+        import requests
+        self._requests = requests
+        self.base_url = base_url.rstrip('/')
+        self.password = password
+        self.user_format = user_format
+        self.user_count = user_count
+        self.workers = workers
+        self.rng = random.Random(seed)
+        self.skip = skip
+        self.users = {}
+        self._lock = threading.Lock()
+
+    def user_for(self, bucket):
+        """分桶到目标用户的映射，首次使用时登录并加载该用户的任务和列表ID"""
+        key = 0 if bucket is None else bucket % self.user_count
+        with self._lock:
+            user = self.users.get(key)
+        if user:
+            return user
+        username = self.user_format.format(key + 1)
+        session = self._requests.Session()
+        session.post(f'{self.base_url}/api/auth/login', json={'username': username, 'password': self.password})
+        task_ids = [task['id'] for task in session.get(f'{self.base_url}/api/tasks').json() or []] \
+            if bucket is not None else []
+        list_ids = [item['id'] for item in session.get(f'{self.base_url}/api/task_lists').json() or []] \
+            if bucket is not None else []
+        user = ReplayUser(username, session, task_ids, list_ids)
+        with self._lock:
+            self.users.setdefault(key, user)
+        return self.users[key]
+
+    def prepare(self, records):
+        """预先登录所有涉及的用户，避免登录耗时混入回放计时"""
+        for bucket in {entry.get('u') for entry in records}:
+            try:
+                self.user_for(bucket)
+            except (self._requests.RequestException, ValueError) as e:
+                print(f'准备回放用户失败（分桶 {bucket}）: {e}')
+
+    def send(self, entry):
+        user = self.user_for(entry.get('u'))
+        rng = random.Random(self.rng.random())
+        path = build_path(entry['r'], materialize(entry.get('a') or {}, user, rng))
+        params = materialize(entry.get('q'), user, rng)
+        body = materialize(entry.get('b'), user, rng)
+        session = user.session
+        if entry['r'] == '/api/auth/login':
+            # 登录请求使用独立会话和回放用户的凭据，不影响已登录会话
+            session = self._requests.Session()
+            body = {'username': user.username, 'password': self.password}
+        started = time.perf_counter()
+        try:
+            response = session.request(entry['m'], self.base_url + path, params=params, json=body)
+            response.content
+            status = response.status_code
+        except self._requests.RequestException:
+            status = 0
+        return entry, time.perf_counter() - started, status
+
+    def replay(self, records, speed):
+        """speed为0时不等待，尽快发送；否则按录制间隔除以speed调度"""
+        records = [entry for entry in records if (entry['m'], entry['r']) not in self.skip]
+        self.prepare(records)
+        results = []
+        futures = []
+        origin = records[0]['t'] if records else 0
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for entry in records:
+                if speed:
+                    delay = (entry['t'] - origin) / 1000 / speed - (time.perf_counter() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+                futures.append(pool.submit(self.send, entry))
+            for future in futures:
+                results.append(future.result())
+        return results, time.perf_counter() - started
+
+def _percentile(values, q):
+    return round(float(np.percentile(values, q)), 3) if values else None
+
+def _delta(old, new):
+    if not old or new is None:
+        return None
+    return round((new - old) / old * 100, 1)
+
+def compare_latencies(results):
+    """按路由汇总录制与回放的延迟分位数及变化百分比"""
+    grouped = {}
+    for entry, elapsed, status in results:
+        item = grouped.setdefault((entry['m'], entry['r']), {'captured': [], 'replayed': [], 'errors': 0,
+                                                             'status_changed': 0})
+        item['captured'].append(entry.get('d', 0))
+        item['replayed'].append(elapsed * 1000)
+        if status == 0 or status >= 500:
+            item['errors'] += 1
+        if status != entry.get('s'):
+            item['status_changed'] += 1
+
+    report = []
+    for (method, rule), item in grouped.items():
+        row = {'method': method, 'route': rule, 'count': len(item['replayed']),
+               'errors': item['errors'], 'status_changed': item['status_changed']}
+        for q in (50, 95):
+            captured = _percentile(item['captured'], q)
+            replayed = _percentile(item['replayed'], q)
+            row[f'captured_p{q}_ms'] = captured
+            row[f'replayed_p{q}_ms'] = replayed
+            row[f'delta_p{q}_pct'] = _delta(captured, replayed)
+        report.append(row)
+    report.sort(key=lambda row: row['count'], reverse=True)
+    return report
+
+def format_report(report):
+    lines = [f"{'请求数':>6} {'错误':>4} {'状态变化':>6} {'录制p50':>9} {'回放p50':>9} {'变化':>8} "
+             f"{'录制p95':>9} {'回放p95':>9} {'变化':>8}  路由"]
+    for row in report:
+        def pct(value):
+            return f'{value:+.1f}%' if value is not None else '-'
+        lines.append(f"{row['count']:>6} {row['errors']:>4} {row['status_changed']:>8} "
+                     f"{row['captured_p50_ms']:>9.2f} {row['replayed_p50_ms']:>9.2f} {pct(row['delta_p50_pct']):>8} "
+                     f"{row['captured_p95_ms']:>9.2f} {row['replayed_p95_ms']:>9.2f} {pct(row['delta_p95_pct']):>8}  "
+                     f"{row['method']} {row['route']}")
+    return '\n'.join(lines)
+
+def summarize_records(records):
+    """流量构成：各路由请求数占比和录制延迟"""
+    counts = {}
+    for entry in records:
+        counts.setdefault((entry['m'], entry['r']), []).append(entry.get('d', 0))
+    total = len(records)
+    span = (records[-1]['t'] - records[0]['t']) / 1000 if len(records) > 1 else 0
+    lines = [f"共 {total} 个请求，{len({e.get('u') for e in records})} 个用户分桶，时长 {span:.0f}s"]
+    for (method, rule), durations in sorted(counts.items(), key=lambda item: len(item[1]), reverse=True):
+        lines.append(f"{len(durations):>8} {len(durations) / total:>7.1%} p50 {_percentile(durations, 50):>8.2f}ms  "
+                     f"{method} {rule}")
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description='流量录制文件查看与回放')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    summary_parser = subparsers.add_parser('summary', help='查看录制文件的流量构成')
+    summary_parser.add_argument('file')
+
+    replay_parser = subparsers.add_parser('replay', help='回放到本地实例并对比延迟')
+    replay_parser.add_argument('file')
+    replay_parser.add_argument('--base-url', default='http://127.0.0.1:5000', help='目标实例地址')
+    replay_parser.add_argument('--speed', type=float, default=1.0, help='回放倍速（0为不等待）')
+    replay_parser.add_argument('--workers', type=int, default=16, help='并发线程数')
+    replay_parser.add_argument('--users', type=int, default=1000, help='目标实例上可用的用户数')
+    replay_parser.add_argument('--user-format', default='user{}', help='目标用户名格式（与generate_data.py一致）')
+    replay_parser.add_argument('--password', default='password123', help='目标用户密码')
+    replay_parser.add_argument('--limit', type=int, help='只回放前N个请求')
+    replay_parser.add_argument('--seed', type=int, default=1, help='ID替换的随机种子')
+    replay_parser.add_argument('--include-all', action='store_true', help='不跳过注册、登出、修改AI配置等请求')
+    replay_parser.add_argument('--output', help='把对比结果写入JSON文件')
+    args = parser.parse_args()
+
+    records = load_records(args.file)
+    if not records:
+        print(f'录制文件为空: {args.file}')
+        return
+
+    if args.command == 'summary':
+        print(summarize_records(records))
+        return
+
+    if args.limit:
+        records = records[:args.limit]
+    replayer = Replayer(args.base_url, args.password, args.user_format, args.users, args.workers,
+                        args.seed, set() if args.include_all else DEFAULT_SKIP)
+    results, elapsed = replayer.replay(records, args.speed)
+    report = compare_latencies(results)
+    print(f'回放 {len(results)} 个请求，耗时 {elapsed:.1f}s')
+    print(format_report(report))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'file': os.path.basename(args.file), 'speed': args.speed, 'elapsed': round(elapsed, 3),
+                       'routes': report}, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()